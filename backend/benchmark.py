@@ -0,0 +1,373 @@
+#!/usr/bin/env python
+"""
+Load test and latency benchmark for the API.
+
+Seeds a dedicated database with a configurable number of stories and
+ratings, then drives a mixed workload (generate, history, trending, get,
+rate, share) at a fixed concurrency against the app in-process, or against
+a running server with --url. Story generation uses the deterministic local
+LLM provider, so results measure our code rather than the model. A --url
+server must therefore be started with LLM_PROVIDER=local (its
+LOCAL_LLM_* settings apply, not --llm-*) and serve --database; the
+benchmark refuses to run against one that reports another provider.
+
+Per-endpoint throughput and p50/p95/p99 latencies are printed and written
+to a JSON file; pass an earlier file with --compare to see the difference.
+
+    python benchmark.py --stories 100000 --ratings 2000000 --concurrency 32 --requests 20000
+    python benchmark.py --skip-seed --compare bench-before.json --output bench-after.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+import httpx
+
+WORKLOAD = {
+    # endpoint name -> relative weight in the mix
+    "generate": 2,
+    "history": 18,
+    "trending": 20,
+    "get": 30,
+    "rate": 20,
+    "share": 4,
+    "shared": 6,
+}
+
+SEED_BATCH_SIZE = 5000
+
+_WORDS = (
+    "the wand flickered as the council gathered beneath ancient stars while a storm rolled toward "
+    "the castle and every promise of the old kingdom hung on one impossible choice"
+).split()
+
+def percentile(samples: list, pct: float) -> float:
+    """Nearest-rank percentile of ``samples`` (0 for an empty list)"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(1, int(round(pct / 100 * len(ordered))))
+    return ordered[min(rank, len(ordered)) - 1]
+
+# Seeding
+
+def _rating_stream(stories: int, ratings: int, seed: int):
+    """Deterministic (story_id, rating_value) pairs, skewed toward popular stories"""
+    rng = random.Random(seed)
+    for _ in range(ratings):
+        yield int(stories * rng.random() ** 2) + 1, rng.choice((1, 2, 3, 3, 4, 4, 4, 5, 5, 5))
+
+def seed_database(engine, stories: int, ratings: int, story_words: int = 300,
+                  share_fraction: float = 0.2, seed: int = 1) -> dict:
+    """Replace all stories and ratings with a synthetic data set.
+
+    Rows go in through batched core INSERTs; the denormalized aggregates are
+    computed up front so they match the ratings exactly without replaying
+    the per-rating mapper events.
+    """
+    from sqlalchemy import delete, insert
+    from database import (
+        Story, Rating, GenerationJob, TRENDING_PRIOR_MEAN, TRENDING_PRIOR_WEIGHT, clear_search_index, index_stories,
+    )
+    from story_generator import UNIVERSES
+    import story_codec
+
+    started = time.perf_counter()
+    universes = list(UNIVERSES)
+    rating_sum = [0] * (stories + 1)
+    rating_count = [0] * (stories + 1)
+    stars = {value: [0] * (stories + 1) for value in range(1, 6)}
+    for story_id, value in _rating_stream(stories, ratings, seed):
+        rating_sum[story_id] += value
+        rating_count[story_id] += 1
+        stars[value][story_id] += 1
+
+    rng = random.Random(seed)
+    texts = [" ".join(rng.choice(_WORDS) for _ in range(story_words)) for _ in range(16)]
+    # Stored the way the app writes them (compressed unless STORY_COMPRESSION=none)
+    bodies = [dict(zip(("story", "story_codec", "story_blob"), story_codec.encode(text))) for text in texts]
+    now = datetime.utcnow()
+
+    with engine.begin() as connection:
+        connection.execute(delete(GenerationJob))
+        connection.execute(delete(Rating))
+        connection.execute(delete(Story))
+        clear_search_index(connection)
+
+    for start in range(1, stories + 1, SEED_BATCH_SIZE):
+        rows = []
+        for story_id in range(start, min(start + SEED_BATCH_SIZE, stories + 1)):
+            rows.append({
+                "id": story_id,
+                "universe": universes[story_id % len(universes)],
+                "what_if": f"What if benchmark scenario {story_id} went differently?",
+                **bodies[story_id % len(bodies)],
+                "word_count": story_words,
+                "rating": 0,
+                "is_public": True,
+                "share_token": f"bench{story_id:011d}" if rng.random() < share_fraction else None,
+                "created_at": now - timedelta(seconds=(stories - story_id) * 60),
+                "rating_sum": rating_sum[story_id],
+                "rating_count": rating_count[story_id],
+                **{f"stars_{value}": stars[value][story_id] for value in range(1, 6)},
+                "trending_score": (
+                    (TRENDING_PRIOR_WEIGHT * TRENDING_PRIOR_MEAN + rating_sum[story_id])
+                    / (TRENDING_PRIOR_WEIGHT + rating_count[story_id])
+                ),
+            })
+        with engine.begin() as connection:
+            connection.execute(insert(Story), rows)
+            index_stories(connection, [
+                {"id": row["id"], "what_if": row["what_if"], "story": texts[row["id"] % len(texts)]} for row in rows
+            ])
+
+    batch = []
+    for n, (story_id, value) in enumerate(_rating_stream(stories, ratings, seed)):
+        batch.append({"story_id": story_id, "session_id": f"seed-{n}", "rating_value": value,
+                      "created_at": now, "updated_at": now})
+        if len(batch) >= SEED_BATCH_SIZE:
+            with engine.begin() as connection:
+                connection.execute(insert(Rating), batch)
+            batch = []
+    if batch:
+        with engine.begin() as connection:
+            connection.execute(insert(Rating), batch)
+
+    return {"stories": stories, "ratings": ratings, "seconds": round(time.perf_counter() - started, 2)}
+
+def load_targets(engine, sample_size: int = 10000) -> dict:
+    """Story ids and share tokens the workload can address"""
+    from sqlalchemy import func, select
+    from database import Story
+
+    with engine.connect() as connection:
+        max_id = connection.execute(select(func.max(Story.id))).scalar() or 0
+        tokens = connection.execute(
+            select(Story.share_token).where(Story.share_token.isnot(None)).limit(sample_size)
+        ).scalars().all()
+    return {"max_id": max_id, "share_tokens": list(tokens)}
+
+# Workload
+
+class Recorder:
+    """Collects latencies and failures per endpoint"""
+
+    def __init__(self):
+        self.latencies = {name: [] for name in WORKLOAD}
+        self.errors = {name: 0 for name in WORKLOAD}
+
+    def record(self, name: str, seconds: float, ok: bool):
+        self.latencies[name].append(seconds)
+        if not ok:
+            self.errors[name] += 1
+
+    def report(self, wall_seconds: float) -> dict:
+        endpoints = {}
+        for name, samples in self.latencies.items():
+            if not samples:
+                continue
+            endpoints[name] = {
+                "requests": len(samples),
+                "errors": self.errors[name],
+                "throughput_rps": round(len(samples) / wall_seconds, 1),
+                "mean_ms": round(sum(samples) / len(samples) * 1000, 2),
+                "p50_ms": round(percentile(samples, 50) * 1000, 2),
+                "p95_ms": round(percentile(samples, 95) * 1000, 2),
+                "p99_ms": round(percentile(samples, 99) * 1000, 2),
+                "max_ms": round(max(samples) * 1000, 2),
+            }
+        everything = [s for samples in self.latencies.values() for s in samples]
+        total = {
+            "requests": len(everything),
+            "errors": sum(self.errors.values()),
+            "seconds": round(wall_seconds, 2),
+            "throughput_rps": round(len(everything) / wall_seconds, 1) if wall_seconds else 0,
+            "p50_ms": round(percentile(everything, 50) * 1000, 2),
+            "p95_ms": round(percentile(everything, 95) * 1000, 2),
+            "p99_ms": round(percentile(everything, 99) * 1000, 2),
+        }
+        return {"endpoints": endpoints, "total": total}
+
+async def _call(client: httpx.AsyncClient, name: str, rng: random.Random, targets: dict, state: dict):
+    """Issue one request of kind ``name``; returns True on success"""
+    from story_generator import UNIVERSES
+
+    story_id = int(targets["max_id"] * rng.random() ** 2) + 1
+    if name == "generate":
+        response = await client.post("/story/generate", json={
+            "universe": rng.choice(list(UNIVERSES)),
+            "what_if": f"What if scenario {rng.randrange(1000)} happened?",
+            "length": "short"
+        })
+    elif name == "history":
+        cursor = state.get("cursor") if rng.random() < 0.5 else None
+        response = await client.get("/story/history", params={"limit": 20, **({"cursor": cursor} if cursor else {})})
+        if response.status_code == 200:
+            state["cursor"] = response.json().get("next_cursor")
+    elif name == "trending":
+        params = {"limit": 10}
+        if rng.random() < 0.5:
+            params["universe"] = rng.choice(list(UNIVERSES))
+        response = await client.get("/story/trending", params=params)
+    elif name == "get":
+        response = await client.get(f"/story/{story_id}")
+    elif name == "rate":
+        response = await client.post(f"/story/{story_id}/rate", json={
+            "rating": rng.randint(1, 5),
+            "session_id": f"bench-{rng.randrange(50000)}"
+        })
+    elif name == "share":
+        response = await client.post(f"/story/{story_id}/share")
+    else:
+        if not targets["share_tokens"]:
+            response = await client.get(f"/story/{story_id}")
+        else:
+            response = await client.get(f"/story/share/{rng.choice(targets['share_tokens'])}")
+    return response.status_code < 400
+
+async def run_workload(client: httpx.AsyncClient, targets: dict, concurrency: int = 16,
+                       requests: int = 2000, seed: int = 1) -> dict:
+    """Drive the weighted endpoint mix with ``concurrency`` workers until ``requests`` are done"""
+    recorder = Recorder()
+    names = list(WORKLOAD)
+    weights = [WORKLOAD[name] for name in names]
+    remaining = [requests]
+
+    async def worker(index: int):
+        rng = random.Random(seed * 1000 + index)
+        state = {}
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            name = rng.choices(names, weights)[0]
+            started = time.perf_counter()
+            try:
+                ok = await _call(client, name, rng, targets, state)
+            except httpx.HTTPError:
+                ok = False
+            recorder.record(name, time.perf_counter() - started, ok)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    return recorder.report(time.perf_counter() - started)
+
+# Reporting
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def print_report(result: dict, baseline: dict = None):
+    header = f"{'endpoint':<10}{'requests':>10}{'errors':>8}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    print(header)
+    print("-" * len(header))
+    rows = list(result["endpoints"].items()) + [("TOTAL", result["total"])]
+    for name, stats in rows:
+        line = (f"{name:<10}{stats['requests']:>10}{stats['errors']:>8}{stats['throughput_rps']:>10}"
+                f"{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}")
+        before = (baseline or {}).get("endpoints", {}).get(name) if name != "TOTAL" else (baseline or {}).get("total")
+        if before and before.get("p95_ms"):
+            change = (stats["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100
+            line += f"   p95 {change:+.1f}% vs {baseline['meta']['commit']}"
+        print(line)
+
+async def _run_in_process(args, targets: dict) -> dict:
+    from main import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            return await run_workload(client, targets, args.concurrency, args.requests, args.seed)
+
+async def check_remote_provider(client: httpx.AsyncClient):
+    """Exit unless the server generates with the local provider, so generate requests never reach a real model"""
+    response = await client.get("/debug/generation")
+    response.raise_for_status()
+    provider = response.json().get("llm_provider")
+    if provider != "local":
+        sys.exit(f"❌ {client.base_url} uses the '{provider}' LLM provider; start it with LLM_PROVIDER=local")
+
+async def _run_remote(args, targets: dict) -> dict:
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=60) as client:
+        await check_remote_provider(client)
+        return await run_workload(client, targets, args.concurrency, args.requests, args.seed)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--database", default="sqlite:///./bench.db", help="database URL to seed and serve from")
+    parser.add_argument("--url", help="benchmark a running server (started with LLM_PROVIDER=local) instead of the app in-process")
+    parser.add_argument("--stories", type=int, default=10000)
+    parser.add_argument("--ratings", type=int, default=200000)
+    parser.add_argument("--story-words", type=int, default=300)
+    parser.add_argument("--skip-seed", action="store_true", help="reuse the data already in --database")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--llm-latency-ms", type=float, default=200, help="local provider time to first token (in-process only)")
+    parser.add_argument("--llm-tokens-per-second", type=float, default=0, help="local provider token rate, 0 = instant (in-process only)")
+    parser.add_argument("--rate-limit", action="store_true", help="keep per-client rate limiting on (in-process only)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default=f"bench-{datetime.utcnow():%Y%m%d-%H%M%S}.json")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    args = parser.parse_args(argv)
+
+    # The engine is built from DATABASE_URL on first use
+    os.environ["DATABASE_URL"] = args.database
+    import migrate_db
+    from database import get_engine
+    from llm_providers import LocalProvider, set_provider
+    from rate_limit import rate_limiter
+
+    set_provider(LocalProvider(latency_ms=args.llm_latency_ms, tokens_per_second=args.llm_tokens_per_second))
+    # Every simulated client shares one address, so limits would only measure the limiter
+    rate_limiter.enabled = args.rate_limit
+
+    engine = get_engine()
+    seed_stats = None
+    if not args.skip_seed:
+        migrate_db.migrate()
+        print(f"🌱 Seeding {args.stories} stories and {args.ratings} ratings...")
+        seed_stats = seed_database(engine, args.stories, args.ratings, args.story_words, seed=args.seed)
+        print(f"✅ Seeded in {seed_stats['seconds']}s")
+
+    targets = load_targets(engine)
+    if not targets["max_id"]:
+        sys.exit("❌ No stories to benchmark against; run without --skip-seed first")
+
+    print(f"🏁 {args.requests} requests at concurrency {args.concurrency}...")
+    runner = _run_remote if args.url else _run_in_process
+    result = asyncio.run(runner(args, targets))
+    result["meta"] = {
+        "commit": _git_commit(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "database": engine.dialect.name,
+        "target": args.url or "in-process",
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "seed": seed_stats,
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+
+    with open(args.output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"💾 Results written to {args.output}")
+    return result
+
+if __name__ == "__main__":
+    main()
@@ -1,46 +1,133 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, Boolean, ForeignKey, Float
+from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, Boolean, ForeignKey, Float, Index, LargeBinary, event, update, select, text
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import sessionmaker, relationship, attributes, column_property
 from datetime import datetime
 import os
 import secrets
+import threading
 
-DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./whatif.db")
+import story_codec
 
-engine = create_engine(
-    DATABASE_URL, 
-    connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {}
-)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+DEFAULT_DATABASE_URL = "sqlite:///./whatif.db"
+
+# The engine is created on first use rather than at import, so importing the
+# app does no database work and DATABASE_URL may come from a .env file
+# loaded after this module.
+_engine = None
+_engine_lock = threading.Lock()
+_engine_listeners = []
+
+def get_engine():
+    """The process-wide engine for DATABASE_URL, created on first use"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            url = os.getenv("DATABASE_URL", DEFAULT_DATABASE_URL)
+            engine = create_engine(
+                url,
+                connect_args={"check_same_thread": False} if "sqlite" in url else {}
+            )
+            for listener in _engine_listeners:
+                listener(engine)
+            _engine = engine
+        return _engine
+
+def on_engine_created(listener):
+    """Call ``listener(engine)`` when the engine is created, or now if it already exists"""
+    with _engine_lock:
+        _engine_listeners.append(listener)
+        engine = _engine
+    if engine is not None:
+        listener(engine)
+
+def __getattr__(name):
+    # ``from database import engine`` still works; it creates the engine
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+class _DeferredSessionmaker(sessionmaker):
+    """sessionmaker that binds to get_engine() when the first session is made"""
+
+    def __call__(self, **local_kw):
+        if self.kw.get("bind") is None and local_kw.get("bind") is None:
+            self.configure(bind=get_engine())
+        return super().__call__(**local_kw)
+
+SessionLocal = _DeferredSessionmaker(autocommit=False, autoflush=False)
 Base = declarative_base()
 
+# Bayesian prior for the trending score: a story with no ratings scores
+# TRENDING_PRIOR_MEAN and each real rating pulls it towards its own average.
+TRENDING_PRIOR_MEAN = 3.0
+TRENDING_PRIOR_WEIGHT = 5.0
+
+# Small listing columns carried in the history index on Postgres (INCLUDE is
+# not available on SQLite, where the rowid lookup per row is cheap anyway).
+# what_if is left out: it is unbounded user text and a long one would push
+# the index tuple past the btree size limit, so a page still reads it from
+# the heap and the index is not fully covering.
+HISTORY_INCLUDE_COLUMNS = ["universe", "word_count", "rating", "rating_sum", "rating_count"]
+
+def average_from_aggregates(rating_sum, rating_count):
+    """Average rating rounded for display, 0 when there are no ratings"""
+    if not rating_count:
+        return 0
+    return round(rating_sum / rating_count, 1)
+
 class Story(Base):
     __tablename__ = "stories"
     
     id = Column(Integer, primary_key=True, index=True)
     universe = Column(String, index=True)
     what_if = Column(Text)
-    story = Column(Text)
+    # Story text: compressed in story_blob when story_codec is set, plain in the
+    # "story" column otherwise (rows from before compression). Use ``story``.
+    story_text = Column("story", Text, nullable=True)
+    story_blob = Column(LargeBinary, nullable=True)
+    story_codec = Column(String(16), nullable=True)
     word_count = Column(Integer)
     rating = Column(Integer, default=0)  # Kept for backward compatibility
     is_public = Column(Boolean, default=True)
     share_token = Column(String(32), unique=True, index=True, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # Normalized request hash used by the generation cache (see generation_cache.py)
+    scenario_hash = Column(String(64), index=True, nullable=True)
+    
+    # Denormalized rating aggregates, maintained by the Rating mapper events below
+    rating_sum = Column(Integer, default=0, server_default="0", nullable=False)
+    rating_count = Column(Integer, default=0, server_default="0", nullable=False)
+    stars_1 = Column(Integer, default=0, server_default="0", nullable=False)
+    stars_2 = Column(Integer, default=0, server_default="0", nullable=False)
+    stars_3 = Column(Integer, default=0, server_default="0", nullable=False)
+    stars_4 = Column(Integer, default=0, server_default="0", nullable=False)
+    stars_5 = Column(Integer, default=0, server_default="0", nullable=False)
+    trending_score = Column(Float, default=TRENDING_PRIOR_MEAN, server_default=str(TRENDING_PRIOR_MEAN), nullable=False)
     
     # Relationship to ratings
     ratings = relationship("Rating", back_populates="story", cascade="all, delete-orphan")
     
+    @property
+    def story(self):
+        """Story text, decompressed when stored compressed"""
+        if self.story_codec is not None:
+            return story_codec.decompress(self.story_blob, self.story_codec)
+        return self.story_text
+    
+    @story.setter
+    def story(self, text):
+        self.story_text, self.story_codec, self.story_blob = story_codec.encode(text)
+    
     @property
     def average_rating(self):
-        """Calculate average rating from all user ratings"""
-        if not self.ratings:
-            return 0
-        return round(sum(r.rating_value for r in self.ratings) / len(self.ratings), 1)
+        """Average rating computed from the stored aggregates"""
+        return average_from_aggregates(self.rating_sum, self.rating_count)
     
     @property
-    def rating_count(self):
-        """Get total number of ratings"""
-        return len(self.ratings) if self.ratings else 0
+    def rating_distribution(self):
+        """Per-star rating counts as {1: count, ..., 5: count}"""
+        return {value: getattr(self, f"stars_{value}") or 0 for value in RATING_VALUES}
     
     def generate_share_token(self):
         """Generate a unique share token for this story"""
@@ -48,26 +135,253 @@ class Story(Base):
             self.share_token = secrets.token_urlsafe(16)
         return self.share_token
 
+    __table_args__ = (
+        # Top-K trending reads walk these indexes instead of scanning stories
+        Index("ix_stories_public_trending", "is_public", "trending_score", "rating_count", "id"),
+        Index("ix_stories_universe_trending", "universe", "is_public", "trending_score", "rating_count", "id"),
+        # Keyset pagination for /story/history; on Postgres it also carries HISTORY_INCLUDE_COLUMNS
+        Index(
+            "ix_stories_public_created", "is_public", "created_at", "id",
+            postgresql_include=HISTORY_INCLUDE_COLUMNS
+        ),
+    )
+
 class Rating(Base):
     __tablename__ = "ratings"
     
     id = Column(Integer, primary_key=True, index=True)
     story_id = Column(Integer, ForeignKey("stories.id"), nullable=False)
     session_id = Column(String(64), nullable=False)  # Browser session identifier
-    rating_value = Column(Integer, nullable=False)  # 1-5 stars
+    # 1-5 stars; active_history keeps the previous value so aggregates can be adjusted
+    rating_value = column_property(Column(Integer, nullable=False), active_history=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationship to story
     story = relationship("Story", back_populates="ratings")
     
-    # Ensure one rating per session per story
+    # One rating per session per story; also the lookup index for rating writes
+    __table_args__ = (
+        Index("ux_ratings_story_session", "story_id", "session_id", unique=True),
+    )
+
+class GenerationJob(Base):
+    """A story generation request processed by the in-process job workers"""
+    __tablename__ = "generation_jobs"
+    
+    id = Column(String(32), primary_key=True)
+    status = Column(String(16), nullable=False, default="pending")  # pending, running, succeeded, failed
+    universe = Column(String, nullable=False)
+    what_if = Column(Text, nullable=False)
+    length = Column(String(16), nullable=False, default="medium")
+    system_prompt = Column(Text, nullable=True)  # set for custom universes
+    fresh = Column(Boolean, nullable=False, default=False)  # bypass the generation cache
+    story_id = Column(Integer, ForeignKey("stories.id"), nullable=True)
+    error = Column(Text, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    
+    story = relationship("Story")
+    
     __table_args__ = (
-        # Note: SQLite doesn't support this, but PostgreSQL does
-        # UniqueConstraint('story_id', 'session_id', name='unique_story_session_rating'),
+        # Workers claim the oldest claimable job through this index
+        Index("ix_generation_jobs_status_created", "status", "created_at"),
     )
 
-Base.metadata.create_all(bind=engine)
+class UniversePrompt(Base):
+    """Generated system prompt for a custom universe, reused across requests"""
+    __tablename__ = "universe_prompts"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    universe_key = Column(String, unique=True, index=True, nullable=False)  # normalized universe name
+    universe = Column(String, nullable=False)  # name as first requested
+    system_prompt = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+RATING_VALUES = (1, 2, 3, 4, 5)
+
+def rating_delta_values(old_value=None, new_value=None):
+    """Build the column increments for stories when a rating changes.
+
+    ``old_value`` is the rating being replaced (None for a new rating) and
+    ``new_value`` the rating being stored (None for a removed rating).
+    """
+    values = {}
+    if old_value is not None:
+        values["rating_sum"] = Story.rating_sum - old_value
+        values["rating_count"] = Story.rating_count - 1
+        values[f"stars_{old_value}"] = getattr(Story, f"stars_{old_value}") - 1
+    if new_value is not None:
+        values["rating_sum"] = values.get("rating_sum", Story.rating_sum) + new_value
+        values["rating_count"] = values.get("rating_count", Story.rating_count) + 1
+        column = f"stars_{new_value}"
+        values[column] = values.get(column, getattr(Story, column)) + 1
+    if "rating_sum" in values:
+        values["trending_score"] = (
+            (TRENDING_PRIOR_WEIGHT * TRENDING_PRIOR_MEAN + values["rating_sum"])
+            / (TRENDING_PRIOR_WEIGHT + values["rating_count"])
+        )
+    return values
+
+def apply_rating_delta(connection, story_id, old_value=None, new_value=None):
+    """Apply a rating change to the story aggregates on ``connection``"""
+    if old_value == new_value:
+        return
+    connection.execute(
+        update(Story)
+        .where(Story.id == story_id)
+        .values(**rating_delta_values(old_value, new_value))
+    )
+
+def rating_upsert(dialect_name: str, rows):
+    """INSERT ... ON CONFLICT (story_id, session_id) DO UPDATE for ``rows``.
+
+    ``rows`` is one dict or a list of dicts with story_id, session_id,
+    rating_value, created_at and updated_at.
+    """
+    insert = postgresql.insert if dialect_name == "postgresql" else sqlite.insert
+    statement = insert(Rating.__table__).values(rows)
+    return statement.on_conflict_do_update(
+        index_elements=["story_id", "session_id"],
+        set_={
+            "rating_value": statement.excluded.rating_value,
+            "updated_at": statement.excluded.updated_at,
+        }
+    )
+
+def save_rating(connection, story_id: int, session_id: str, value: int):
+    """Insert or replace one session's rating and adjust the story aggregates.
+
+    Returns None if the story does not exist, otherwise the story's
+    aggregates before and after the change. A no-op write on the story row
+    comes first so concurrent raters of the same story are serialized (a
+    row lock on Postgres, the write lock on SQLite) and the previous rating
+    read next is current.
+    """
+    locked = connection.execute(
+        update(Story).where(Story.id == story_id).values(rating_count=Story.rating_count)
+    )
+    if locked.rowcount == 0:
+        return None
+
+    row = rating_state(connection, story_id, session_id)
+    now = datetime.utcnow()
+    connection.execute(rating_upsert(connection.dialect.name, {
+        "story_id": story_id,
+        "session_id": session_id,
+        "rating_value": value,
+        "created_at": now,
+        "updated_at": now,
+    }))
+    apply_rating_delta(connection, story_id, row.previous, value)
+    return rating_change(row, row.previous, value)
+
+def rating_state(connection, story_id: int, session_id: str):
+    """Story aggregates plus this session's current rating (``previous``), or None"""
+    previous_value = (
+        select(Rating.rating_value)
+        .where(Rating.story_id == story_id, Rating.session_id == session_id)
+        .scalar_subquery()
+    )
+    return connection.execute(
+        select(Story.rating_sum, Story.rating_count, Story.trending_score, previous_value.label("previous"))
+        .where(Story.id == story_id)
+    ).first()
+
+def rating_change(state, previous_value, new_value) -> dict:
+    """Story aggregates before and after replacing ``previous_value`` with ``new_value``"""
+    rating_sum = state.rating_sum + new_value - (previous_value or 0)
+    rating_count = state.rating_count + (0 if previous_value is not None else 1)
+    return {
+        "previous_value": previous_value,
+        "previous_score": state.trending_score,
+        "rating_sum": rating_sum,
+        "rating_count": rating_count,
+        "trending_score": (
+            (TRENDING_PRIOR_WEIGHT * TRENDING_PRIOR_MEAN + rating_sum) / (TRENDING_PRIOR_WEIGHT + rating_count)
+        ),
+    }
+
+@event.listens_for(Rating, "after_insert")
+def _rating_inserted(mapper, connection, target):
+    apply_rating_delta(connection, target.story_id, new_value=target.rating_value)
+
+@event.listens_for(Rating, "after_update")
+def _rating_updated(mapper, connection, target):
+    history = attributes.get_history(target, "rating_value")
+    if not history.deleted:
+        return
+    apply_rating_delta(connection, target.story_id, history.deleted[0], target.rating_value)
+
+@event.listens_for(Rating, "after_delete")
+def _rating_deleted(mapper, connection, target):
+    apply_rating_delta(connection, target.story_id, old_value=target.rating_value)
+
+# Full-text index over what_if and story text (queried by search.py): a
+# contentless FTS5 table keyed by story id on SQLite, a tsvector column with
+# a GIN index on Postgres. The story text is stored compressed, so no
+# trigger can read it; the index is written from Python when a story is
+# inserted instead.
+SEARCH_INDEX_DDL = {
+    "sqlite": [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS stories_fts "
+        "USING fts5(what_if, story, content='', tokenize='porter unicode61')",
+    ],
+    "postgresql": [
+        "ALTER TABLE stories ADD COLUMN IF NOT EXISTS search_vector tsvector",
+        "CREATE INDEX IF NOT EXISTS ix_stories_search ON stories USING GIN (search_vector)",
+    ],
+}
+
+_SEARCH_INDEX_INSERT = {
+    "sqlite": "INSERT INTO stories_fts (rowid, what_if, story) VALUES (:id, :what_if, :story)",
+    # Scenario matches rank above matches in the story body
+    "postgresql": (
+        "UPDATE stories SET search_vector = "
+        "setweight(to_tsvector('english', :what_if), 'A') || setweight(to_tsvector('english', :story), 'B') "
+        "WHERE id = :id"
+    ),
+}
+
+def create_search_index(connection):
+    """Create the full-text index for this dialect if it does not exist"""
+    for statement in SEARCH_INDEX_DDL.get(connection.dialect.name, []):
+        connection.execute(text(statement))
+
+def index_stories(connection, rows):
+    """Add stories to the full-text index; ``rows`` are dicts with id, what_if and story"""
+    statement = _SEARCH_INDEX_INSERT.get(connection.dialect.name)
+    if statement is None or not rows:
+        return
+    connection.execute(text(statement), [
+        {"id": row["id"], "what_if": row["what_if"] or "", "story": row["story"] or ""} for row in rows
+    ])
+
+def clear_search_index(connection):
+    """Drop every entry from the full-text index (for bulk reloads)"""
+    if connection.dialect.name == "sqlite":
+        # Contentless FTS5 tables cannot be DELETEd from
+        connection.execute(text("INSERT INTO stories_fts (stories_fts) VALUES ('delete-all')"))
+    elif connection.dialect.name == "postgresql":
+        connection.execute(text("UPDATE stories SET search_vector = NULL"))
+
+@event.listens_for(Story.__table__, "after_create")
+def _stories_created(target, connection, **kw):
+    create_search_index(connection)
+
+@event.listens_for(Story, "after_insert")
+def _story_inserted(mapper, connection, target):
+    index_stories(connection, [{"id": target.id, "what_if": target.what_if, "story": target.story}])
+
+def create_schema(bind=None):
+    """Create any missing tables (and the search index of a new stories table).
+
+    An explicit step run by migrate_db.migrate(), not an import side effect.
+    """
+    Base.metadata.create_all(bind=bind if bind is not None else get_engine())
 
 def get_db():
     db = SessionLocal()
@@ -0,0 +1,98 @@
+"""
+Exact-match cache for story generation.
+
+Requests are keyed on a normalized ``(universe, what_if, length,
+system_prompt hash)``. The key is stored on every generated story in the
+indexed ``stories.scenario_hash`` column, and an in-process LRU with a TTL
+keeps the story ids per key hot. Up to ``max_variants`` different stories
+are generated per key; after that, requests reuse one of them and cost no
+tokens. Clients can opt out with ``fresh=true``.
+"""
+import hashlib
+import json
+import os
+import random
+import re
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+from database import Story
+from ttl_cache import TTLCache
+from metrics import record_cache
+
+_WHITESPACE = re.compile(r"\s+")
+
+def normalize_text(text: Optional[str]) -> str:
+    """Case-fold, collapse whitespace and drop trailing punctuation"""
+    if not text:
+        return ""
+    return _WHITESPACE.sub(" ", text).strip().casefold().rstrip("?!. ")
+
+def scenario_key(universe: str, what_if: str, length: str = "medium", system_prompt: Optional[str] = None) -> str:
+    """Stable hash identifying equivalent generation requests"""
+    prompt_hash = hashlib.sha256(system_prompt.encode()).hexdigest() if system_prompt else ""
+    raw = json.dumps([normalize_text(universe), normalize_text(what_if), normalize_text(length), prompt_hash])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+class GenerationCache:
+    """Decides whether a request can reuse an existing story"""
+
+    def __init__(self, max_variants: int = None, lru_size: int = None, ttl_seconds: float = None):
+        self.max_variants = max_variants if max_variants is not None else int(
+            os.getenv("GENERATION_CACHE_VARIANTS", "3")
+        )
+        self.lru = TTLCache(
+            max_size=lru_size if lru_size is not None else int(os.getenv("GENERATION_CACHE_SIZE", "2048")),
+            ttl_seconds=ttl_seconds if ttl_seconds is not None else float(os.getenv("GENERATION_CACHE_TTL_SECONDS", "3600"))
+        )
+        self.hits = 0
+        self.misses = 0
+
+    def variant_ids(self, db: Session, key: str) -> list:
+        """Story ids stored for ``key``, from the LRU or the scenario_hash index"""
+        ids = self.lru.get(key)
+        if ids is None:
+            rows = db.query(Story.id).filter(
+                Story.scenario_hash == key,
+                Story.is_public == True
+            ).order_by(Story.id).limit(self.max_variants).all()
+            ids = tuple(row.id for row in rows)
+            self.lru.set(key, ids)
+        return list(ids)
+
+    def find(self, db: Session, key: str) -> Optional[Story]:
+        """Return a story to reuse, or None when a new variant should be generated"""
+        ids = self.variant_ids(db, key)
+        if self.max_variants < 1 or len(ids) < self.max_variants:
+            self.misses += 1
+            record_cache("generation", hit=False)
+            return None
+
+        story = db.query(Story).filter(Story.id == random.choice(ids)).first()
+        if story is None:
+            # A cached variant was deleted; fall back to the database next time
+            self.lru.invalidate(key)
+            self.misses += 1
+            record_cache("generation", hit=False)
+            return None
+        self.hits += 1
+        record_cache("generation", hit=True)
+        return story
+
+    def remember(self, key: str, story_id: int):
+        """Record a freshly generated variant for ``key``"""
+        ids = self.lru.get(key)
+        if ids is not None and story_id not in ids and len(ids) < self.max_variants:
+            self.lru.set(key, tuple(ids) + (story_id,))
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            "entries": len(self.lru)
+        }
+
+generation_cache = GenerationCache()
@@ -0,0 +1,75 @@
+"""
+Keyset-paginated story history.
+
+Pages are ordered by ``(created_at, id)`` descending and continue from an
+opaque cursor, so every page is an index range scan over
+``ix_stories_public_created`` regardless of how deep the client has paged.
+Only the listed columns are selected; the story body is never loaded.
+"""
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Session
+
+from database import Story
+import pagination
+from pagination import encode_cursor, decode_cursor
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+HISTORY_COLUMNS = (
+    Story.id,
+    Story.universe,
+    Story.what_if,
+    Story.word_count,
+    Story.rating,
+    Story.rating_sum,
+    Story.rating_count,
+    Story.created_at,
+)
+
+def clamp_limit(limit: Optional[int]) -> int:
+    return pagination.clamp_limit(limit, DEFAULT_LIMIT, MAX_LIMIT)
+
+def serialize_row(row) -> dict:
+    """Shape a projected history row like the /story/history payload"""
+    return {
+        **pagination.summary_fields(row),
+        "rating": row.rating,
+        "created_at": row.created_at.isoformat()
+    }
+
+def get_history_page(db: Session, limit: Optional[int] = DEFAULT_LIMIT, cursor: Optional[str] = None) -> dict:
+    """Return one page of public stories, newest first, plus the next cursor.
+
+    Raises ValueError if ``cursor`` is not one we issued.
+    """
+    limit = clamp_limit(limit)
+    query = db.query(*HISTORY_COLUMNS).filter(Story.is_public == True)
+
+    if cursor:
+        created_at, story_id = decode_cursor(cursor, 2)
+        try:
+            created_at = datetime.fromisoformat(created_at)
+            story_id = int(story_id)
+        except (TypeError, ValueError) as e:
+            raise ValueError("Invalid cursor") from e
+        query = query.filter(tuple_(Story.created_at, Story.id) < tuple_(created_at, story_id))
+
+    # Fetch one extra row to know whether another page exists
+    rows = query.order_by(Story.created_at.desc(), Story.id.desc()).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    next_cursor = None
+    if has_more:
+        last = rows[-1]
+        next_cursor = encode_cursor(last.created_at.isoformat(), last.id)
+
+    return {
+        "count": len(rows),
+        "stories": [serialize_row(row) for row in rows],
+        "next_cursor": next_cursor
+    }
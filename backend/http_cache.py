@@ -0,0 +1,59 @@
+"""
+HTTP caching for story reads.
+
+A story's text, universe and scenario never change once it is stored;
+only the rating fields (and whether it has a share link) do. Story
+responses therefore carry a strong ETag made of the story id and a rating
+version built from the stored aggregates, so any change to what the body
+shows changes the tag. Clients and CDNs revalidate with ``If-None-Match``
+and get a ``304`` that never reads the story text.
+
+With ``?split=true`` the story endpoints answer with the volatile fields
+only, plus a ``text_url`` for ``/story/{id}/text``. That body is immutable
+and may be cached for a year; ``format=plain`` serves just the text,
+gzip-encoded straight from storage when the client accepts it.
+"""
+import os
+from typing import Optional
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+def story_cache_control() -> str:
+    """Cache-Control for responses that include rating fields"""
+    return f"public, max-age={int(os.getenv('STORY_CACHE_MAX_AGE', '10'))}"
+
+def rating_version(story) -> str:
+    """Changes whenever the rating fields shown for ``story`` change"""
+    return f"{story.rating_count}.{story.rating_sum}.{story.rating}"
+
+def story_etag(story, shared: bool = False, split: bool = False) -> str:
+    """Strong ETag for a story response; ``shared`` when it includes a share_url"""
+    suffix = ("-s" if shared else "") + ("-meta" if split else "")
+    return f'"story-{story.id}-r{rating_version(story)}{suffix}"'
+
+def text_etag(story_id: int, variant: Optional[str] = None) -> str:
+    """ETag for the immutable text of a story, per representation (e.g. ``plain-gzip``)"""
+    return f'"story-{story_id}-text{"-" + variant if variant else ""}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an ``If-None-Match`` header matches ``etag`` (weak comparison, as for GET)"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+def accepts_encoding(accept_encoding: Optional[str], encoding: str) -> bool:
+    """Whether an ``Accept-Encoding`` header allows ``encoding`` (q=0 refuses it)"""
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        if name.strip().lower() not in (encoding, "*"):
+            continue
+        q = params.strip().removeprefix("q=")
+        try:
+            return not params.strip() or float(q) > 0
+        except ValueError:
+            return True
+    return False
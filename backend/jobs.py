@@ -0,0 +1,328 @@
+"""
+Durable in-process job queue for story generation.
+
+Jobs are rows in ``generation_jobs``, so anything submitted survives a
+restart. A pool of asyncio workers started from the FastAPI lifespan hook
+claims jobs with a compare-and-set UPDATE (safe across several uvicorn
+workers), runs the LLM call and stores the story together with the job
+result. A job left ``running`` by a crashed process is reclaimed once its
+lease expires; there is no external broker.
+
+The lease is the job's ``started_at``. It is renewed once the worker gets
+an LLM slot, since waiting for one can take longer than the lease, and
+every later transition is a compare-and-set on the ``started_at`` this
+worker holds, so a worker whose job was reclaimed cannot finish it twice.
+"""
+import asyncio
+import math
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import and_, or_, update
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, GenerationJob, Story
+from generation_cache import generation_cache, scenario_key
+from universe_prompts import universe_prompts
+import story_generator
+from llm_scheduler import llm_scheduler, priority_for
+from wakeup import Wakeup
+
+# Jobs share one fair-queue session and never time out waiting for a slot
+JOB_SESSION = "jobs"
+
+PENDING = "pending"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+class JobQueue:
+    """Stores generation jobs and runs them on a pool of worker tasks"""
+
+    def __init__(self, session_factory=SessionLocal, workers: int = None, poll_seconds: float = None,
+                 lease_seconds: float = None, max_attempts: int = None, cache=generation_cache):
+        self.session_factory = session_factory
+        self.cache = cache
+        self.workers = workers if workers is not None else int(os.getenv("JOB_WORKERS", "4"))
+        self.poll_seconds = poll_seconds if poll_seconds is not None else float(os.getenv("JOB_POLL_SECONDS", "2"))
+        self.lease_seconds = lease_seconds if lease_seconds is not None else float(os.getenv("JOB_LEASE_SECONDS", "600"))
+        self.max_attempts = max_attempts if max_attempts is not None else int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+        self._tasks = []
+        self._active = {}  # worker index -> id of the job it is running
+        self._wake = Wakeup()
+
+    # Submission and lookup (called from request handlers)
+
+    def submit(self, db: Session, universe: str, what_if: str, length: str = "medium",
+               system_prompt: Optional[str] = None, fresh: bool = False) -> GenerationJob:
+        """Persist a new pending job and wake an idle worker"""
+        if system_prompt is None and universe not in story_generator.UNIVERSES:
+            system_prompt = universe_prompts.resolve(db, universe)
+        job = GenerationJob(
+            id=uuid.uuid4().hex,
+            status=PENDING,
+            universe=universe,
+            what_if=what_if,
+            length=length,
+            system_prompt=system_prompt,
+            fresh=fresh
+        )
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+        self.notify()
+        return job
+
+    def notify(self):
+        """Wake idle workers"""
+        self._wake.set()
+
+    # Worker-side state transitions (blocking, run through asyncio.to_thread)
+
+    def claim(self) -> Optional[dict]:
+        """Atomically move the oldest claimable job to running and return it"""
+        db = self.session_factory()
+        try:
+            while True:
+                now = datetime.utcnow()
+                stale = now - timedelta(seconds=self.lease_seconds)
+                candidate = db.query(GenerationJob.id, GenerationJob.status, GenerationJob.started_at).filter(
+                    or_(
+                        GenerationJob.status == PENDING,
+                        and_(GenerationJob.status == RUNNING, GenerationJob.started_at < stale)
+                    )
+                ).order_by(GenerationJob.created_at).first()
+                if candidate is None:
+                    return None
+
+                # Compare-and-set on the state we read so only one worker wins
+                unchanged = (
+                    GenerationJob.started_at.is_(None) if candidate.started_at is None
+                    else GenerationJob.started_at == candidate.started_at
+                )
+                result = db.execute(
+                    update(GenerationJob)
+                    .where(GenerationJob.id == candidate.id, GenerationJob.status == candidate.status, unchanged)
+                    .values(status=RUNNING, started_at=now, attempts=GenerationJob.attempts + 1)
+                )
+                db.commit()
+                if result.rowcount != 1:
+                    continue
+
+                job = db.get(GenerationJob, candidate.id)
+                if job.attempts > self.max_attempts:
+                    job.status = FAILED
+                    job.error = job.error or "Job exceeded its maximum number of attempts"
+                    job.finished_at = now
+                    db.commit()
+                    continue
+                return {
+                    "id": job.id,
+                    "started_at": job.started_at,
+                    "universe": job.universe,
+                    "what_if": job.what_if,
+                    "length": job.length,
+                    "system_prompt": job.system_prompt,
+                    "fresh": job.fresh,
+                    "attempts": job.attempts
+                }
+        finally:
+            db.close()
+
+    def _transition(self, db: Session, job: dict, **values) -> bool:
+        """Update the job only while this worker still holds its lease; returns whether it did"""
+        result = db.execute(
+            update(GenerationJob)
+            .where(
+                GenerationJob.id == job["id"],
+                GenerationJob.status == RUNNING,
+                GenerationJob.started_at == job["started_at"]
+            )
+            .values(**values)
+        )
+        return result.rowcount == 1
+
+    def renew_lease(self, job: dict) -> bool:
+        """Restart the lease of a claimed job; False if another worker has reclaimed it"""
+        db = self.session_factory()
+        try:
+            now = datetime.utcnow()
+            renewed = self._transition(db, job, started_at=now)
+            db.commit()
+            if renewed:
+                job["started_at"] = now
+            return renewed
+        finally:
+            db.close()
+
+    def complete(self, job: dict, story_text: str):
+        """Store the story and mark the job succeeded in one transaction"""
+        db = self.session_factory()
+        try:
+            story = Story(
+                universe=job["universe"],
+                what_if=job["what_if"],
+                story=story_text,
+                word_count=len(story_text.split()),
+                scenario_hash=job_key(job)
+            )
+            db.add(story)
+            db.flush()
+            story_id, scenario_hash = story.id, story.scenario_hash
+            if not self._transition(db, job, **self._succeeded(story_id)):
+                db.rollback()  # the job was reclaimed; its new owner stores the story
+                return
+            db.commit()
+            self.cache.remember(scenario_hash, story_id)
+        finally:
+            db.close()
+
+    def complete_from_cache(self, job: dict) -> bool:
+        """Finish the job with a cached variant if one can be reused"""
+        if job["fresh"]:
+            return False
+        db = self.session_factory()
+        try:
+            story = self.cache.find(db, job_key(job))
+            if story is None:
+                return False
+            self._transition(db, job, **self._succeeded(story.id))
+            db.commit()
+            return True
+        finally:
+            db.close()
+
+    def _succeeded(self, story_id: int) -> dict:
+        return {"status": SUCCEEDED, "story_id": story_id, "error": None, "finished_at": datetime.utcnow()}
+
+    def fail(self, job: dict, error: Exception):
+        """Retry transient failures; give up after max_attempts or on bad input"""
+        db = self.session_factory()
+        try:
+            if isinstance(error, ValueError) or job["attempts"] >= self.max_attempts:
+                values = {"status": FAILED, "finished_at": datetime.utcnow()}
+            else:
+                values = {"status": PENDING, "started_at": None}
+            self._transition(db, job, error=str(error), **values)
+            db.commit()
+        finally:
+            db.close()
+
+    def release(self, job_ids: list):
+        """Return interrupted jobs to the queue without counting the attempt"""
+        if not job_ids:
+            return
+        db = self.session_factory()
+        try:
+            db.execute(
+                update(GenerationJob)
+                .where(GenerationJob.id.in_(job_ids), GenerationJob.status == RUNNING)
+                .values(status=PENDING, started_at=None, attempts=GenerationJob.attempts - 1)
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    # Execution
+
+    async def execute(self, job: dict):
+        """Run one claimed job to completion"""
+        try:
+            if await asyncio.to_thread(self.complete_from_cache, job):
+                return
+            async with llm_scheduler.slot(JOB_SESSION, priority_for(job["length"]), deadline=math.inf):
+                # The wait for a slot may have outlasted the lease
+                if not await asyncio.to_thread(self.renew_lease, job):
+                    return
+                if job["system_prompt"] is None:
+                    result = await story_generator.generate_story_async(
+                        universe=job["universe"],
+                        what_if=job["what_if"],
+                        length=job["length"]
+                    )
+                    story_text = result["story"]
+                else:
+                    story_text = await story_generator.generate_story_with_prompt_async(
+                        universe=job["universe"],
+                        system_prompt=job["system_prompt"],
+                        what_if=job["what_if"],
+                        length=job["length"]
+                    )
+        except Exception as e:
+            await asyncio.to_thread(self.fail, job, e)
+            return
+        try:
+            await asyncio.to_thread(self.complete, job, story_text)
+        except Exception as e:
+            # Storing the story failed (e.g. the database is locked); retry the job later
+            print(f"❌ Could not store the story of job {job['id']}: {e}")
+            await asyncio.to_thread(self.fail, job, e)
+
+    async def run_until_empty(self):
+        """Process claimable jobs one at a time until none are left"""
+        while True:
+            job = await asyncio.to_thread(self.claim)
+            if job is None:
+                return
+            await self.execute(job)
+
+    async def _worker(self, index: int):
+        while True:
+            try:
+                job = await asyncio.to_thread(self.claim)
+            except Exception as e:
+                print(f"❌ Job worker {index} could not claim a job: {e}")
+                job = None
+            if job is None:
+                await self._wake.wait(self.poll_seconds)
+                continue
+            self._active[index] = job["id"]
+            try:
+                await self.execute(job)
+            except Exception as e:
+                # Keep the worker alive and put the job back rather than leave it running until its lease expires
+                print(f"❌ Job worker {index} failed on job {job['id']}: {e}")
+                try:
+                    await asyncio.to_thread(self.release, [job["id"]])
+                except Exception as release_error:
+                    print(f"❌ Job worker {index} could not release job {job['id']}: {release_error}")
+            finally:
+                self._active.pop(index, None)
+
+    def start(self):
+        """Start the worker tasks on the running event loop"""
+        self._wake.bind()
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+
+    async def stop(self):
+        """Cancel the workers and put their in-flight jobs back in the queue"""
+        interrupted = list(self._active.values())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._active.clear()
+        self._wake.unbind()
+        await asyncio.to_thread(self.release, interrupted)
+
+def job_key(job: dict) -> str:
+    """Generation cache key for a claimed job"""
+    return scenario_key(job["universe"], job["what_if"], job["length"], job["system_prompt"])
+
+def job_status(job: GenerationJob) -> dict:
+    """API representation of a job"""
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "universe": job.universe,
+        "what_if": job.what_if,
+        "attempts": job.attempts,
+        "error": job.error,
+        "story_id": job.story_id,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None
+    }
+
+job_queue = JobQueue()
@@ -0,0 +1,118 @@
+"""
+Precomputed trending leaderboards.
+
+A background task (started from the FastAPI lifespan hook) rebuilds an
+in-memory snapshot of the global and per-universe top lists on an interval,
+or sooner when a rating moves a story's score noticeably. /story/trending
+then serves the ready snapshot instead of querying the database.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Optional
+
+from database import SessionLocal
+from story_generator import UNIVERSES
+import trending
+from wakeup import Wakeup
+
+GLOBAL_BOARD = None  # key of the board covering every universe
+
+class LeaderboardSnapshot:
+    """Immutable set of top lists produced by one rebuild"""
+
+    def __init__(self, version: int, boards: dict, generated_at: datetime):
+        self.version = version
+        self.boards = boards
+        self.generated_at = generated_at
+        # From the contents rather than the version, which is only a counter
+        # in this process: every worker then tags the same boards alike
+        self.etag = f'"leaderboard-{board_digest(boards)}"'
+
+    def get(self, universe: Optional[str], limit: int) -> Optional[list]:
+        """Return the first ``limit`` entries, or None if this snapshot can't answer"""
+        board = self.boards.get(universe)
+        if board is None:
+            return None
+        return board[:limit]
+
+def board_digest(boards: dict) -> str:
+    """Stable hash of the boards' entries"""
+    ordered = sorted(((universe or "", board) for universe, board in boards.items()), key=lambda item: item[0])
+    payload = json.dumps(ordered, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+class Leaderboard:
+    """Holds the current snapshot and the task that keeps it fresh"""
+
+    def __init__(self, session_factory=SessionLocal, size: int = trending.MAX_LIMIT,
+                 refresh_seconds: float = None, bump_threshold: float = None,
+                 min_rebuild_seconds: float = 1.0):
+        self.session_factory = session_factory
+        self.size = size
+        self.refresh_seconds = refresh_seconds if refresh_seconds is not None else float(
+            os.getenv("LEADERBOARD_REFRESH_SECONDS", "60")
+        )
+        self.bump_threshold = bump_threshold if bump_threshold is not None else float(
+            os.getenv("LEADERBOARD_BUMP_THRESHOLD", "0.25")
+        )
+        self.min_rebuild_seconds = min_rebuild_seconds
+        self.snapshot: Optional[LeaderboardSnapshot] = None
+        self._lock = threading.Lock()
+        self._wake = Wakeup()
+
+    def rebuild(self) -> LeaderboardSnapshot:
+        """Recompute every board and publish a new snapshot if anything changed.
+
+        Built-in universes always get a board (possibly empty), custom ones
+        once they have a public story; all of them come from one query.
+        """
+        db = self.session_factory()
+        try:
+            by_universe = trending.get_trending_by_universe(db, limit=self.size)
+            boards = {GLOBAL_BOARD: trending.get_trending(db, limit=self.size)}
+            boards.update({universe: [] for universe in UNIVERSES})
+            boards.update(by_universe)
+        finally:
+            db.close()
+
+        with self._lock:
+            current = self.snapshot
+            if current is not None and current.boards == boards:
+                return current
+            version = current.version + 1 if current else 1
+            self.snapshot = LeaderboardSnapshot(version, boards, datetime.utcnow())
+            return self.snapshot
+
+    def note_score_change(self, old_score: float, new_score: float):
+        """Ask for an early rebuild when a rating moved a score by a lot"""
+        if abs((new_score or 0) - (old_score or 0)) >= self.bump_threshold:
+            self.request_refresh()
+
+    def request_refresh(self):
+        """Wake the refresher task"""
+        self._wake.set()
+
+    async def run(self):
+        """Rebuild immediately, then every ``refresh_seconds`` or when bumped"""
+        self._wake.bind()
+        try:
+            while True:
+                started = time.monotonic()
+                try:
+                    await asyncio.to_thread(self.rebuild)
+                except Exception as e:
+                    print(f"❌ Leaderboard rebuild failed: {e}")
+                await self._wake.wait(self.refresh_seconds)
+                # Debounce bursts of bumps into at most one rebuild per interval
+                elapsed = time.monotonic() - started
+                if elapsed < self.min_rebuild_seconds:
+                    await asyncio.sleep(self.min_rebuild_seconds - elapsed)
+        finally:
+            self._wake.unbind()
+
+leaderboard = Leaderboard()
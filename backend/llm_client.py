@@ -0,0 +1,115 @@
+"""
+Process-wide OpenAI clients sharing tuned HTTP connection pools.
+
+Clients are created lazily on first use, so importing the generator still
+needs no API key, and then reused by every call, so generations reuse
+kept-alive TLS connections instead of handshaking each time. The FastAPI
+lifespan hook closes them on shutdown.
+
+The ``openai`` SDK takes about half a second to import, so it is only
+imported when the first client is built; processes that never call the
+model (migrations, workers serving reads, tests) never load it.
+"""
+import asyncio
+import os
+import threading
+
+import httpx
+
+_SDK_CLASSES = ("OpenAI", "AsyncOpenAI")
+
+def __getattr__(name):
+    # ``llm_client.OpenAI`` / ``llm_client.AsyncOpenAI``, imported on first access
+    if name in _SDK_CLASSES:
+        import openai
+        for sdk_class in _SDK_CLASSES:
+            globals().setdefault(sdk_class, getattr(openai, sdk_class))
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def _sdk_class(name: str):
+    return globals().get(name) or __getattr__(name)
+
+def _env_float(name: str, default: str) -> float:
+    return float(os.getenv(name, default))
+
+class LLMClientManager:
+    """Builds the sync and async clients once and hands out the shared instances"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._client = None
+        self._async_client = None
+        self._async_loop = None
+
+    def _api_key(self) -> str:
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise ValueError("OPENAI_API_KEY environment variable is not set")
+        return api_key
+
+    def limits(self) -> httpx.Limits:
+        """Connection pool limits from LLM_MAX_CONNECTIONS / LLM_MAX_KEEPALIVE / LLM_KEEPALIVE_SECONDS"""
+        return httpx.Limits(
+            max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", "100")),
+            max_keepalive_connections=int(os.getenv("LLM_MAX_KEEPALIVE", "20")),
+            keepalive_expiry=_env_float("LLM_KEEPALIVE_SECONDS", "30")
+        )
+
+    def timeout(self) -> httpx.Timeout:
+        """Timeouts from LLM_CONNECT_TIMEOUT / LLM_READ_TIMEOUT (seconds)"""
+        read = _env_float("LLM_READ_TIMEOUT", "120")
+        return httpx.Timeout(read, connect=_env_float("LLM_CONNECT_TIMEOUT", "5"))
+
+    def max_retries(self) -> int:
+        return int(os.getenv("LLM_MAX_RETRIES", "2"))
+
+    def get(self) -> "OpenAI":
+        """Shared synchronous client"""
+        with self._lock:
+            if self._client is None:
+                self._client = _sdk_class("OpenAI")(
+                    api_key=self._api_key(),
+                    timeout=self.timeout(),
+                    max_retries=self.max_retries(),
+                    http_client=httpx.Client(limits=self.limits(), timeout=self.timeout())
+                )
+            return self._client
+
+    def get_async(self) -> "AsyncOpenAI":
+        """Shared async client for the running event loop.
+
+        Async connections belong to the loop that opened them, so a client is
+        rebuilt if it is requested from a different loop.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._async_client is None or self._async_loop is not loop:
+                self._async_client = _sdk_class("AsyncOpenAI")(
+                    api_key=self._api_key(),
+                    timeout=self.timeout(),
+                    max_retries=self.max_retries(),
+                    http_client=httpx.AsyncClient(limits=self.limits(), timeout=self.timeout())
+                )
+                self._async_loop = loop
+            return self._async_client
+
+    async def aclose(self):
+        """Close both clients and their connection pools"""
+        with self._lock:
+            client, self._client = self._client, None
+            async_client, self._async_client = self._async_client, None
+            self._async_loop = None
+        if client is not None:
+            client.close()
+        if async_client is not None:
+            await async_client.close()
+
+    def reset(self):
+        """Forget the clients without closing them (e.g. after patching in tests)"""
+        with self._lock:
+            self._client = None
+            self._async_client = None
+            self._async_loop = None
+
+llm_clients = LLMClientManager()
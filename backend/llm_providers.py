@@ -0,0 +1,210 @@
+"""
+Pluggable LLM providers.
+
+``story_generator`` builds provider-neutral chat requests (messages,
+max_tokens, temperature) and hands them to the provider selected by the
+``LLM_PROVIDER`` env var:
+
+- ``openai`` (default): the OpenAI chat completions API through the shared
+  pooled clients in ``llm_client``.
+- ``local``: deterministic offline text with configurable latency, token
+  rate and error injection, for load tests, benchmarks and CI.
+"""
+import asyncio
+import hashlib
+import os
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import AsyncIterator
+
+from llm_client import llm_clients
+
+DEFAULT_MODEL = "gpt-4o-mini"
+
+class Completion:
+    """Text of a finished completion plus its token accounting"""
+
+    def __init__(self, text: str, model: str, prompt_tokens: int = 0, completion_tokens: int = 0):
+        self.text = text
+        self.model = model
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+
+class ProviderConfigurationError(RuntimeError):
+    """LLM_PROVIDER names no known provider (a server misconfiguration, not a bad request)"""
+
+class LLMProvider(ABC):
+    """Interface every provider implements"""
+
+    name = "base"
+
+    def __init__(self, model: str = None):
+        self.model = model or os.getenv("LLM_MODEL", DEFAULT_MODEL)
+
+    @abstractmethod
+    def complete(self, request: dict) -> Completion:
+        """Run a chat request to completion, blocking"""
+
+    @abstractmethod
+    async def acomplete(self, request: dict) -> Completion:
+        """Run a chat request to completion without blocking the event loop"""
+
+    @abstractmethod
+    def astream(self, request: dict) -> AsyncIterator[str]:
+        """Yield text deltas of a chat request as they are produced (an async generator)"""
+
+class OpenAIProvider(LLMProvider):
+    """OpenAI chat completions over the shared pooled clients"""
+
+    name = "openai"
+
+    def _completion(self, response) -> Completion:
+        usage = getattr(response, "usage", None)
+        return Completion(
+            text=response.choices[0].message.content,
+            model=self.model,
+            prompt_tokens=int(getattr(usage, "prompt_tokens", 0) or 0),
+            completion_tokens=int(getattr(usage, "completion_tokens", 0) or 0)
+        )
+
+    def complete(self, request: dict) -> Completion:
+        client = llm_clients.get()
+        return self._completion(client.chat.completions.create(model=self.model, **request))
+
+    async def acomplete(self, request: dict) -> Completion:
+        client = llm_clients.get_async()
+        return self._completion(await client.chat.completions.create(model=self.model, **request))
+
+    async def astream(self, request: dict):
+        # Closing this generator closes the upstream HTTP response, which
+        # stops the model from producing more tokens.
+        client = llm_clients.get_async()
+        stream = await client.chat.completions.create(model=self.model, stream=True, **request)
+        async with stream:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+
+class LocalProviderError(RuntimeError):
+    """Injected failure from the local provider"""
+
+_LOCAL_VOCABULARY = (
+    "the", "a", "and", "of", "to", "in", "was", "that", "with", "as", "for", "his", "her",
+    "they", "light", "shadow", "castle", "sword", "wand", "ship", "storm", "whisper", "ancient",
+    "promise", "betrayal", "hope", "fire", "council", "door", "night", "morning", "silence",
+    "power", "memory", "friend", "enemy", "journey", "secret", "crown", "river", "stars",
+    "suddenly", "slowly", "never", "always", "again", "beyond", "beneath", "against", "toward",
+)
+
+class LocalProvider(LLMProvider):
+    """Deterministic offline stand-in for a real model.
+
+    The same request always yields the same text. Behaviour is tuned with
+    LOCAL_LLM_LATENCY_MS (time to first token), LOCAL_LLM_TOKENS_PER_SECOND
+    (0 = instant), LOCAL_LLM_ERROR_RATE (0-1) and LOCAL_LLM_SEED.
+    """
+
+    name = "local"
+    TOKENS_PER_WORD = 1.3
+    WORDS_PER_MAX_TOKEN = 0.4  # 3000 max_tokens -> ~1200 words, like a medium story
+
+    def __init__(self, model: str = None, latency_ms: float = None, tokens_per_second: float = None,
+                 error_rate: float = None, seed: int = None):
+        super().__init__(model or os.getenv("LLM_MODEL", "local-deterministic"))
+        self.latency = (latency_ms if latency_ms is not None else float(os.getenv("LOCAL_LLM_LATENCY_MS", "0"))) / 1000
+        self.tokens_per_second = tokens_per_second if tokens_per_second is not None else float(
+            os.getenv("LOCAL_LLM_TOKENS_PER_SECOND", "0")
+        )
+        self.error_rate = error_rate if error_rate is not None else float(os.getenv("LOCAL_LLM_ERROR_RATE", "0"))
+        self._errors = random.Random(seed if seed is not None else int(os.getenv("LOCAL_LLM_SEED", "0")))
+        self._errors_lock = threading.Lock()
+
+    def _seed(self, request: dict) -> int:
+        raw = repr((request.get("messages"), request.get("max_tokens")))
+        return int(hashlib.sha256(raw.encode()).hexdigest()[:16], 16)
+
+    def words(self, request: dict) -> list:
+        """The deterministic words this request produces"""
+        rng = random.Random(self._seed(request))
+        count = max(1, int(request.get("max_tokens", 1000) * self.WORDS_PER_MAX_TOKEN))
+        words = [rng.choice(_LOCAL_VOCABULARY) for _ in range(count)]
+        words[0] = words[0].capitalize()
+        return words
+
+    def _maybe_fail(self):
+        with self._errors_lock:
+            roll = self._errors.random()
+        if roll < self.error_rate:
+            raise LocalProviderError("Injected local provider error")
+
+    def _word_delay(self) -> float:
+        return self.TOKENS_PER_WORD / self.tokens_per_second if self.tokens_per_second > 0 else 0
+
+    def _completion(self, request: dict, words: list) -> Completion:
+        prompt_words = sum(len(m.get("content", "").split()) for m in request.get("messages", []))
+        return Completion(
+            text=" ".join(words),
+            model=self.model,
+            prompt_tokens=int(prompt_words * self.TOKENS_PER_WORD),
+            completion_tokens=int(len(words) * self.TOKENS_PER_WORD)
+        )
+
+    def complete(self, request: dict) -> Completion:
+        self._maybe_fail()
+        words = self.words(request)
+        time.sleep(self.latency + self._word_delay() * len(words))
+        return self._completion(request, words)
+
+    async def acomplete(self, request: dict) -> Completion:
+        self._maybe_fail()
+        words = self.words(request)
+        await asyncio.sleep(self.latency + self._word_delay() * len(words))
+        return self._completion(request, words)
+
+    async def astream(self, request: dict):
+        self._maybe_fail()
+        words = self.words(request)
+        delay = self._word_delay()
+        await asyncio.sleep(self.latency)
+        for i, word in enumerate(words):
+            if delay:
+                await asyncio.sleep(delay)
+            yield word if i == 0 else " " + word
+
+PROVIDERS = {
+    OpenAIProvider.name: OpenAIProvider,
+    LocalProvider.name: LocalProvider,
+}
+
+_provider = None
+_pinned = False
+_provider_lock = threading.Lock()
+
+def get_provider() -> LLMProvider:
+    """The provider named by LLM_PROVIDER, created once per process"""
+    global _provider
+    name = os.getenv("LLM_PROVIDER", OpenAIProvider.name).lower()
+    with _provider_lock:
+        if _pinned:
+            return _provider
+        if _provider is None or _provider.name != name:
+            if name not in PROVIDERS:
+                raise ProviderConfigurationError(f"Unknown LLM_PROVIDER '{name}'; expected one of {sorted(PROVIDERS)}")
+            _provider = PROVIDERS[name]()
+        return _provider
+
+def provider_name() -> str:
+    """Name of the provider get_provider() would use, without creating it"""
+    with _provider_lock:
+        if _pinned:
+            return _provider.name
+    return os.getenv("LLM_PROVIDER", OpenAIProvider.name).lower()
+
+def set_provider(provider: LLMProvider):
+    """Pin a provider instance regardless of LLM_PROVIDER (benchmarks, tests); None unpins"""
+    global _provider, _pinned
+    with _provider_lock:
+        _provider = provider
+        _pinned = provider is not None
@@ -0,0 +1,243 @@
+"""
+Process-wide concurrency limit and fair queue for LLM calls.
+
+At most LLM_MAX_CONCURRENCY generations hold a slot at once; everything
+else waits in a queue. Waiters are grouped by priority class, cheapest
+first (system prompts, then short, medium and long stories), and each
+class is served round-robin by session so one client submitting a burst
+of stories cannot starve the others. A waiter queued for longer than
+LLM_PRIORITY_AGING_SECONDS is served ahead of cheaper work, so long
+stories still make progress under a steady stream of short ones.
+
+Before queueing, the wait is estimated from the work ahead and the
+observed duration of each class. If it would exceed
+LLM_QUEUE_DEADLINE_SECONDS the call is refused straight away with
+``SchedulerOverloaded`` (answered as 503 with Retry-After), and a waiter
+still queued at the deadline is refused the same way.
+"""
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import metrics
+
+SYSTEM_PROMPT = "system_prompt"
+PRIORITIES = (SYSTEM_PROMPT, "short", "medium", "long")
+
+# Seconds a slot is expected to be held per class until real timings come in
+DEFAULT_EXPECTED_SECONDS = {SYSTEM_PROMPT: 5.0, "short": 15.0, "medium": 30.0, "long": 45.0}
+EXPECTED_SMOOTHING = 0.2
+
+def priority_for(length: Optional[str]) -> str:
+    """Priority class of a story generation of ``length``"""
+    return length if length in PRIORITIES else "medium"
+
+class SchedulerOverloaded(RuntimeError):
+    """The queue wait for an LLM call would exceed the deadline"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class _Waiter:
+    __slots__ = ("session", "priority", "future", "enqueued")
+
+    def __init__(self, session: str, priority: str, future):
+        self.session = session
+        self.priority = priority
+        self.future = future
+        self.enqueued = time.monotonic()
+
+class Ticket:
+    """A held concurrency slot; hand it back with ``LLMScheduler.release``"""
+    __slots__ = ("priority", "started", "released")
+
+    def __init__(self, priority: str):
+        self.priority = priority
+        self.started = time.monotonic()
+        self.released = False
+
+class LLMScheduler:
+    """Hands out a bounded number of LLM slots in priority and session order"""
+
+    def __init__(self, max_concurrency: int = None, deadline_seconds: float = None, aging_seconds: float = None):
+        self.max_concurrency = max_concurrency if max_concurrency is not None else int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+        self.deadline_seconds = deadline_seconds if deadline_seconds is not None else float(
+            os.getenv("LLM_QUEUE_DEADLINE_SECONDS", "30")
+        )
+        self.aging_seconds = aging_seconds if aging_seconds is not None else float(
+            os.getenv("LLM_PRIORITY_AGING_SECONDS", "10")
+        )
+        self.expected = dict(DEFAULT_EXPECTED_SECONDS)
+        self._queues = {priority: OrderedDict() for priority in PRIORITIES}  # session -> deque of waiters
+        self._running = set()
+        self.rejected = 0
+
+    # Queue state
+
+    @property
+    def in_use(self) -> int:
+        return len(self._running)
+
+    def depth(self, priority: Optional[str] = None) -> int:
+        """Number of queued waiters, overall or in one class"""
+        priorities = PRIORITIES if priority is None else (priority,)
+        return sum(len(waiters) for p in priorities for waiters in self._queues[p].values())
+
+    def estimated_wait(self, priority: str) -> float:
+        """Seconds until a new waiter of ``priority`` would likely get a slot"""
+        if self.in_use < self.max_concurrency and not self.depth():
+            return 0.0
+        now = time.monotonic()
+        remaining = sorted(max(0.0, self.expected[t.priority] - (now - t.started)) for t in self._running)
+        # Waiters in this class and cheaper ones are served first (ignoring round-robin and aging)
+        ahead = sum(
+            self.expected[p] * len(waiters)
+            for p in PRIORITIES[:PRIORITIES.index(priority) + 1]
+            for waiters in self._queues[p].values()
+        )
+        first_free = remaining[0] if remaining and len(remaining) >= self.max_concurrency else 0.0
+        return first_free + ahead / max(1, self.max_concurrency)
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_use": self.in_use,
+            "queued": {priority: self.depth(priority) for priority in PRIORITIES},
+            "estimated_wait_seconds": {priority: round(self.estimated_wait(priority), 3) for priority in PRIORITIES},
+            "rejected": self.rejected
+        }
+
+    # Acquire and release
+
+    def admit(self, priority: str, deadline: Optional[float] = None):
+        """Raise SchedulerOverloaded if a new waiter of ``priority`` would be refused right now"""
+        deadline = self.deadline_seconds if deadline is None else deadline
+        estimate = self.estimated_wait(priority)
+        if estimate > deadline:
+            self._reject(priority, "estimate")
+            raise SchedulerOverloaded(
+                f"LLM queue is full (estimated wait {estimate:.0f}s, deadline {deadline:.0f}s)", estimate
+            )
+
+    async def acquire(self, session: str, priority: str, deadline: Optional[float] = None) -> Ticket:
+        """Wait for a slot; raises SchedulerOverloaded once the wait would pass ``deadline`` seconds.
+
+        ``deadline=math.inf`` waits as long as it takes (background jobs).
+        """
+        deadline = self.deadline_seconds if deadline is None else deadline
+        if self.in_use < self.max_concurrency and not self.depth():
+            metrics.LLM_QUEUE_WAIT.observe(0.0, priority=priority)
+            return self._grant(priority)
+
+        self.admit(priority, deadline)
+        waiter = _Waiter(session, priority, asyncio.get_running_loop().create_future())
+        self._queues[priority].setdefault(session, deque()).append(waiter)
+        try:
+            await asyncio.wait_for(waiter.future, None if math.isinf(deadline) else deadline)
+        except asyncio.TimeoutError:
+            self._discard(waiter)
+            self._reject(priority, "timeout")
+            raise SchedulerOverloaded(
+                f"Waited {deadline:.0f}s for an LLM slot", self.estimated_wait(priority) or deadline
+            )
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self.release(waiter.future.result())
+            else:
+                self._discard(waiter)
+            raise
+        metrics.LLM_QUEUE_WAIT.observe(time.monotonic() - waiter.enqueued, priority=priority)
+        return waiter.future.result()
+
+    def release(self, ticket: Ticket):
+        """Give a slot back and hand it to the next waiter (idempotent)"""
+        if ticket.released:
+            return
+        ticket.released = True
+        self._running.discard(ticket)
+        held = time.monotonic() - ticket.started
+        self.expected[ticket.priority] += EXPECTED_SMOOTHING * (held - self.expected[ticket.priority])
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, session: str, priority: str, deadline: Optional[float] = None):
+        """Hold a slot for the duration of the ``async with`` block"""
+        ticket = await self.acquire(session, priority, deadline)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    async def stream(self, chunks, session: str, priority: str, deadline: Optional[float] = None):
+        """Relay ``chunks`` while holding a slot, acquired when the first chunk is requested.
+
+        Acquiring and releasing share one try/finally inside the generator,
+        so a response body that is never iterated never holds a slot.
+        """
+        try:
+            async with self.slot(session, priority, deadline):
+                async for chunk in chunks:
+                    yield chunk
+        finally:
+            await chunks.aclose()
+
+    def _grant(self, priority: str) -> Ticket:
+        ticket = Ticket(priority)
+        self._running.add(ticket)
+        return ticket
+
+    def _reject(self, priority: str, reason: str):
+        self.rejected += 1
+        metrics.LLM_QUEUE_REJECTED.inc(priority=priority, reason=reason)
+
+    def _discard(self, waiter: _Waiter):
+        waiters = self._queues[waiter.priority].get(waiter.session)
+        if waiters is None:
+            return
+        try:
+            waiters.remove(waiter)
+        except ValueError:
+            pass
+        if not waiters:
+            del self._queues[waiter.priority][waiter.session]
+
+    def _next_waiter(self) -> Optional[_Waiter]:
+        """Pop the waiter to serve next: an aged one, else round-robin in the cheapest non-empty class"""
+        heads = [waiters[0] for p in PRIORITIES for waiters in self._queues[p].values()]
+        if not heads:
+            return None
+        oldest = min(heads, key=lambda waiter: waiter.enqueued)
+        if time.monotonic() - oldest.enqueued >= self.aging_seconds:
+            priority, session = oldest.priority, oldest.session
+        else:
+            priority = next(p for p in PRIORITIES if self._queues[p])
+            session = next(iter(self._queues[priority]))
+        sessions = self._queues[priority]
+        waiter = sessions[session].popleft()
+        if sessions[session]:
+            sessions.move_to_end(session)  # the session goes to the back of the rotation
+        else:
+            del sessions[session]
+        return waiter
+
+    def _dispatch(self):
+        while self.in_use < self.max_concurrency:
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+            if waiter.future.done():  # timed out or cancelled while queued
+                continue
+            waiter.future.set_result(self._grant(waiter.priority))
+
+llm_scheduler = LLMScheduler()
+
+@metrics.registry.collector
+def _queue_gauges():
+    for priority in PRIORITIES:
+        metrics.LLM_QUEUE_DEPTH.set(llm_scheduler.depth(priority), priority=priority)
+    metrics.LLM_SLOTS_IN_USE.set(llm_scheduler.in_use)
@@ -1,25 +1,45 @@
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, HTTPException, Depends, Header
+from fastapi import FastAPI, HTTPException, Depends, Header, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
+from fastapi.responses import JSONResponse
+from sqlalchemy.orm import Session, defer
 from sqlalchemy import func, text, inspect
 from pydantic import BaseModel
 from typing import List, Optional
 from datetime import datetime
+import asyncio
 import os
 from dotenv import load_dotenv
 from pathlib import Path
 
-from database import get_db, Story, Rating, engine
-from story_generator import generate_story, get_available_universes
+from database import get_db, get_engine, on_engine_created, SessionLocal, Story, Rating, GenerationJob, save_rating, average_from_aggregates, RATING_VALUES
+from story_generator import generate_story_async, stream_story, get_available_universes, validate_story_request
+from streaming import story_stream_response, replay_text
+from generation_cache import generation_cache, scenario_key
+from universe_prompts import universe_prompts
+from single_flight import single_flight
+from llm_client import llm_clients
+from llm_providers import provider_name
 import migrate_db
+import trending
+import history
+import search
+from leaderboard import leaderboard
+from jobs import job_queue, job_status, SUCCEEDED
+import metrics
+import query_budget
+import http_cache
+import story_codec
+from rating_buffer import rating_buffer
+from rate_limit import RateLimitMiddleware, client_key
+from llm_scheduler import llm_scheduler, priority_for, SchedulerOverloaded
 
 env_path = Path(__file__).resolve().parent / ".env"
 load_dotenv(dotenv_path=env_path)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Run database migration on startup
+    # Create missing tables and apply pending migrations (one indexed read when up to date)
     try:
         print("🚀 Starting database migration...")
         migrate_db.migrate()
@@ -29,10 +49,43 @@ async def lifespan(app: FastAPI):
         # We don't exit here so the app can try to start, 
         # but in production you might want to fail hard.
         # Given the user's issue, let's log loudly.
+
+    leaderboard_task = asyncio.create_task(leaderboard.run())
+    job_queue.start()
+    rating_buffer.start()
     yield
+    await rating_buffer.stop()
+    await job_queue.stop()
+    leaderboard_task.cancel()
+    try:
+        await leaderboard_task
+    except asyncio.CancelledError:
+        pass
+    await llm_clients.aclose()
 
 app = FastAPI(title="What If Novel AI", version="2.0.0", lifespan=lifespan)
 
+# Middleware added later wraps the earlier ones: metrics see every
+# response, and CORS headers are applied to rate-limited responses too.
+
+# Query budgets: hot read paths are held to a couple of queries, everything
+# else to QUERY_BUDGET; repeated statement shapes are flagged as N+1
+ROUTE_QUERY_BUDGETS = {
+    "/story/history": 2,
+    "/story/trending": 2,
+    "/story/search": 1,
+    "/story/{story_id}": 2,
+    "/story/{story_id}/text": 1,
+    "/story/{story_id}/ratings": 1,
+    "/ratings": 1,
+    "/story/share/{token}": 2,
+}
+on_engine_created(query_budget.instrument_engine)
+app.add_middleware(query_budget.QueryBudgetMiddleware, router_app=app, route_budgets=ROUTE_QUERY_BUDGETS)
+
+# Per-client token buckets, tight for generation and loose for reads (see rate_limit.py)
+app.add_middleware(RateLimitMiddleware, router_app=app)
+
 # CORS for frontend
 app.add_middleware(
     CORSMiddleware,
@@ -42,12 +95,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request latency, in-flight and per-request query metrics for /metrics
+on_engine_created(metrics.instrument_engine)
+app.add_middleware(metrics.MetricsMiddleware, router_app=app)
+
 # Request/Response models
 class StoryRequest(BaseModel):
     universe: str
     what_if: str
     length: str = "medium"
     system_prompt: Optional[str] = None
+    fresh: bool = False  # skip the generation cache and always call the model
 
 class RatingRequest(BaseModel):
     rating: int
@@ -65,6 +123,66 @@ class StoryResponse(BaseModel):
     created_at: str
     share_url: Optional[str] = None
 
+def story_response(story: Story, share_url: Optional[str] = None) -> StoryResponse:
+    """Build the API representation of a stored story"""
+    return StoryResponse(
+        id=story.id,
+        universe=story.universe,
+        what_if=story.what_if,
+        story=story.story,
+        word_count=story.word_count,
+        rating=story.rating,
+        average_rating=story.average_rating,
+        rating_count=story.rating_count,
+        created_at=story.created_at.isoformat(),
+        share_url=share_url
+    )
+
+class StoryMetaResponse(BaseModel):
+    """Volatile fields of a story; the text is served separately from text_url"""
+    id: int
+    rating: int
+    average_rating: float
+    rating_count: int
+    share_url: Optional[str] = None
+    text_url: str
+
+class StoryTextResponse(BaseModel):
+    """Fields of a story that never change once it is stored"""
+    id: int
+    universe: str
+    what_if: str
+    story: str
+    word_count: int
+    created_at: str
+
+def find_story(db: Session, criterion, with_text: bool = True) -> Optional[Story]:
+    """Load one story, leaving the text unloaded when the response may not need it"""
+    query = db.query(Story).filter(criterion)
+    if not with_text:
+        query = query.options(defer(Story.story_text), defer(Story.story_blob))
+    return query.first()
+
+def cached_story_response(response: Response, story: Story, share_url: Optional[str],
+                          if_none_match: Optional[str], split: bool):
+    """Story response with ETag and Cache-Control, or 304 when the client's copy is current"""
+    etag = http_cache.story_etag(story, shared=share_url is not None, split=split)
+    headers = {"ETag": etag, "Cache-Control": http_cache.story_cache_control()}
+    if http_cache.etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    if split:
+        meta = StoryMetaResponse(
+            id=story.id,
+            rating=story.rating,
+            average_rating=story.average_rating,
+            rating_count=story.rating_count,
+            share_url=share_url,
+            text_url=f"/story/{story.id}/text"
+        )
+        return JSONResponse(meta.model_dump(), headers=headers)
+    response.headers.update(headers)
+    return story_response(story, share_url=share_url)
+
 class RatingStats(BaseModel):
     average: float
     count: int
@@ -75,6 +193,7 @@ class RatingStats(BaseModel):
 def debug_schema():
     """Debug endpoint to show database columns"""
     try:
+        engine = get_engine()
         inspector = inspect(engine)
         columns = [col['name'] for col in inspector.get_columns('stories')]
         return {
@@ -85,6 +204,21 @@ def debug_schema():
     except Exception as e:
         return {"error": str(e)}
 
+@app.get("/debug/generation")
+def debug_generation():
+    """Debug endpoint with generation cache and request coalescing counters"""
+    return {
+        "llm_provider": provider_name(),
+        "cache": generation_cache.stats(),
+        "single_flight": single_flight.stats(),
+        "scheduler": llm_scheduler.stats()
+    }
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """Process metrics in the Prometheus text format"""
+    return Response(content=metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
 @app.get("/")
 def root():
     return {
@@ -95,6 +229,9 @@ def root():
             "generate": "/story/generate",
             "history": "/story/history",
             "trending": "/story/trending",
+            "search": "/story/search?q=",
+            "jobs": "/story/jobs",
+            "ratings": "/ratings?story_ids=1,2,3",
             "share": "/story/share/{token}"
         }
     }
@@ -107,111 +244,297 @@ def list_universes():
         "count": len(get_available_universes())
     }
 
+def save_story(db: Session, story: Story) -> Story:
+    """Insert a newly generated story and reload its server-side defaults"""
+    db.add(story)
+    db.commit()
+    db.refresh(story)
+    if story.scenario_hash:
+        generation_cache.remember(story.scenario_hash, story.id)
+    return story
+
+def save_new_story(bind, story: Story) -> int:
+    """Insert a generated story in a session of its own and return its id.
+
+    Generations shared through single_flight keep running after the request
+    that started them is gone, so they must not use that request's session.
+    """
+    scenario_hash = story.scenario_hash
+    with SessionLocal(bind=bind) as db:
+        db.add(story)
+        db.flush()
+        story_id = story.id
+        db.commit()
+    if scenario_hash:
+        generation_cache.remember(scenario_hash, story_id)
+    return story_id
+
+def find_cached_story(db: Session, request: StoryRequest, key: str) -> Optional[Story]:
+    """Reuse a stored variant for this scenario unless the client asked for a fresh one"""
+    if request.fresh:
+        return None
+    return generation_cache.find(db, key)
+
+def overloaded(e: SchedulerOverloaded) -> HTTPException:
+    """503 for a generation the LLM scheduler turned away"""
+    return HTTPException(
+        status_code=503,
+        detail=str(e),
+        headers={"Retry-After": str(max(1, round(e.retry_after)))}
+    )
+
+async def coalesce(request: StoryRequest, key: str, generate) -> int:
+    """Run ``generate`` (returning a story id) once for concurrent identical requests.
+
+    Requests with fresh=true always generate their own variant.
+    """
+    if request.fresh:
+        return await generate()
+    return await single_flight.do(key, generate)
+
 @app.post("/story/generate", response_model=StoryResponse)
-def create_story(request: StoryRequest, db: Session = Depends(get_db)):
+async def create_story(request: StoryRequest, http_request: Request, db: Session = Depends(get_db)):
     """Generate a new 'what if' story"""
     
     try:
-        result = generate_story(
-            universe=request.universe,
-            what_if=request.what_if,
-            length=request.length
-        )
+        # Reject bad requests here rather than after they have waited for an LLM slot
+        validate_story_request(request.universe, request.what_if)
+        key = scenario_key(request.universe, request.what_if, request.length)
+        cached = await asyncio.to_thread(find_cached_story, db, request, key)
+        if cached is not None:
+            return story_response(cached)
         
-        db_story = Story(
-            universe=request.universe,
-            what_if=request.what_if,
-            story=result["story"],
-            word_count=result["word_count"]
-        )
-        db.add(db_story)
-        db.commit()
-        db.refresh(db_story)
+        bind = db.get_bind()
+
+        async def generate() -> int:
+            async with llm_scheduler.slot(client_key(http_request.scope), priority_for(request.length)):
+                result = await generate_story_async(
+                    universe=request.universe,
+                    what_if=request.what_if,
+                    length=request.length
+                )
+            
+            db_story = Story(
+                universe=request.universe,
+                what_if=request.what_if,
+                story=result["story"],
+                word_count=result["word_count"],
+                scenario_hash=key
+            )
+            # Sessions are synchronous; keep their I/O off the event loop
+            return await asyncio.to_thread(save_new_story, bind, db_story)
         
-        return StoryResponse(
-            id=db_story.id,
-            universe=db_story.universe,
-            what_if=db_story.what_if,
-            story=db_story.story,
-            word_count=db_story.word_count,
-            rating=db_story.rating,
-            average_rating=db_story.average_rating,
-            rating_count=db_story.rating_count,
-            created_at=db_story.created_at.isoformat()
-        )
+        story_id = await coalesce(request, key, generate)
+        db_story = await asyncio.to_thread(db.get, Story, story_id)
+        return story_response(db_story)
         
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+    except SchedulerOverloaded as e:
+        raise overloaded(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Story generation failed: {str(e)}")
 
-@app.get("/story/history")
-def get_history(limit: int = 20, db: Session = Depends(get_db)):
-    """Get recent stories"""
-    stories = db.query(Story).filter(Story.is_public == True).order_by(Story.created_at.desc()).limit(limit).all()
-    
+@app.post("/story/generate/stream")
+async def create_story_stream(request: StoryRequest, http_request: Request, db: Session = Depends(get_db)):
+    """Generate a new 'what if' story, streaming tokens as Server-Sent Events"""
+    try:
+        chunks = stream_story(
+            universe=request.universe,
+            what_if=request.what_if,
+            length=request.length
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    key = scenario_key(request.universe, request.what_if, request.length)
+    return await _stream_or_replay(http_request, request, db, key, chunks, Story(
+        universe=request.universe,
+        what_if=request.what_if,
+        scenario_hash=key
+    ))
+
+async def _stream_or_replay(http_request: Request, request: StoryRequest, db: Session, key: str, chunks, story: Story):
+    """Relay a fresh generation, or replay a cached or in-flight story through the same SSE events"""
+    cached = await asyncio.to_thread(find_cached_story, db, request, key)
+    if cached is None and not request.fresh and single_flight.in_flight(key) is not None:
+        # An identical non-streaming generation is running; wait for it instead
+        try:
+            story_id = await single_flight.join(key)
+        except Exception:
+            story_id = None
+        if story_id is not None:
+            cached = await asyncio.to_thread(db.get, Story, story_id)
+    if cached is not None:
+        await chunks.aclose()
+        payload = story_response(cached).model_dump(exclude={"story"})
+        return story_stream_response(http_request, replay_text(cached.story), lambda story_text: payload)
+
+    # Refuse with a 503 now if the queue is full; the LLM slot itself is taken
+    # when the body starts streaming and held until the relay ends
+    priority = priority_for(request.length)
+    try:
+        llm_scheduler.admit(priority)
+    except SchedulerOverloaded as e:
+        await chunks.aclose()
+        raise overloaded(e)
+    chunks = llm_scheduler.stream(chunks, client_key(http_request.scope), priority)
+
+    def persist(story_text: str) -> dict:
+        story.story = story_text
+        story.word_count = len(story_text.split())
+        return story_response(save_story(db, story)).model_dump(exclude={"story"})
+
+    return story_stream_response(http_request, chunks, persist)
+
+@app.post("/story/jobs", status_code=202)
+def submit_story_job(request: StoryRequest, db: Session = Depends(get_db)):
+    """Queue a story generation and return its job id immediately"""
+    job = job_queue.submit(
+        db,
+        universe=request.universe,
+        what_if=request.what_if,
+        length=request.length,
+        system_prompt=request.system_prompt,
+        fresh=request.fresh
+    )
     return {
-        "count": len(stories),
-        "stories": [
-            {
-                "id": s.id,
-                "universe": s.universe,
-                "what_if": s.what_if,
-                "word_count": s.word_count,
-                "rating": s.rating,
-                "average_rating": s.average_rating,
-                "rating_count": s.rating_count,
-                "created_at": s.created_at.isoformat()
-            }
-            for s in stories
-        ]
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/story/jobs/{job.id}"
     }
 
+@app.get("/story/jobs/{job_id}")
+def get_story_job(job_id: str, db: Session = Depends(get_db)):
+    """Get the status of a generation job, with the story once it succeeded"""
+    job = db.query(GenerationJob).filter(GenerationJob.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    result = job_status(job)
+    if job.status == SUCCEEDED and job.story is not None:
+        result["story"] = story_response(job.story)
+    return result
+
+@app.get("/story/history")
+def get_history(limit: int = history.DEFAULT_LIMIT, cursor: Optional[str] = None, db: Session = Depends(get_db)):
+    """Get recent stories, paging backwards with the returned next_cursor"""
+    try:
+        return history.get_history_page(db, limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.get("/story/trending")
-def trending_stories(db: Session = Depends(get_db)):
+def trending_stories(
+    response: Response,
+    limit: int = trending.DEFAULT_LIMIT,
+    universe: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
     """Get top rated stories"""
-    stories = db.query(Story).filter(Story.is_public == True).all()
-    
-    # Sort by average rating and rating count
-    sorted_stories = sorted(
-        stories,
-        key=lambda s: (s.average_rating, s.rating_count),
-        reverse=True
-    )[:10]
-    
+    limit = trending.clamp_limit(limit)
+    snapshot = leaderboard.snapshot
+    stories = snapshot.get(universe, limit) if snapshot else None
+    metrics.record_cache("trending_snapshot", hit=stories is not None)
+
+    if stories is None:
+        # No snapshot yet (or an unknown universe): answer from the live index
+        return {"stories": trending.get_trending(db, limit=limit, universe=universe)}
+
+    headers = {"ETag": snapshot.etag, "Cache-Control": "no-cache"}
+    if http_cache.etag_matches(if_none_match, snapshot.etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
     return {
-        "stories": [
-            {
-                "id": s.id,
-                "universe": s.universe,
-                "what_if": s.what_if,
-                "average_rating": s.average_rating,
-                "rating_count": s.rating_count,
-                "word_count": s.word_count
-            }
-            for s in sorted_stories
-        ]
+        "stories": stories,
+        "version": snapshot.version,
+        "generated_at": snapshot.generated_at.isoformat()
     }
 
+@app.get("/story/search")
+def search_stories(
+    q: str,
+    universe: Optional[str] = None,
+    limit: int = search.DEFAULT_LIMIT,
+    offset: int = 0,
+    db: Session = Depends(get_db)
+):
+    """Full-text search over scenarios and story text, best matches first"""
+    try:
+        return search.search_stories(db, q, universe=universe, limit=limit, offset=offset)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.get("/story/{story_id}", response_model=StoryResponse)
-def get_story(story_id: int, db: Session = Depends(get_db)):
-    """Get a specific story"""
-    story = db.query(Story).filter(Story.id == story_id).first()
+def get_story(
+    story_id: int,
+    response: Response,
+    split: bool = False,
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
+    """Get a specific story (``split=true`` returns only the rating fields, see http_cache.py)"""
+    # A revalidation that ends in 304 never needs the text
+    story = find_story(db, Story.id == story_id, with_text=not (split or if_none_match))
     
     if not story:
         raise HTTPException(status_code=404, detail="Story not found")
     
-    return StoryResponse(
+    share_url = f"/share/{story.share_token}" if story.share_token else None
+    return cached_story_response(response, story, share_url, if_none_match, split)
+
+PLAIN_TEXT = "text/plain; charset=utf-8"
+
+@app.get("/story/{story_id}/text", response_model=StoryTextResponse)
+def get_story_text(
+    story_id: int,
+    response: Response,
+    format: str = "json",
+    if_none_match: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
+    """Get the immutable part of a story; cacheable for a year.
+
+    ``format=plain`` returns only the text as text/plain, sending the stored
+    gzip bytes as they are to clients that accept gzip.
+    """
+    if format not in ("json", "plain"):
+        raise HTTPException(status_code=400, detail="format must be json or plain")
+    plain = format == "plain"
+    gzip_ok = plain and http_cache.accepts_encoding(accept_encoding, story_codec.GZIP)
+    variant = ("plain-gzip" if gzip_ok else "plain") if plain else None
+    headers = {"ETag": http_cache.text_etag(story_id, variant), "Cache-Control": http_cache.IMMUTABLE_CACHE_CONTROL}
+    if plain:
+        headers["Vary"] = "Accept-Encoding"
+    if http_cache.etag_matches(if_none_match, headers["ETag"]):
+        # Stories are never edited, so a client holding this tag has the current text
+        return Response(status_code=304, headers=headers)
+    
+    if plain:
+        row = db.query(Story.story_text, Story.story_blob, Story.story_codec).filter(Story.id == story_id).first()
+        if not row:
+            raise HTTPException(status_code=404, detail="Story not found")
+        if gzip_ok and row.story_codec == story_codec.GZIP:
+            return Response(row.story_blob, media_type=PLAIN_TEXT, headers={**headers, "Content-Encoding": "gzip"})
+        # Stored uncompressed (or the client wants identity): decode once and send plain text
+        headers["ETag"] = http_cache.text_etag(story_id, "plain")
+        text = story_codec.decompress(row.story_blob, row.story_codec) if row.story_codec else row.story_text
+        return Response(text or "", media_type=PLAIN_TEXT, headers=headers)
+    
+    story = find_story(db, Story.id == story_id)
+    if not story:
+        raise HTTPException(status_code=404, detail="Story not found")
+    
+    response.headers.update(headers)
+    return StoryTextResponse(
         id=story.id,
         universe=story.universe,
         what_if=story.what_if,
         story=story.story,
         word_count=story.word_count,
-        rating=story.rating,
-        average_rating=story.average_rating,
-        rating_count=story.rating_count,
-        created_at=story.created_at.isoformat(),
-        share_url=f"/share/{story.share_token}" if story.share_token else None
+        created_at=story.created_at.isoformat()
     )
 
 @app.post("/story/{story_id}/rate")
@@ -220,55 +543,64 @@ def rate_story(story_id: int, request: RatingRequest, db: Session = Depends(get_
     if request.rating < 1 or request.rating > 5:
         raise HTTPException(status_code=400, detail="Rating must be between 1 and 5")
     
-    story = db.query(Story).filter(Story.id == story_id).first()
-    if not story:
-        raise HTTPException(status_code=404, detail="Story not found")
-    
-    # Check if this session already rated this story
-    existing_rating = db.query(Rating).filter(
-        Rating.story_id == story_id,
-        Rating.session_id == request.session_id
-    ).first()
-    
-    if existing_rating:
-        # Update existing rating
-        existing_rating.rating_value = request.rating
-        existing_rating.updated_at = datetime.utcnow()
+    if rating_buffer.enabled:
+        # Written by the background flusher, which also bumps the leaderboard; the aggregates returned are optimistic
+        change = rating_buffer.submit(db, story_id, request.session_id, request.rating)
     else:
-        # Create new rating
-        new_rating = Rating(
-            story_id=story_id,
-            session_id=request.session_id,
-            rating_value=request.rating
-        )
-        db.add(new_rating)
-    
+        # One upsert on the (story_id, session_id) unique index; aggregates are adjusted in the same transaction
+        change = save_rating(db.connection(), story_id, request.session_id, request.rating)
+    if change is None:
+        db.rollback()
+        raise HTTPException(status_code=404, detail="Story not found")
     db.commit()
-    db.refresh(story)
+    if not rating_buffer.enabled:
+        leaderboard.note_score_change(change["previous_score"], change["trending_score"])
     
     return {
         "message": "Rating saved",
-        "average_rating": story.average_rating,
-        "rating_count": story.rating_count
+        "average_rating": average_from_aggregates(change["rating_sum"], change["rating_count"]),
+        "rating_count": change["rating_count"]
     }
 
+# Stored aggregates behind the rating statistics endpoints
+RATING_STATS_COLUMNS = [Story.id, Story.rating_sum, Story.rating_count] + [
+    getattr(Story, f"stars_{value}") for value in RATING_VALUES
+]
+MAX_RATING_BATCH = 100
+
+def rating_stats(row) -> RatingStats:
+    """Rating statistics from a row of RATING_STATS_COLUMNS"""
+    return RatingStats(
+        average=average_from_aggregates(row.rating_sum, row.rating_count),
+        count=row.rating_count,
+        distribution={value: getattr(row, f"stars_{value}") for value in RATING_VALUES}
+    )
+
 @app.get("/story/{story_id}/ratings", response_model=RatingStats)
 def get_story_ratings(story_id: int, db: Session = Depends(get_db)):
     """Get rating statistics for a story"""
-    story = db.query(Story).filter(Story.id == story_id).first()
-    if not story:
+    row = db.query(*RATING_STATS_COLUMNS).filter(Story.id == story_id).first()
+    if not row:
         raise HTTPException(status_code=404, detail="Story not found")
     
-    # Calculate distribution
-    distribution = {1: 0, 2: 0, 3: 0, 4: 0, 5: 0}
-    for rating in story.ratings:
-        distribution[rating.rating_value] += 1
+    return rating_stats(row)
+
+@app.get("/ratings")
+def get_ratings_batch(story_ids: str, db: Session = Depends(get_db)):
+    """Rating statistics for many stories in one query (``story_ids=1,2,3``)"""
+    try:
+        ids = list(dict.fromkeys(int(part) for part in story_ids.split(",") if part.strip()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="story_ids must be a comma-separated list of integers")
+    if len(ids) > MAX_RATING_BATCH:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_RATING_BATCH} story_ids per request")
     
-    return RatingStats(
-        average=story.average_rating,
-        count=story.rating_count,
-        distribution=distribution
-    )
+    rows = db.query(*RATING_STATS_COLUMNS).filter(Story.id.in_(ids)).all() if ids else []
+    found = {row.id: rating_stats(row) for row in rows}
+    return {
+        "ratings": {story_id: found[story_id] for story_id in ids if story_id in found},
+        "missing": [story_id for story_id in ids if story_id not in found]
+    }
 
 @app.post("/story/{story_id}/share")
 def generate_share_link(story_id: int, db: Session = Depends(get_db)):
@@ -286,82 +618,116 @@ def generate_share_link(story_id: int, db: Session = Depends(get_db)):
     }
 
 @app.get("/story/share/{token}", response_model=StoryResponse)
-def get_shared_story(token: str, db: Session = Depends(get_db)):
+def get_shared_story(
+    token: str,
+    response: Response,
+    split: bool = False,
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
     """Get a story by its share token (public access)"""
-    story = db.query(Story).filter(Story.share_token == token).first()
+    story = find_story(db, Story.share_token == token, with_text=not (split or if_none_match))
     
     if not story:
         raise HTTPException(status_code=404, detail="Story not found")
     
-    return StoryResponse(
-        id=story.id,
-        universe=story.universe,
-        what_if=story.what_if,
-        story=story.story,
-        word_count=story.word_count,
-        rating=story.rating,
-        average_rating=story.average_rating,
-        rating_count=story.rating_count,
-        created_at=story.created_at.isoformat(),
-        share_url=f"/share/{token}"
-    )
+    return cached_story_response(response, story, f"/share/{token}", if_none_match, split)
 
 class UniversePromptRequest(BaseModel):
     universe: str
+    regenerate: bool = False  # ignore the stored prompt and ask the model again
 
 @app.post("/universe/system-prompt")
-def generate_system_prompt(request: UniversePromptRequest):
-    """Generate a system prompt for a custom universe"""
+async def generate_system_prompt(request: UniversePromptRequest, http_request: Request, db: Session = Depends(get_db)):
+    """Get (generating and storing on first use) the system prompt for a custom universe"""
     try:
-        from story_generator import generate_universe_prompt
-        prompt = generate_universe_prompt(request.universe)
-        return {"universe": request.universe, "system_prompt": prompt}
+        prompt, cached = await universe_prompts.get_or_generate(
+            db, request.universe, regenerate=request.regenerate, session=client_key(http_request.scope)
+        )
+        return {"universe": request.universe, "system_prompt": prompt, "cached": cached}
+    except SchedulerOverloaded as e:
+        raise overloaded(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to generate system prompt: {str(e)}")
 
+@app.delete("/universe/system-prompt/{universe}")
+def invalidate_system_prompt(universe: str, db: Session = Depends(get_db)):
+    """Forget the stored system prompt so the next request generates a new one"""
+    if not universe_prompts.invalidate(db, universe):
+        raise HTTPException(status_code=404, detail="No stored system prompt for this universe")
+    return {"universe": universe, "deleted": True}
+
 @app.post("/story/generate-custom")
-def generate_custom_story(request: StoryRequest, db: Session = Depends(get_db)):
+async def generate_custom_story(request: StoryRequest, http_request: Request, db: Session = Depends(get_db)):
     """Generate a story for a custom universe"""
     try:
-        from story_generator import generate_story_with_prompt
-        
-
-        
-        system_prompt = request.system_prompt or f"You are an expert in the {request.universe} universe. Write in the style of {request.universe}."
+        from story_generator import generate_story_with_prompt_async
         
-        story_text = generate_story_with_prompt(
-            universe=request.universe,
-            system_prompt=system_prompt,
-            what_if=request.what_if,
-            length=request.length
-        )
+        validate_story_request(request.universe, request.what_if, custom=True)
+        system_prompt = await asyncio.to_thread(universe_prompts.resolve, db, request.universe, request.system_prompt)
+        key = scenario_key(request.universe, request.what_if, request.length, system_prompt)
+        cached = await asyncio.to_thread(find_cached_story, db, request, key)
+        if cached is not None:
+            return story_response(cached)
         
-        story = Story(
-            universe=request.universe,
-            what_if=request.what_if,
-            story=story_text,
-            word_count=len(story_text.split()),
-            rating=0,
-            created_at=datetime.now()
-        )
-        db.add(story)
-        db.commit()
-        db.refresh(story)
+        bind = db.get_bind()
+
+        async def generate() -> int:
+            async with llm_scheduler.slot(client_key(http_request.scope), priority_for(request.length)):
+                story_text = await generate_story_with_prompt_async(
+                    universe=request.universe,
+                    system_prompt=system_prompt,
+                    what_if=request.what_if,
+                    length=request.length
+                )
+            
+            story = Story(
+                universe=request.universe,
+                what_if=request.what_if,
+                story=story_text,
+                word_count=len(story_text.split()),
+                rating=0,
+                created_at=datetime.now(),
+                scenario_hash=key
+            )
+            return await asyncio.to_thread(save_new_story, bind, story)
         
-        return StoryResponse(
-            id=story.id,
-            universe=story.universe,
-            what_if=story.what_if,
-            story=story.story,
-            word_count=story.word_count,
-            rating=story.rating,
-            average_rating=story.average_rating,
-            rating_count=story.rating_count,
-            created_at=story.created_at.isoformat()
-        )
+        story_id = await coalesce(request, key, generate)
+        story = await asyncio.to_thread(db.get, Story, story_id)
+        return story_response(story)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except SchedulerOverloaded as e:
+        raise overloaded(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to generate story: {str(e)}")
 
+@app.post("/story/generate-custom/stream")
+async def generate_custom_story_stream(request: StoryRequest, http_request: Request, db: Session = Depends(get_db)):
+    """Generate a custom universe story, streaming tokens as Server-Sent Events"""
+    from story_generator import stream_story_with_prompt
+
+    try:
+        validate_story_request(request.universe, request.what_if, custom=True)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    system_prompt = await asyncio.to_thread(universe_prompts.resolve, db, request.universe, request.system_prompt)
+    chunks = stream_story_with_prompt(
+        universe=request.universe,
+        system_prompt=system_prompt,
+        what_if=request.what_if,
+        length=request.length
+    )
+
+    key = scenario_key(request.universe, request.what_if, request.length, system_prompt)
+    return await _stream_or_replay(http_request, request, db, key, chunks, Story(
+        universe=request.universe,
+        what_if=request.what_if,
+        rating=0,
+        created_at=datetime.now(),
+        scenario_hash=key
+    ))
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,369 @@
+"""
+In-process metrics in the Prometheus text exposition format.
+
+A small registry of counters, gauges and histograms, enough to expose
+request latency, database query, LLM and cache metrics on ``/metrics``
+without another dependency. Values live in this process only, so each
+uvicorn worker exposes its own series.
+
+- ``MetricsMiddleware`` times every request per route template and tracks
+  requests in flight.
+- ``instrument_engine`` hooks SQLAlchemy cursor events to count and time
+  queries, both globally and per HTTP request.
+- ``observe_completion`` / ``instrument_stream`` record LLM latency, time
+  to first token and token counts per model and universe.
+- ``record_cache`` counts cache hits and misses; hit ratios are derived
+  when the metrics are rendered.
+"""
+import contextvars
+import threading
+import time
+from typing import Optional
+
+from sqlalchemy import event
+from starlette.routing import Match
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+LLM_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 60.0, 120.0)
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._samples(key, value))
+        return lines
+
+    def _samples(self, key: tuple, value) -> list:
+        return [f"{self.name}{_labels(self.labelnames, key)} {_format_value(value)}"]
+
+class Counter(_Metric):
+    """Monotonically increasing value per label set"""
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+class Gauge(_Metric):
+    """Value that can go up and down per label set"""
+    kind = "gauge"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+class Histogram(_Metric):
+    """Cumulative bucket counts, sum and count per label set"""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["buckets"][i] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return state["count"] if state else 0
+
+    def _samples(self, key: tuple, state) -> list:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, state["buckets"]):
+            cumulative += count
+            le = f'le="{_format_value(bound)}"'
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+        labels = _labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(state['sum'])}")
+        lines.append(f"{self.name}_count{labels} {state['count']}")
+        return lines
+
+class Registry:
+    """Holds every metric and renders them for a scrape"""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, fn):
+        """Register ``fn`` to refresh gauges right before each render"""
+        self._collectors.append(fn)
+        return fn
+
+    def render(self) -> str:
+        for fn in self._collectors:
+            fn()
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        for metric in self._metrics:
+            metric.clear()
+
+registry = Registry()
+
+HTTP_REQUESTS = registry.counter(
+    "http_requests_total", "HTTP requests by route template and status", ("method", "route", "status"))
+HTTP_LATENCY = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template", ("method", "route"))
+HTTP_IN_FLIGHT = registry.gauge(
+    "http_requests_in_flight", "HTTP requests currently being served", ("method", "route"))
+HTTP_DB_QUERIES = registry.histogram(
+    "http_request_db_queries", "Database queries issued per HTTP request", ("method", "route"), QUERY_COUNT_BUCKETS)
+HTTP_DB_SECONDS = registry.histogram(
+    "http_request_db_seconds", "Time spent in database queries per HTTP request", ("method", "route"), QUERY_BUCKETS)
+
+DB_QUERIES = registry.counter("db_queries_total", "Database queries by statement type", ("operation",))
+DB_LATENCY = registry.histogram(
+    "db_query_duration_seconds", "Database query latency by statement type", ("operation",), QUERY_BUCKETS)
+
+LLM_REQUESTS = registry.counter(
+    "llm_requests_total", "LLM calls by model, universe, mode and outcome", ("model", "universe", "mode", "outcome"))
+LLM_LATENCY = registry.histogram(
+    "llm_request_duration_seconds", "LLM call latency until the last token", ("model", "universe", "mode"), LLM_BUCKETS)
+LLM_TTFT = registry.histogram(
+    "llm_time_to_first_token_seconds", "Time until the first streamed token", ("model", "universe"), LLM_BUCKETS)
+LLM_TOKENS = registry.counter(
+    "llm_tokens_total", "LLM tokens by model, universe and kind (prompt or completion)", ("model", "universe", "kind"))
+
+LLM_QUEUE_DEPTH = registry.gauge("llm_queue_depth", "LLM calls waiting for a concurrency slot", ("priority",))
+LLM_QUEUE_WAIT = registry.histogram(
+    "llm_queue_wait_seconds", "Time LLM calls waited for a concurrency slot", ("priority",), LLM_BUCKETS)
+LLM_QUEUE_REJECTED = registry.counter(
+    "llm_queue_rejected_total", "LLM calls turned away because the queue wait would exceed the deadline",
+    ("priority", "reason"))
+LLM_SLOTS_IN_USE = registry.gauge("llm_slots_in_use", "LLM concurrency slots currently held")
+
+SINGLE_FLIGHT_CALLS = registry.counter(
+    "single_flight_calls_total",
+    "Generation calls that started the work (leader) or waited on identical in-flight work (coalesced)", ("role",))
+
+CACHE_REQUESTS = registry.counter("cache_requests_total", "Cache lookups by cache and result", ("cache", "result"))
+CACHE_HIT_RATIO = registry.gauge("cache_hit_ratio", "Share of cache lookups that hit since startup", ("cache",))
+
+@registry.collector
+def _cache_ratios():
+    caches = {key[0] for key in list(CACHE_REQUESTS._values)}
+    for cache in caches:
+        hits = CACHE_REQUESTS.value(cache=cache, result="hit")
+        total = hits + CACHE_REQUESTS.value(cache=cache, result="miss")
+        CACHE_HIT_RATIO.set(hits / total if total else 0.0, cache=cache)
+
+def record_cache(cache: str, hit: bool):
+    """Count one lookup against ``cache``"""
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+# Database
+
+class QueryStats:
+    """Queries issued while serving one request"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+_request_queries = contextvars.ContextVar("request_queries", default=None)
+
+def _operation(statement: str) -> str:
+    word = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+    return word if word in ("SELECT", "INSERT", "UPDATE", "DELETE") else "OTHER"
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["metrics_query_start"].pop()
+    operation = _operation(statement)
+    DB_QUERIES.inc(operation=operation)
+    DB_LATENCY.observe(elapsed, operation=operation)
+    stats = _request_queries.get()
+    if stats is not None:
+        stats.count += 1
+        stats.seconds += elapsed
+
+def _handle_error(context):
+    # after_cursor_execute does not run for a failed statement
+    if context.connection is not None and context.connection.info.get("metrics_query_start"):
+        context.connection.info["metrics_query_start"].pop()
+
+def instrument_engine(engine):
+    """Count and time every statement executed on ``engine`` (idempotent)"""
+    if event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+# HTTP
+
+def route_template(app, scope) -> str:
+    """Path template of the route ``scope`` will be dispatched to"""
+    partial = None
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(route, "path", scope["path"])
+        if match == Match.PARTIAL and partial is None:
+            partial = route
+    return getattr(partial, "path", "unmatched") if partial is not None else "unmatched"
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency, status, in-flight count and DB use per route"""
+
+    def __init__(self, app, router_app=None):
+        self.app = app
+        self.router_app = router_app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = route_template(self.router_app, scope) if self.router_app is not None else scope["path"]
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        stats = QueryStats()
+        token = _request_queries.set(stats)
+        HTTP_IN_FLIGHT.inc(method=method, route=route)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            HTTP_IN_FLIGHT.dec(method=method, route=route)
+            _request_queries.reset(token)
+            HTTP_REQUESTS.inc(method=method, route=route, status=status["code"])
+            HTTP_LATENCY.observe(elapsed, method=method, route=route)
+            HTTP_DB_QUERIES.observe(stats.count, method=method, route=route)
+            HTTP_DB_SECONDS.observe(stats.seconds, method=method, route=route)
+
+# LLM
+
+def universe_label(universe: Optional[str], known: tuple = ()) -> str:
+    """Bound label cardinality: built-in universes by name, everything else as "custom" """
+    return universe if universe in known else "custom"
+
+def observe_completion(model: str, universe: str, started: float, completion=None, error: Exception = None,
+                       mode: str = "complete"):
+    """Record one finished (or failed) non-streaming LLM call started at ``started``"""
+    elapsed = time.perf_counter() - started
+    LLM_REQUESTS.inc(model=model, universe=universe, mode=mode, outcome="error" if error else "ok")
+    if error is not None:
+        return
+    LLM_LATENCY.observe(elapsed, model=model, universe=universe, mode=mode)
+    LLM_TOKENS.inc(completion.prompt_tokens, model=model, universe=universe, kind="prompt")
+    LLM_TOKENS.inc(completion.completion_tokens, model=model, universe=universe, kind="completion")
+
+async def instrument_stream(chunks, model: str, universe: str):
+    """Pass streamed deltas through, recording time to first token and totals.
+
+    Streams do not report usage, so each delta counts as one completion token.
+    """
+    started = time.perf_counter()
+    deltas = 0
+    outcome = "ok"
+    try:
+        async for text in chunks:
+            if deltas == 0:
+                LLM_TTFT.observe(time.perf_counter() - started, model=model, universe=universe)
+            deltas += 1
+            yield text
+    except GeneratorExit:
+        outcome = "cancelled"
+        raise
+    except Exception:
+        outcome = "error"
+        raise
+    finally:
+        await chunks.aclose()
+        LLM_REQUESTS.inc(model=model, universe=universe, mode="stream", outcome=outcome)
+        LLM_LATENCY.observe(time.perf_counter() - started, model=model, universe=universe, mode="stream")
+        LLM_TOKENS.inc(deltas, model=model, universe=universe, kind="completion")
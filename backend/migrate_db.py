@@ -1,83 +1,400 @@
 """
-Database migration script to add new columns to existing database
-This preserves all existing stories while adding new features
+Versioned database migrations.
+
+Schema changes are the ordered steps in MIGRATIONS. Each applied step is
+recorded in the ``schema_version`` table, so a deploy only runs the steps
+it has not seen yet. When nothing is pending, ``migrate()`` costs a single
+read of ``MAX(version)`` from that table's primary key; the release
+command and every worker's startup hook can all call it.
+
+Pending steps run under an advisory lock (``pg_advisory_lock`` on
+Postgres, an exclusive lock file next to the SQLite database), so workers
+starting together apply each step once. Backfills walk the table in id
+order, write each batch with one executemany and commit it, so they can be
+interrupted and resumed.
+
+Missing tables are created first with ``database.create_schema()``, and
+every step checks the schema before changing it, so new databases and
+ones migrated by the old unversioned script pass through the steps they
+already have.
 """
+from contextlib import contextmanager
 from sqlalchemy import text, inspect
-from database import engine
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from database import (
+    get_engine, create_schema, TRENDING_PRIOR_MEAN, TRENDING_PRIOR_WEIGHT, HISTORY_INCLUDE_COLUMNS,
+    create_search_index, index_stories,
+)
+import story_codec
 import secrets
 import sys
 
+try:
+    import fcntl
+except ImportError:  # Windows: migrations are not locked across processes
+    fcntl = None
+
+# Engine to migrate; None migrates the app's engine (database.get_engine())
+engine = None
+
+# Arbitrary app-wide key for pg_advisory_lock
+MIGRATION_LOCK_KEY = 7_240_311
+
+RATING_AGGREGATE_COLUMNS = [
+    "rating_sum", "rating_count",
+    "stars_1", "stars_2", "stars_3", "stars_4", "stars_5",
+]
+
+def backfill_rating_aggregates(conn, story_ids=None):
+    """Recompute the stored rating aggregates and trending score from the ratings table.
+
+    One set-based UPDATE instead of a query per story; ``story_ids``
+    limits it to the given stories.
+    """
+    where = ""
+    params = {"weight": TRENDING_PRIOR_WEIGHT, "mean": TRENDING_PRIOR_MEAN}
+    if story_ids is not None:
+        where = f"WHERE id IN ({', '.join(f':id{i}' for i in range(len(story_ids)))})"
+        params.update({f"id{i}": story_id for i, story_id in enumerate(story_ids)})
+    conn.execute(text(f"""
+        UPDATE stories SET
+            rating_sum = COALESCE((SELECT SUM(rating_value) FROM ratings WHERE ratings.story_id = stories.id), 0),
+            rating_count = (SELECT COUNT(*) FROM ratings WHERE ratings.story_id = stories.id),
+            stars_1 = (SELECT COUNT(*) FROM ratings WHERE ratings.story_id = stories.id AND rating_value = 1),
+            stars_2 = (SELECT COUNT(*) FROM ratings WHERE ratings.story_id = stories.id AND rating_value = 2),
+            stars_3 = (SELECT COUNT(*) FROM ratings WHERE ratings.story_id = stories.id AND rating_value = 3),
+            stars_4 = (SELECT COUNT(*) FROM ratings WHERE ratings.story_id = stories.id AND rating_value = 4),
+            stars_5 = (SELECT COUNT(*) FROM ratings WHERE ratings.story_id = stories.id AND rating_value = 5)
+        {where}
+    """), params)
+    if 'trending_score' in [col['name'] for col in inspect(conn).get_columns('stories')]:
+        conn.execute(text(f"""
+            UPDATE stories
+            SET trending_score = (:weight * :mean + rating_sum) / (:weight + rating_count)
+            {where}
+        """), params)
+
+def backfill_batches(conn, columns, where, write_batch, batch_size, label):
+    """Feed the stories matching ``where`` to ``write_batch(conn, rows)`` in id order, committing each batch.
+
+    ``columns`` are selected along with ``id``. Each batch is a keyset read
+    (``id > last id``) and one executemany, so progress is kept if the run
+    is interrupted. Returns the number of rows written.
+    """
+    condition = f" AND ({where})" if where else ""
+    total = conn.execute(text(f"SELECT COUNT(*) FROM stories WHERE 1 = 1{condition}")).scalar()
+    if not total:
+        return 0
+    last_id = 0
+    done = 0
+    while True:
+        rows = conn.execute(
+            text(f"""
+                SELECT {', '.join(['id', *columns])} FROM stories
+                WHERE id > :last_id{condition}
+                ORDER BY id LIMIT :batch_size
+            """),
+            {"last_id": last_id, "batch_size": batch_size}
+        ).fetchall()
+        if not rows:
+            return done
+        write_batch(conn, rows)
+        conn.commit()
+        last_id = rows[-1].id
+        done += len(rows)
+        print(f"  ... {label}: {done}/{total} stories (up to id {last_id})")
+
+SHARE_TOKEN_BATCH_SIZE = 1000
+
+def backfill_share_tokens(conn, batch_size=SHARE_TOKEN_BATCH_SIZE):
+    """Give every story without a share token a fresh one. Returns the number of stories updated."""
+    return backfill_batches(
+        conn, [], "share_token IS NULL",
+        lambda conn, rows: conn.execute(
+            text("UPDATE stories SET share_token = :token WHERE id = :id"),
+            [{"id": row.id, "token": secrets.token_urlsafe(16)} for row in rows]
+        ),
+        batch_size, "share tokens"
+    )
+
+COMPRESS_BATCH_SIZE = 500
+
+def compress_stories(conn, codec, batch_size=COMPRESS_BATCH_SIZE):
+    """Move plain story text into the compressed column. Returns the number of stories compressed."""
+    return backfill_batches(
+        conn, ["story"], "story_codec IS NULL AND story IS NOT NULL",
+        lambda conn, rows: conn.execute(
+            text("""
+                UPDATE stories SET story_blob = :blob, story_codec = :codec, story = NULL
+                WHERE id = :id AND story_codec IS NULL
+            """),
+            [{"id": row.id, "blob": story_codec.compress(row.story, codec), "codec": codec} for row in rows]
+        ),
+        batch_size, "compressed"
+    )
+
+SEARCH_BATCH_SIZE = 500
+
+def backfill_search_index(conn, batch_size=SEARCH_BATCH_SIZE):
+    """Add every story to a new full-text index. Returns the number of stories indexed."""
+    return backfill_batches(
+        conn, ["what_if", "story", "story_blob", "story_codec"], None,
+        lambda conn, rows: index_stories(conn, [{
+            "id": row.id,
+            "what_if": row.what_if,
+            "story": story_codec.decompress(row.story_blob, row.story_codec) if row.story_codec else row.story,
+        } for row in rows]),
+        batch_size, "indexed"
+    )
+
+def _columns(conn, table):
+    return [col['name'] for col in inspect(conn).get_columns(table)]
+
+def _is_sqlite(conn):
+    return conn.dialect.name == "sqlite"
+
+# Migration steps. Each one is idempotent and commits its own work.
+
+def add_share_tokens(conn):
+    if 'share_token' not in _columns(conn, 'stories'):
+        conn.execute(text("ALTER TABLE stories ADD COLUMN share_token VARCHAR(32)"))
+        conn.commit()
+        print("✓ Added share_token column")
+    updated = backfill_share_tokens(conn, SHARE_TOKEN_BATCH_SIZE)
+    if updated:
+        print(f"✓ Backfilled {updated} stories with share tokens")
+
+def create_ratings_table(conn):
+    if _is_sqlite(conn):
+        id_column = "id INTEGER PRIMARY KEY AUTOINCREMENT"
+    else:
+        id_column = "id INTEGER PRIMARY KEY GENERATED BY DEFAULT AS IDENTITY"
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS ratings (
+            {id_column},
+            story_id INTEGER NOT NULL,
+            session_id VARCHAR(64) NOT NULL,
+            rating_value INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (story_id) REFERENCES stories(id)
+        )
+    """))
+    conn.commit()
+    print("✓ Ratings table created/verified")
+
+def add_rating_aggregates(conn):
+    columns = _columns(conn, 'stories')
+    missing_aggregates = [col for col in RATING_AGGREGATE_COLUMNS if col not in columns]
+    if not missing_aggregates:
+        return
+    for col in missing_aggregates:
+        conn.execute(text(f"ALTER TABLE stories ADD COLUMN {col} INTEGER NOT NULL DEFAULT 0"))
+    conn.commit()
+    backfill_rating_aggregates(conn)
+    conn.commit()
+    print("✓ Added rating aggregate columns and backfilled them from the ratings table")
+
+def add_trending_score(conn):
+    if 'trending_score' not in _columns(conn, 'stories'):
+        conn.execute(text(
+            f"ALTER TABLE stories ADD COLUMN trending_score FLOAT NOT NULL DEFAULT {TRENDING_PRIOR_MEAN}"
+        ))
+        conn.execute(
+            text("""
+                UPDATE stories
+                SET trending_score = (:weight * :mean + rating_sum) / (:weight + rating_count)
+            """),
+            {"weight": TRENDING_PRIOR_WEIGHT, "mean": TRENDING_PRIOR_MEAN}
+        )
+        conn.commit()
+        print("✓ Added and backfilled trending_score column")
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_stories_public_trending "
+        "ON stories (is_public, trending_score, rating_count, id)"
+    ))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_stories_universe_trending "
+        "ON stories (universe, is_public, trending_score, rating_count, id)"
+    ))
+    conn.commit()
+    print("✓ Trending indexes created/verified")
+
+def add_history_index(conn):
+    """Keyset pagination index for /story/history"""
+    if _is_sqlite(conn):
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_stories_public_created "
+            "ON stories (is_public, created_at, id)"
+        ))
+    else:
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_stories_public_created "
+            "ON stories (is_public, created_at, id) "
+            f"INCLUDE ({', '.join(HISTORY_INCLUDE_COLUMNS)})"
+        ))
+    conn.commit()
+    print("✓ History index created/verified")
+
+def add_scenario_hash(conn):
+    """Scenario hash used by the generation cache.
+
+    Existing rows keep NULL: their custom system prompts were never stored,
+    so they can't be keyed reliably and simply never count as cache hits.
+    """
+    if 'scenario_hash' not in _columns(conn, 'stories'):
+        conn.execute(text("ALTER TABLE stories ADD COLUMN scenario_hash VARCHAR(64)"))
+        print("✓ Added scenario_hash column")
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_stories_scenario_hash ON stories (scenario_hash)"
+    ))
+    conn.commit()
+
+def add_unique_rating_index(conn):
+    """One rating per (story, session), enforced by a unique index that also serves the rating upsert.
+
+    Duplicates left by concurrent double-clicks are removed first, keeping
+    the newest row.
+    """
+    rating_indexes = [index['name'] for index in inspect(conn).get_indexes('ratings')]
+    if 'ux_ratings_story_session' in rating_indexes:
+        return
+    affected = conn.execute(text("""
+        SELECT DISTINCT story_id FROM ratings
+        GROUP BY story_id, session_id HAVING COUNT(*) > 1
+    """)).scalars().all()
+    if affected:
+        print(f"Removing duplicate ratings on {len(affected)} stories...")
+        result = conn.execute(text("""
+            DELETE FROM ratings WHERE id NOT IN (
+                SELECT MAX(id) FROM ratings GROUP BY story_id, session_id
+            )
+        """))
+        for start in range(0, len(affected), 500):
+            backfill_rating_aggregates(conn, affected[start:start + 500])
+        print(f"✓ Removed {result.rowcount} duplicate ratings and recomputed their aggregates")
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_ratings_story_session "
+        "ON ratings (story_id, session_id)"
+    ))
+    conn.commit()
+    print("✓ Unique rating index created")
+
+def add_compressed_storage(conn):
+    """Compressed story storage; existing plain text is compressed in batches and then cleared"""
+    if 'story_codec' not in _columns(conn, 'stories'):
+        blob_type = "BLOB" if _is_sqlite(conn) else "BYTEA"
+        conn.execute(text(f"ALTER TABLE stories ADD COLUMN story_blob {blob_type}"))
+        conn.execute(text("ALTER TABLE stories ADD COLUMN story_codec VARCHAR(16)"))
+        conn.commit()
+        print("✓ Added story_blob and story_codec columns")
+    codec = story_codec.default_codec()
+    if codec is not None:
+        compressed = compress_stories(conn, codec, COMPRESS_BATCH_SIZE)
+        if compressed:
+            # The space is reused by new rows; VACUUM returns it to the filesystem
+            print(f"✓ Compressed {compressed} stories with {codec}")
+
+def add_search_index(conn):
+    """Full-text search index over what_if and story (see search.py)"""
+    if _is_sqlite(conn):
+        exists = 'stories_fts' in inspect(conn).get_table_names()
+    else:
+        exists = 'search_vector' in _columns(conn, 'stories')
+    if exists:
+        return
+    create_search_index(conn)
+    conn.commit()
+    indexed = backfill_search_index(conn, SEARCH_BATCH_SIZE)
+    print(f"✓ Search index created, {indexed} stories indexed")
+
+# Append new steps here; never renumber or edit a step that has shipped.
+MIGRATIONS = [
+    (1, "share tokens", add_share_tokens),
+    (2, "ratings table", create_ratings_table),
+    (3, "rating aggregates", add_rating_aggregates),
+    (4, "trending score", add_trending_score),
+    (5, "history index", add_history_index),
+    (6, "scenario hash", add_scenario_hash),
+    (7, "unique rating index", add_unique_rating_index),
+    (8, "compressed story storage", add_compressed_storage),
+    (9, "full-text search index", add_search_index),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+def schema_version(conn):
+    """Highest applied migration version, or None when the schema_version table doesn't exist yet"""
+    try:
+        return conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+    except (OperationalError, ProgrammingError):
+        conn.rollback()
+        return None
+
+@contextmanager
+def migration_lock(conn):
+    """Hold an exclusive, cross-process lock for running migrations"""
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        conn.commit()
+        try:
+            yield
+        finally:
+            conn.rollback()  # a failed step leaves the transaction aborted
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
+            conn.commit()
+        return
+
+    database = conn.engine.url.database
+    if not _is_sqlite(conn) or fcntl is None or database in (None, "", ":memory:"):
+        yield  # an in-memory database is private to this process
+        return
+    with open(f"{database}.migrate.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
 def migrate():
-    print(f"Migrating database using engine: {engine.url}")
-    
-    with engine.connect() as conn:
-        # Create inspector to check for columns
-            inspector = inspect(engine)
-            columns = [col['name'] for col in inspector.get_columns('stories')]
-            print(f"Found columns in 'stories': {columns}")
-            
-            # 1. Add Column if missing
-            if 'share_token' not in columns:
-                print("Adding share_token column...")
-                # SQLite and Postgres have slightly different syntax support, 
-                # but ADD COLUMN works for both in this simple case
-                conn.execute(text("ALTER TABLE stories ADD COLUMN share_token VARCHAR(32)"))
-                conn.commit()  # Commit structural change
-                print("✓ Added share_token column")
-            else:
-                print("✓ share_token column already exists")
-            
-            # 2. Backfill share_tokens for existing stories
-            print("Checking for stories needing backfill...")
-            # We use a transaction for data updates
-            result = conn.execute(text("SELECT id FROM stories WHERE share_token IS NULL"))
-            stories_to_update = result.fetchall()
-            
-            if stories_to_update:
-                print(f"Found {len(stories_to_update)} stories without share_token. Backfilling...")
-                for story_row in stories_to_update:
-                    story_id = story_row[0]
-                    token = secrets.token_urlsafe(16)
-                    conn.execute(
-                        text("UPDATE stories SET share_token = :token WHERE id = :id"),
-                        {"token": token, "id": story_id}
-                    )
-                conn.commit()
-                print(f"✓ Backfilled {len(stories_to_update)} stories with share tokens")
-            else:
-                print("✓ All stories already have share tokens")
+    bind = engine if engine is not None else get_engine()
+    with bind.connect() as conn:
+        version = schema_version(conn)
+        if version is not None and version >= LATEST_VERSION:
+            print(f"✓ Database schema is up to date (version {version})")
+            return
 
-            # 3. Create ratings table if it doesn't exist
+        with migration_lock(conn):
             conn.execute(text("""
-                CREATE TABLE IF NOT EXISTS ratings (
-                    id INTEGER PRIMARY KEY GENERATED BY DEFAULT AS IDENTITY, -- Postgres compatible
-                    story_id INTEGER NOT NULL,
-                    session_id VARCHAR(64) NOT NULL,
-                    rating_value INTEGER NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (story_id) REFERENCES stories(id)
-                )
-            """) if 'sqlite' not in str(engine.url) else text("""
-                 CREATE TABLE IF NOT EXISTS ratings (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    story_id INTEGER NOT NULL,
-                    session_id VARCHAR(64) NOT NULL,
-                    rating_value INTEGER NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (story_id) REFERENCES stories(id)
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    description VARCHAR(200) NOT NULL,
+                    applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
                 )
             """))
             conn.commit()
-            print("✓ Ratings table created/verified")
-            
-            # Show story count
-            result = conn.execute(text("SELECT COUNT(*) FROM stories"))
-            count = result.scalar()
+            # Another worker may have applied some steps while we waited for the lock
+            version = schema_version(conn)
+            pending = [migration for migration in MIGRATIONS if migration[0] > version]
+            if not pending:
+                print(f"✓ Database schema is up to date (version {version})")
+                return
+
+            print(f"Migrating database from version {version} to {LATEST_VERSION} using engine: {bind.url}")
+            create_schema(conn)
+            conn.commit()
+            for number, description, step in pending:
+                print(f"→ {number}: {description}")
+                step(conn)
+                conn.execute(
+                    text("INSERT INTO schema_version (version, description) VALUES (:version, :description)"),
+                    {"version": number, "description": description}
+                )
+                conn.commit()
+
+            count = conn.execute(text("SELECT COUNT(*) FROM stories")).scalar()
             print(f"📚 Total stories preserved: {count}")
-            print("\n✅ Migration completed successfully!")
-            
+            print(f"\n✅ Migration to version {LATEST_VERSION} completed successfully!")
+
 if __name__ == "__main__":
     try:
         migrate()
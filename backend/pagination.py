@@ -0,0 +1,46 @@
+"""
+Helpers shared by the story listings (history, trending, search).
+
+Page sizes are clamped to a per-listing maximum, and every listing row
+carries the same summary fields. A cursor is the sort key of the last row on a page, serialized to JSON and
+base64url-encoded so clients treat it as an opaque token. Decoding a
+tampered or malformed cursor raises ValueError.
+"""
+import base64
+import json
+from typing import Optional
+
+from database import average_from_aggregates
+
+def clamp_limit(limit: Optional[int], default: int, maximum: int) -> int:
+    """Keep the requested page size within [1, maximum]"""
+    if limit is None:
+        return default
+    return max(1, min(limit, maximum))
+
+def summary_fields(row) -> dict:
+    """Fields every listing shows for a projected story row"""
+    return {
+        "id": row.id,
+        "universe": row.universe,
+        "what_if": row.what_if,
+        "word_count": row.word_count,
+        "average_rating": average_from_aggregates(row.rating_sum, row.rating_count),
+        "rating_count": row.rating_count,
+    }
+
+def encode_cursor(*values) -> str:
+    """Encode the sort key of the last returned row"""
+    raw = json.dumps(list(values), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str, size: int) -> list:
+    """Decode a cursor produced by encode_cursor with ``size`` key parts"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("Invalid cursor")
+    return values
@@ -0,0 +1,159 @@
+"""
+Per-request query budgets and N+1 detection.
+
+Every statement executed on an instrumented engine is recorded by the
+active ``QueryTracker`` scopes: the one opened by ``QueryBudgetMiddleware``
+for the current request, and any opened with ``track_queries()``. When a
+scope ends, it is checked against its budget and for the same statement
+shape running again and again (the signature of an N+1 lazy load).
+
+Violations print a warning, or raise ``QueryBudgetExceeded`` when
+QUERY_BUDGET_MODE=raise (the test suite runs this way). QUERY_BUDGET_MODE=off
+disables the checks.
+"""
+import contextvars
+import os
+import re
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Optional
+
+from sqlalchemy import event
+
+import metrics
+
+OFF = "off"
+WARN = "warn"
+RAISE = "raise"
+
+_WHITESPACE = re.compile(r"\s+")
+_PARAM_LIST = re.compile(r"\((?:\s*(?:\?|%\(\w+\)s|%s|:\w+)\s*,)+\s*(?:\?|%\(\w+\)s|%s|:\w+)\s*\)")
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+
+class QueryBudgetExceeded(AssertionError):
+    """A scope ran more queries than allowed or repeated a statement shape"""
+
+def statement_shape(statement: str) -> str:
+    """Normalize a statement so repeats differing only in values compare equal"""
+    shape = _WHITESPACE.sub(" ", statement.strip())
+    shape = _PARAM_LIST.sub("(?)", shape)
+    return _LITERAL.sub("?", shape)
+
+class QueryTracker:
+    """Statements recorded while a scope is open"""
+
+    def __init__(self, label: str = "block", budget: Optional[int] = None, repeat_threshold: Optional[int] = None):
+        self.label = label
+        self.budget = budget
+        self.repeat_threshold = repeat_threshold
+        self.statements = []
+        self._lock = threading.Lock()
+
+    def record(self, statement: str):
+        with self._lock:
+            self.statements.append(statement)
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def shapes(self) -> Counter:
+        """How many times each statement shape ran"""
+        return Counter(statement_shape(statement) for statement in self.statements)
+
+    def repeated(self) -> dict:
+        """Shapes that ran at least ``repeat_threshold`` times"""
+        if not self.repeat_threshold:
+            return {}
+        return {shape: n for shape, n in self.shapes().items() if n >= self.repeat_threshold}
+
+    def violations(self) -> list:
+        problems = []
+        if self.budget is not None and self.count > self.budget:
+            problems.append(f"{self.count} queries, budget is {self.budget}")
+        for shape, n in self.repeated().items():
+            problems.append(f"same statement ran {n} times (possible N+1): {shape[:200]}")
+        return problems
+
+    def check(self, mode: str = WARN):
+        """Warn about or raise on budget violations"""
+        problems = self.violations()
+        if not problems or mode == OFF:
+            return
+        message = f"Query budget exceeded in {self.label}: " + "; ".join(problems)
+        if mode == RAISE:
+            raise QueryBudgetExceeded(message)
+        print(f"⚠️  {message}")
+
+_context_trackers = contextvars.ContextVar("query_trackers", default=())
+_global_trackers = []
+_global_lock = threading.Lock()
+
+def _record_statement(conn, cursor, statement, parameters, context, executemany):
+    for tracker in _context_trackers.get():
+        tracker.record(statement)
+    if _global_trackers:
+        with _global_lock:
+            trackers = list(_global_trackers)
+        for tracker in trackers:
+            tracker.record(statement)
+
+def instrument_engine(engine):
+    """Record the statements of ``engine`` in the active scopes (idempotent)"""
+    if not event.contains(engine, "before_cursor_execute", _record_statement):
+        event.listen(engine, "before_cursor_execute", _record_statement)
+
+def default_mode() -> str:
+    return os.getenv("QUERY_BUDGET_MODE", WARN).lower()
+
+@contextmanager
+def track_queries(label: str = "block", budget: Optional[int] = None, repeat_threshold: Optional[int] = None,
+                  mode: Optional[str] = None, all_threads: bool = False):
+    """Record the queries run inside the ``with`` block and check them on exit.
+
+    Scopes follow the current context, so they also see work handed to
+    ``asyncio.to_thread``. ``all_threads=True`` records every query on
+    instrumented engines instead, e.g. for requests served by TestClient's
+    event loop thread.
+    """
+    tracker = QueryTracker(label, budget, repeat_threshold)
+    if all_threads:
+        with _global_lock:
+            _global_trackers.append(tracker)
+    else:
+        token = _context_trackers.set(_context_trackers.get() + (tracker,))
+    try:
+        yield tracker
+    finally:
+        if all_threads:
+            with _global_lock:
+                _global_trackers.remove(tracker)
+        else:
+            _context_trackers.reset(token)
+    tracker.check(mode or default_mode())
+
+class QueryBudgetMiddleware:
+    """ASGI middleware checking each request against its route's query budget"""
+
+    def __init__(self, app, router_app=None, budget: int = None, repeat_threshold: int = None,
+                 route_budgets: dict = None, mode: str = None):
+        self.app = app
+        self.router_app = router_app
+        self.budget = budget if budget is not None else int(os.getenv("QUERY_BUDGET", "25"))
+        self.repeat_threshold = repeat_threshold if repeat_threshold is not None else int(
+            os.getenv("QUERY_REPEAT_THRESHOLD", "5")
+        )
+        self.route_budgets = route_budgets or {}
+        self.mode = mode
+
+    async def __call__(self, scope, receive, send):
+        mode = self.mode or default_mode()
+        if scope["type"] != "http" or mode == OFF:
+            await self.app(scope, receive, send)
+            return
+
+        route = metrics.route_template(self.router_app, scope) if self.router_app is not None else scope["path"]
+        budget = self.route_budgets.get(route, self.budget)
+        with track_queries(f"{scope['method']} {route}", budget, self.repeat_threshold, mode):
+            await self.app(scope, receive, send)
@@ -0,0 +1,278 @@
+"""
+Token-bucket rate limiting per client.
+
+Every request is charged to a bucket keyed by the client's IP address
+(the ``X-Forwarded-For`` hop added by our proxy when
+RATE_LIMIT_TRUST_FORWARDED is set).
+Clients that send an ``X-Session-ID`` header (or ``session_id`` query
+parameter) are also charged to a bucket for that session; since the
+client picks the session id, it only ever narrows the IP limit and never
+replaces it. Each bucket refills at the route's rate and holds up to its
+burst size; a request that finds either bucket empty gets a ``429`` with
+``Retry-After``. Generation routes cost real tokens and get
+tight limits, cheap reads much higher ones.
+
+Buckets live in process memory by default. Setting RATE_LIMIT_SQLITE_PATH
+keeps them in a small SQLite file instead, so the limits hold across
+uvicorn workers on one host.
+"""
+import asyncio
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+import metrics
+
+class Limit:
+    """``rate`` requests per ``per_seconds`` with bursts of up to ``burst``"""
+
+    def __init__(self, rate: float, per_seconds: float = 60, burst: Optional[int] = None):
+        self.rate = rate
+        self.per_seconds = per_seconds
+        self.burst = burst if burst is not None else max(1, int(rate))
+
+    @property
+    def refill_per_second(self) -> float:
+        return self.rate / self.per_seconds
+
+    def __repr__(self):
+        return f"Limit({self.rate}/{self.per_seconds}s, burst={self.burst})"
+
+# (method, route template) -> limit; "*" matches any route for that method
+DEFAULT_LIMITS = {
+    ("POST", "/story/generate"): Limit(10, 60, burst=5),
+    ("POST", "/story/generate/stream"): Limit(10, 60, burst=5),
+    ("POST", "/story/generate-custom"): Limit(10, 60, burst=5),
+    ("POST", "/story/generate-custom/stream"): Limit(10, 60, burst=5),
+    ("POST", "/story/jobs"): Limit(10, 60, burst=5),
+    ("POST", "/universe/system-prompt"): Limit(5, 60, burst=3),
+    ("POST", "/story/{story_id}/rate"): Limit(60, 60, burst=20),
+    ("POST", "*"): Limit(120, 60, burst=30),
+    ("DELETE", "*"): Limit(30, 60, burst=10),
+    ("GET", "*"): Limit(1200, 60, burst=200),
+}
+
+EXEMPT_ROUTES = {"/metrics"}
+
+def parse_limits(spec: str) -> dict:
+    """Parse RATE_LIMITS, e.g. ``POST /story/generate=20/60:10; GET *=600/60``.
+
+    Each entry is ``METHOD route=count/seconds[:burst]``.
+    """
+    limits = {}
+    for entry in filter(None, (part.strip() for part in spec.split(";"))):
+        try:
+            target, value = entry.rsplit("=", 1)
+            method, route = target.split(None, 1)
+            rate, _, rest = value.partition("/")
+            seconds, _, burst = rest.partition(":")
+            limits[(method.upper(), route.strip())] = Limit(
+                float(rate), float(seconds or 60), int(burst) if burst else None
+            )
+        except ValueError:
+            raise ValueError(f"Invalid RATE_LIMITS entry '{entry}'")
+    return limits
+
+class MemoryStore:
+    """Buckets in a dict; limits apply per process"""
+
+    blocking = False
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = {}  # key -> (tokens, updated_at)
+
+    def take(self, key: str, limit: Limit, now: Optional[float] = None):
+        """Spend one token; returns ``(allowed, retry_after_seconds)``"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (limit.burst, now))
+            tokens = min(limit.burst, tokens + (now - updated) * limit.refill_per_second)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+        return allowed, 0 if allowed else (1 - tokens) / limit.refill_per_second
+
+    def _prune(self, now: float):
+        # Drop the least recently used half; their buckets would have refilled anyway
+        for key, _ in sorted(self._buckets.items(), key=lambda item: item[1][1])[: len(self._buckets) // 2]:
+            del self._buckets[key]
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+class SQLiteStore:
+    """Buckets in a SQLite file shared by every worker on the host"""
+
+    blocking = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limit_buckets "
+                "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def take(self, key: str, limit: Limit, now: Optional[float] = None):
+        """Spend one token; returns ``(allowed, retry_after_seconds)``"""
+        # Wall clock, since monotonic clocks are not comparable across processes
+        now = time.time() if now is None else now
+        connection = self._connect()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT tokens, updated_at FROM rate_limit_buckets WHERE key = ?", (key,)
+            ).fetchone()
+            tokens, updated = row if row else (limit.burst, now)
+            tokens = min(limit.burst, tokens + max(0.0, now - updated) * limit.refill_per_second)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            connection.execute(
+                "INSERT INTO rate_limit_buckets (key, tokens, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at",
+                (key, tokens, now)
+            )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return allowed, 0 if allowed else (1 - tokens) / limit.refill_per_second
+
+    def clear(self):
+        self._connect().execute("DELETE FROM rate_limit_buckets")
+
+def default_store():
+    path = os.getenv("RATE_LIMIT_SQLITE_PATH")
+    return SQLiteStore(path) if path else MemoryStore()
+
+def _session_id(scope) -> str:
+    headers = dict(scope.get("headers") or [])
+    session_id = headers.get(b"x-session-id", b"").decode("latin-1").strip()
+    if not session_id:
+        for pair in (scope.get("query_string") or b"").decode("latin-1").split("&"):
+            name, _, value = pair.partition("=")
+            if name == "session_id" and value:
+                session_id = value
+                break
+    return session_id[:64]
+
+def client_ip_key(scope) -> str:
+    """The client's IP address, from X-Forwarded-For only when RATE_LIMIT_TRUST_FORWARDED is set.
+
+    Each proxy appends the address it received the request from, so only
+    the hops added by our own proxies can be trusted: the address is taken
+    RATE_LIMIT_TRUSTED_PROXIES (default 1, e.g. the Heroku router) hops from
+    the right. Anything further left was sent by the client.
+    """
+    if os.getenv("RATE_LIMIT_TRUST_FORWARDED", "").lower() in ("1", "true", "yes"):
+        headers = dict(scope.get("headers") or [])
+        hops = [hop.strip() for hop in headers.get(b"x-forwarded-for", b"").decode("latin-1").split(",")]
+        hops = [hop for hop in hops if hop]
+        trusted = max(1, int(os.getenv("RATE_LIMIT_TRUSTED_PROXIES", "1")))
+        if len(hops) >= trusted:
+            return f"ip:{hops[-trusted]}"
+    client = scope.get("client")
+    return f"ip:{client[0] if client else 'unknown'}"
+
+def client_key(scope) -> str:
+    """Session id when the client sends one, otherwise its IP address (for fair queueing, not limits)"""
+    session_id = _session_id(scope)
+    return f"session:{session_id}" if session_id else client_ip_key(scope)
+
+def rate_limit_keys(scope) -> list:
+    """Bucket keys a request is charged to: always its IP, plus its session when it sends one"""
+    keys = [client_ip_key(scope)]
+    session_id = _session_id(scope)
+    if session_id:
+        keys.append(f"session:{session_id}")
+    return keys
+
+class RateLimiter:
+    """Looks up the limit for a request and spends from its bucket"""
+
+    def __init__(self, store=None, limits: dict = None, enabled: bool = None):
+        self.store = store if store is not None else default_store()
+        self.limits = dict(DEFAULT_LIMITS)
+        self.limits.update(limits if limits is not None else parse_limits(os.getenv("RATE_LIMITS", "")))
+        self.enabled = enabled if enabled is not None else os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.rejected = 0
+
+    def limit_for(self, method: str, route: str) -> Optional[Limit]:
+        return self.limits.get((method, route)) or self.limits.get((method, "*"))
+
+    def check(self, keys, method: str, route: str):
+        """``(allowed, retry_after)`` for one request charged to each of ``keys`` (a key or list of keys).
+
+        Keys are charged in order and the first empty bucket rejects the
+        request, so the IP bucket is spent even when a session id is sent.
+        """
+        limit = self.limit_for(method, route)
+        if limit is None:
+            return True, 0
+        for key in [keys] if isinstance(keys, str) else keys:
+            allowed, retry_after = self.store.take(f"{key}|{method} {route}", limit)
+            if not allowed:
+                self.rejected += 1
+                return False, retry_after
+        return True, 0
+
+class RateLimitMiddleware:
+    """ASGI middleware answering 429 once a client's bucket for the route is empty"""
+
+    def __init__(self, app, router_app=None, limiter: RateLimiter = None):
+        self.app = app
+        self.router_app = router_app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        limiter = self.limiter or rate_limiter
+        if scope["type"] != "http" or not limiter.enabled or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+        route = metrics.route_template(self.router_app, scope) if self.router_app is not None else scope["path"]
+        if route in EXEMPT_ROUTES:
+            await self.app(scope, receive, send)
+            return
+
+        keys = rate_limit_keys(scope)
+        if limiter.store.blocking:
+            allowed, retry_after = await asyncio.to_thread(limiter.check, keys, scope["method"], route)
+        else:
+            allowed, retry_after = limiter.check(keys, scope["method"], route)
+        if allowed:
+            await self.app(scope, receive, send)
+            return
+
+        body = json.dumps({"detail": "Rate limit exceeded, try again later"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+rate_limiter = RateLimiter()
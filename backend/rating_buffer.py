@@ -0,0 +1,207 @@
+"""
+Write-behind buffer for rating ingestion.
+
+When RATING_BUFFER_ENABLED is set, ``/story/{id}/rate`` only records the
+rating in memory and answers with an optimistic aggregate. Repeated clicks
+for the same ``(story_id, session_id)`` collapse to the last value. A
+background task started from the FastAPI lifespan hook flushes the buffer
+every RATING_BUFFER_FLUSH_MS, or as soon as RATING_BUFFER_MAX_ENTRIES
+ratings are waiting. Each flush is one transaction: a bulk upsert of the
+ratings plus one batched UPDATE of the story aggregates. Once a flush is
+committed, stories whose trending score moved far enough bump the
+leaderboard, so the early rebuild reads the new scores. The buffer is
+flushed again on shutdown.
+
+Ratings still in the buffer are lost if the process dies, and reads of a
+story do not see them until the next flush.
+"""
+import asyncio
+import os
+import threading
+from datetime import datetime
+
+from sqlalchemy import bindparam, tuple_, select, update
+from sqlalchemy.orm import Session
+
+from database import (
+    SessionLocal, Story, Rating, RATING_VALUES, TRENDING_PRIOR_MEAN, TRENDING_PRIOR_WEIGHT,
+    rating_upsert, rating_state, rating_change,
+)
+from leaderboard import leaderboard
+from wakeup import Wakeup
+
+FLUSH_CHUNK_SIZE = 500
+
+class RatingBuffer:
+    """Collapses ratings in memory and writes them to the database in batches"""
+
+    def __init__(self, session_factory=SessionLocal, enabled: bool = None, flush_ms: float = None,
+                 max_entries: int = None):
+        self.session_factory = session_factory
+        self.enabled = enabled if enabled is not None else os.getenv("RATING_BUFFER_ENABLED", "").lower() in ("1", "true", "yes")
+        self.flush_seconds = (flush_ms if flush_ms is not None else float(os.getenv("RATING_BUFFER_FLUSH_MS", "200"))) / 1000
+        self.max_entries = max_entries if max_entries is not None else int(os.getenv("RATING_BUFFER_MAX_ENTRIES", "1000"))
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = {}  # (story_id, session_id) -> (rating_value, rated_at)
+        self._task = None
+        self._wake = Wakeup()
+        self.flushed = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def submit(self, db: Session, story_id: int, session_id: str, value: int):
+        """Buffer a rating and return the optimistic aggregates, or None for an unknown story.
+
+        The aggregates are the stored ones adjusted for this rating only;
+        other sessions' unflushed ratings show up after the next flush.
+        """
+        state = rating_state(db.connection(), story_id, session_id)
+        db.rollback()  # end the read transaction so SQLite writers are not blocked
+        if state is None:
+            return None
+
+        with self._lock:
+            self._pending[(story_id, session_id)] = (value, datetime.utcnow())
+            full = len(self._pending) >= self.max_entries
+        if full:
+            self.request_flush()
+        # The stored aggregates count the stored rating, whatever is still buffered for this session
+        return rating_change(state, state.previous, value)
+
+    def request_flush(self):
+        """Wake the flusher early"""
+        self._wake.set()
+
+    def flush(self) -> int:
+        """Write everything buffered so far; returns the number of ratings written"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+            try:
+                self._write(batch)
+            except Exception:
+                # Put the batch back without overwriting newer clicks
+                with self._lock:
+                    for key, entry in batch.items():
+                        self._pending.setdefault(key, entry)
+                raise
+            self.flushed += len(batch)
+            return len(batch)
+
+    def _write(self, batch: dict):
+        db = self.session_factory()
+        try:
+            connection = db.connection()
+            story_ids = sorted({story_id for story_id, _ in batch})
+
+            # Serialize with other writers of these stories, then drop ratings for stories that are gone
+            existing = {}  # story id -> stored aggregates, for the leaderboard bump
+            for start in range(0, len(story_ids), FLUSH_CHUNK_SIZE):
+                chunk = story_ids[start:start + FLUSH_CHUNK_SIZE]
+                connection.execute(
+                    update(Story).where(Story.id.in_(chunk)).values(rating_count=Story.rating_count)
+                )
+                existing.update((row.id, row) for row in connection.execute(
+                    select(Story.id, Story.rating_sum, Story.rating_count, Story.trending_score)
+                    .where(Story.id.in_(chunk))
+                ))
+            keys = [key for key in batch if key[0] in existing]
+
+            previous = {}
+            for start in range(0, len(keys), FLUSH_CHUNK_SIZE):
+                chunk = keys[start:start + FLUSH_CHUNK_SIZE]
+                rows = connection.execute(
+                    select(Rating.story_id, Rating.session_id, Rating.rating_value)
+                    .where(tuple_(Rating.story_id, Rating.session_id).in_(chunk))
+                )
+                previous.update({(row.story_id, row.session_id): row.rating_value for row in rows})
+
+            rows = [
+                {"story_id": story_id, "session_id": session_id, "rating_value": value,
+                 "created_at": rated_at, "updated_at": rated_at}
+                for (story_id, session_id), (value, rated_at) in ((key, batch[key]) for key in keys)
+            ]
+            for start in range(0, len(rows), FLUSH_CHUNK_SIZE):
+                connection.execute(rating_upsert(connection.dialect.name, rows[start:start + FLUSH_CHUNK_SIZE]))
+
+            deltas = aggregate_deltas({key: batch[key][0] for key in keys}, previous)
+            if deltas:
+                connection.execute(_AGGREGATE_UPDATE, deltas)
+            db.commit()
+        finally:
+            db.close()
+
+        for delta in deltas:
+            stored = existing[delta["story_id"]]
+            new_score = (
+                (TRENDING_PRIOR_WEIGHT * TRENDING_PRIOR_MEAN + stored.rating_sum + delta["d_sum"])
+                / (TRENDING_PRIOR_WEIGHT + stored.rating_count + delta["d_count"])
+            )
+            leaderboard.note_score_change(stored.trending_score, new_score)
+
+    async def run(self):
+        """Flush every ``flush_seconds`` or when the buffer fills up"""
+        self._wake.bind()
+        while True:
+            await self._wake.wait(self.flush_seconds)
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                print(f"❌ Rating buffer flush failed: {e}")
+
+    def start(self):
+        """Start the flusher on the running event loop if the buffer is enabled"""
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Stop the flusher and write whatever is still buffered"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self._wake.unbind()
+        written = await asyncio.to_thread(self.flush)
+        if written:
+            print(f"✅ Flushed {written} buffered ratings on shutdown")
+
+def aggregate_deltas(values: dict, previous: dict) -> list:
+    """Per-story aggregate increments for replacing ``previous`` ratings with ``values``"""
+    stories = {}
+    for (story_id, session_id), value in values.items():
+        old = previous.get((story_id, session_id))
+        if old == value:
+            continue
+        delta = stories.setdefault(story_id, {
+            "story_id": story_id, "d_sum": 0, "d_count": 0, **{f"d_stars_{v}": 0 for v in RATING_VALUES}
+        })
+        delta["d_sum"] += value - (old or 0)
+        delta[f"d_stars_{value}"] += 1
+        if old is None:
+            delta["d_count"] += 1
+        else:
+            delta[f"d_stars_{old}"] -= 1
+    return list(stories.values())
+
+# Executed with one parameter set per story. The SET expressions see the
+# pre-update row, so trending_score is computed from the new totals.
+_AGGREGATE_UPDATE = (
+    update(Story.__table__)
+    .where(Story.__table__.c.id == bindparam("story_id"))
+    .values(
+        rating_sum=Story.__table__.c.rating_sum + bindparam("d_sum"),
+        rating_count=Story.__table__.c.rating_count + bindparam("d_count"),
+        trending_score=(
+            (TRENDING_PRIOR_WEIGHT * TRENDING_PRIOR_MEAN + Story.__table__.c.rating_sum + bindparam("d_sum"))
+            / (TRENDING_PRIOR_WEIGHT + Story.__table__.c.rating_count + bindparam("d_count"))
+        ),
+        **{f"stars_{v}": Story.__table__.c[f"stars_{v}"] + bindparam(f"d_stars_{v}") for v in RATING_VALUES}
+    )
+)
+
+rating_buffer = RatingBuffer()
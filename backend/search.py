@@ -0,0 +1,127 @@
+"""
+Full-text search over story scenarios and text.
+
+Queries go through the full-text index maintained in database.py: FTS5
+``MATCH`` ranked by bm25 on SQLite, a ``tsvector @@ tsquery`` match ranked
+by ``ts_rank`` on Postgres. Every query term must match (stemmed, so
+"survives" finds "survived"), and scenario matches weigh more than matches
+in the story body.
+
+The ranked page of ids is computed from the index alone. The stories
+table is read only by primary key for the rows on that page, and only
+those stories are decompressed to cut the highlighted snippets.
+"""
+import html
+import re
+from typing import Optional
+
+from sqlalchemy import column, func, literal_column, select, table
+from sqlalchemy.orm import Session
+
+from database import Story
+from history import HISTORY_COLUMNS, serialize_row
+import story_codec
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 50
+MAX_OFFSET = 1000
+MAX_TERMS = 10
+SNIPPET_WORDS = 30
+
+_TERM = re.compile(r"\w+")
+
+def query_terms(q: str) -> list:
+    """Lower-cased word terms of a search query"""
+    return _TERM.findall((q or "").lower())[:MAX_TERMS]
+
+def _ranked_page(dialect: str, terms: list, universe: Optional[str], limit: int, offset: int):
+    """Subquery of (id, score) for one page of matches, best first"""
+    if dialect == "sqlite":
+        fts = table("stories_fts", column("rowid"))
+        score = -func.bm25(literal_column("stories_fts"), 2.0, 1.0)  # bm25 is lower-is-better
+        # Quoted terms are matched literally, so user input cannot inject FTS5 syntax
+        match = " ".join(f'"{term}"' for term in terms)
+        query = (
+            select(Story.id, score.label("score"))
+            .select_from(fts.join(Story, Story.id == fts.c.rowid))
+            .where(literal_column("stories_fts").op("MATCH")(match))
+        )
+    elif dialect == "postgresql":
+        vector = literal_column("stories.search_vector")
+        tsquery = func.plainto_tsquery("english", " ".join(terms))
+        score = func.ts_rank(vector, tsquery)
+        query = select(Story.id, score.label("score")).where(vector.op("@@")(tsquery))
+    else:
+        raise ValueError(f"Full-text search is not available on {dialect}")
+
+    query = query.where(Story.is_public == True)
+    if universe:
+        query = query.where(Story.universe == universe)
+    return query.order_by(score.desc(), Story.id.desc()).limit(limit).offset(offset).subquery()
+
+def _is_match(token: str, stems: list) -> bool:
+    return any(word.startswith(stem) for word in _TERM.findall(token.lower()) for stem in stems)
+
+def snippet(text: str, terms: list, words: int = SNIPPET_WORDS, require_match: bool = True) -> Optional[str]:
+    """HTML-escaped excerpt around the first matching word, with matches wrapped in <mark>.
+
+    Returns None when nothing in ``text`` matches, unless ``require_match``
+    is False, in which case the excerpt starts at the beginning.
+    """
+    tokens = (text or "").split()
+    # Crude stemming so "survives" highlights "survived" as the index matched it
+    stems = [term[:5] for term in terms]
+    first = next((i for i, token in enumerate(tokens) if _is_match(token, stems)), None)
+    if first is None:
+        if require_match:
+            return None
+        first = 0
+    start = max(0, first - words // 3)
+    parts = [
+        f"<mark>{html.escape(token)}</mark>" if _is_match(token, stems) else html.escape(token)
+        for token in tokens[start:start + words]
+    ]
+    prefix = "… " if start > 0 else ""
+    suffix = " …" if start + words < len(tokens) else ""
+    return prefix + " ".join(parts) + suffix
+
+def search_stories(db: Session, q: str, universe: Optional[str] = None, limit: Optional[int] = DEFAULT_LIMIT,
+                   offset: int = 0) -> dict:
+    """One ranked page of public stories matching ``q``.
+
+    Raises ValueError for a query without searchable words or an offset
+    past MAX_OFFSET.
+    """
+    terms = query_terms(q)
+    if not terms:
+        raise ValueError("Search query must contain at least one word")
+    if offset < 0 or offset > MAX_OFFSET:
+        raise ValueError(f"offset must be between 0 and {MAX_OFFSET}")
+    limit = max(1, min(limit or DEFAULT_LIMIT, MAX_LIMIT))
+
+    # One extra row tells whether another page exists
+    page = _ranked_page(db.get_bind().dialect.name, terms, universe, limit + 1, offset)
+    rows = db.execute(
+        select(*HISTORY_COLUMNS, Story.story_text, Story.story_blob, Story.story_codec, page.c.score)
+        .select_from(page.join(Story, Story.id == page.c.id))
+        .order_by(page.c.score.desc(), Story.id.desc())
+    ).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    stories = []
+    for row in rows:
+        body = story_codec.decompress(row.story_blob, row.story_codec) if row.story_codec else row.story_text
+        stories.append({
+            **serialize_row(row),
+            "score": round(row.score, 4),
+            "snippet": (
+                snippet(body, terms) or snippet(row.what_if, terms) or snippet(body, terms, require_match=False)
+            )
+        })
+    return {
+        "query": q,
+        "count": len(stories),
+        "stories": stories,
+        "next_offset": offset + limit if has_more else None
+    }
@@ -0,0 +1,57 @@
+"""
+Single-flight coalescing of identical in-flight work.
+
+The first caller for a key starts the work as its own task; callers that
+arrive with the same key while it is running await that task instead of
+starting another. The shared task is shielded, so a caller that goes away
+does not cancel the work the others are waiting on.
+
+Leaders and coalesced callers are counted in ``single_flight_calls_total``.
+"""
+import asyncio
+
+import metrics
+
+class SingleFlight:
+    """Per-process registry of in-flight tasks keyed by request identity"""
+
+    def __init__(self):
+        self._calls = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def in_flight(self, key: str):
+        """The running task for ``key``, if any"""
+        return self._calls.get(key)
+
+    async def do(self, key: str, fn):
+        """Run ``fn()`` once for all concurrent callers with the same ``key``"""
+        task = self._calls.get(key)
+        if task is None:
+            self.leaders += 1
+            metrics.SINGLE_FLIGHT_CALLS.inc(role="leader")
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            self.coalesced += 1
+            metrics.SINGLE_FLIGHT_CALLS.inc(role="coalesced")
+        return await asyncio.shield(task)
+
+    async def join(self, key: str):
+        """Await the in-flight task for ``key``; None if nothing is running"""
+        task = self._calls.get(key)
+        if task is None:
+            return None
+        self.coalesced += 1
+        metrics.SINGLE_FLIGHT_CALLS.inc(role="coalesced")
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        return {
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._calls)
+        }
+
+single_flight = SingleFlight()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+"""
+Startup-time benchmark for the API process, checked against a recorded budget.
+
+Each run starts a fresh interpreter, as a newly scaled dyno does, and
+measures:
+
+- ``import_seconds``: ``import main``
+- ``first_response_seconds``: from interpreter start until the first
+  ``GET /story/history`` has been answered, through the app's lifespan
+  (migration check, background workers) with an already migrated database.
+
+The median of --runs runs is compared with startup_budget.json and the
+script exits with status 1 when either number is over budget, or when
+startup imported the LLM SDK (it should load on the first generation).
+After an intentional change, record a new budget with --record.
+
+    python startup_benchmark.py
+    python startup_benchmark.py --runs 9 --record
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BUDGET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "startup_budget.json")
+METRICS = ("import_seconds", "first_response_seconds")
+# Modules startup must not import
+LAZY_MODULES = ("openai",)
+
+def _measure_child():
+    """Runs in the fresh interpreter; prints one JSON line of timings"""
+    started = time.perf_counter()
+    import asyncio
+    import httpx
+    import main
+    imported = time.perf_counter()
+
+    async def first_response():
+        transport = httpx.ASGITransport(app=main.app)
+        async with main.app.router.lifespan_context(main.app):
+            async with httpx.AsyncClient(transport=transport, base_url="http://startup") as client:
+                response = await client.get("/story/history")
+                response.raise_for_status()
+                return time.perf_counter()
+
+    responded = asyncio.run(first_response())
+    print(json.dumps({
+        "import_seconds": imported - started,
+        "first_response_seconds": responded - started,
+        "lazy_modules_imported": [name for name in LAZY_MODULES if name in sys.modules],
+    }))
+
+def run_once(database_url: str) -> dict:
+    """Time one cold start in a new interpreter"""
+    backend = os.path.dirname(os.path.abspath(__file__))
+    env = {**os.environ, "DATABASE_URL": database_url, "LLM_PROVIDER": "local", "RATE_LIMIT_ENABLED": "false"}
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--measure"],
+        cwd=backend, env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def measure(runs: int = 5) -> dict:
+    """Median startup timings over ``runs`` cold starts against a migrated scratch database"""
+    with tempfile.TemporaryDirectory() as directory:
+        database_url = f"sqlite:///{os.path.join(directory, 'startup.db')}"
+        run_once(database_url)  # creates and migrates the database, warms the bytecode cache
+        samples = [run_once(database_url) for _ in range(runs)]
+    result = {metric: round(statistics.median(s[metric] for s in samples), 4) for metric in METRICS}
+    result["lazy_modules_imported"] = sorted({name for s in samples for name in s["lazy_modules_imported"]})
+    result["runs"] = runs
+    return result
+
+def load_budget(path: str = BUDGET_PATH) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+def check_budget(result: dict, budget: dict) -> list:
+    """Human-readable budget violations of ``result`` (empty when within budget)"""
+    failures = [
+        f"{metric} {result[metric]:.3f}s is over the budget of {budget[metric]:.3f}s"
+        for metric in METRICS if result[metric] > budget[metric]
+    ]
+    failures += [f"{name} was imported during startup" for name in result.get("lazy_modules_imported", [])]
+    return failures
+
+def record_budget(result: dict, headroom: float, path: str = BUDGET_PATH) -> dict:
+    """Write a budget of the measured timings plus ``headroom`` (0.5 = 50%)"""
+    budget = {metric: round(result[metric] * (1 + headroom), 3) for metric in METRICS}
+    budget["recorded"] = {
+        **{metric: result[metric] for metric in METRICS},
+        "headroom": headroom,
+        "python": platform.python_version(),
+        "timestamp": datetime.utcnow().isoformat(),
+    }
+    with open(path, "w") as f:
+        json.dump(budget, f, indent=2)
+        f.write("\n")
+    return budget
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", default=BUDGET_PATH, help="budget file to check against or record to")
+    parser.add_argument("--record", action="store_true", help="record the measured timings as the new budget")
+    parser.add_argument("--headroom", type=float, default=0.5, help="slack added to recorded timings (0.5 = 50%%)")
+    parser.add_argument("--measure", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.measure:
+        _measure_child()
+        return None
+
+    print(f"⏱️  Measuring {args.runs} cold starts...")
+    result = measure(args.runs)
+    for metric in METRICS:
+        print(f"  {metric:<24} {result[metric]:.3f}s")
+
+    if args.record:
+        budget = record_budget(result, args.headroom, args.budget)
+        print(f"💾 Budget written to {args.budget}: " + ", ".join(f"{m} {budget[m]}s" for m in METRICS))
+        return result
+
+    failures = check_budget(result, load_budget(args.budget))
+    if failures:
+        for failure in failures:
+            print(f"❌ {failure}")
+        sys.exit(1)
+    print("✅ Startup is within budget")
+    return result
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""
+Compression of stored story text.
+
+New stories are written to ``stories.story_blob`` compressed with the codec
+named in ``stories.story_codec``; the plain ``stories.story`` column is only
+used by rows written before compression (or with STORY_COMPRESSION=none)
+and is cleared once migrate_db.py has compressed them.
+
+The codec is gzip so the stored bytes can go out unchanged to clients that
+send ``Accept-Encoding: gzip`` (see ``GET /story/{id}/text?format=plain``).
+"""
+import gzip
+import os
+from typing import Optional
+
+GZIP = "gzip"
+CODECS = (GZIP,)
+
+def default_codec() -> Optional[str]:
+    """Codec for newly written stories, None to store plain text"""
+    codec = os.getenv("STORY_COMPRESSION", GZIP).lower()
+    if codec in ("", "none", "off"):
+        return None
+    if codec not in CODECS:
+        raise ValueError(f"Unknown STORY_COMPRESSION codec '{codec}'")
+    return codec
+
+def compress(text: str, codec: str = GZIP) -> bytes:
+    # mtime=0 keeps the output a pure function of the text
+    return gzip.compress(text.encode("utf-8"), compresslevel=9, mtime=0)
+
+def decompress(blob: bytes, codec: str) -> str:
+    if codec != GZIP:
+        raise ValueError(f"Unknown story codec '{codec}'")
+    return gzip.decompress(blob).decode("utf-8")
+
+def encode(text: Optional[str], codec: Optional[str] = None):
+    """``(text, codec, blob)`` column values for storing ``text``"""
+    codec = default_codec() if codec is None else codec
+    if text is None or codec is None:
+        return text, None, None
+    return None, codec, compress(text, codec)
@@ -1,17 +1,8 @@
-from openai import OpenAI
-import os
+import time
 
+from llm_providers import get_provider
+import metrics
 
-def _get_client():
-    """Return an OpenAI client built from the OPENAI_API_KEY env var.
-
-    This defers client creation until it's actually needed so importing this
-    module (e.g. to list universes) doesn't require the API key to be set.
-    """
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        raise ValueError("OPENAI_API_KEY environment variable is not set")
-    return OpenAI(api_key=api_key)
 
 # Universe knowledge bases
 UNIVERSES = {
@@ -57,21 +48,63 @@ UNIVERSES = {
     }
 }
 
-def generate_story(universe: str, what_if: str, length: str = "medium") -> dict:
-    """Generate a 'what if' story"""
-    
-    if universe not in UNIVERSES:
+# Length specifications
+LENGTH_SPECS = {
+    "short": "500-800 words, focus on one key scene",
+    "medium": "1000-1500 words, include 2-3 key scenes with character development",
+    "long": "1800-2500 words, full narrative arc with multiple scenes and deeper exploration"
+}
+
+def _universe_label(universe: str) -> str:
+    return metrics.universe_label(universe, tuple(UNIVERSES))
+
+def _complete(request: dict, universe: str):
+    """Run ``request`` on the configured provider and record its metrics"""
+    provider = get_provider()
+    started = time.perf_counter()
+    try:
+        completion = provider.complete(request)
+    except Exception as e:
+        metrics.observe_completion(provider.model, _universe_label(universe), started, error=e)
+        raise
+    metrics.observe_completion(provider.model, _universe_label(universe), started, completion)
+    return completion
+
+async def _acomplete(request: dict, universe: str):
+    """Async variant of _complete"""
+    provider = get_provider()
+    started = time.perf_counter()
+    try:
+        completion = await provider.acomplete(request)
+    except Exception as e:
+        metrics.observe_completion(provider.model, _universe_label(universe), started, error=e)
+        raise
+    metrics.observe_completion(provider.model, _universe_label(universe), started, completion)
+    return completion
+
+def _stream(request: dict, universe: str):
+    """Stream ``request`` on the configured provider, recording time to first token"""
+    provider = get_provider()
+    return metrics.instrument_stream(provider.astream(request), provider.model, _universe_label(universe))
+
+def validate_story_request(universe: str, what_if: str, custom: bool = False):
+    """Raise ValueError for a story request the model should never see.
+
+    Built-in stories must name a supported universe; custom ones any non-blank universe.
+    """
+    if custom and not universe.strip():
+        raise ValueError("Universe must not be empty")
+    if not custom and universe not in UNIVERSES:
         raise ValueError(f"Universe '{universe}' not supported")
+    if not what_if.strip():
+        raise ValueError("What if scenario must not be empty")
+
+def _story_request(universe: str, what_if: str, length: str) -> dict:
+    """Build the provider-neutral chat request for a built-in universe story"""
+    validate_story_request(universe, what_if)
     
     universe_info = UNIVERSES[universe]
     
-    # Length specifications
-    length_specs = {
-        "short": "500-800 words, focus on one key scene",
-        "medium": "1000-1500 words, include 2-3 key scenes with character development",
-        "long": "1800-2500 words, full narrative arc with multiple scenes and deeper exploration"
-    }
-    
     prompt = f"""{universe_info['context']}
 
 Write a {length} alternative story exploring this 'What If' scenario:
@@ -79,7 +112,7 @@ Write a {length} alternative story exploring this 'What If' scenario:
 **What If: {what_if}**
 
 Guidelines:
-- Length: {length_specs.get(length, length_specs['medium'])}
+- Length: {LENGTH_SPECS.get(length, LENGTH_SPECS['medium'])}
 - Stay true to the universe's tone, rules, and character personalities
 - Make it compelling with conflict, emotion, and resolution
 - Include specific details from the {universe} universe
@@ -87,10 +120,7 @@ Guidelines:
 
 Begin the story now:"""
 
-    client = _get_client()
-
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
+    return dict(
         messages=[
             {"role": "system", "content": "You are a creative writer who specializes in alternative universe fiction."},
             {"role": "user", "content": prompt}
@@ -98,23 +128,47 @@ Begin the story now:"""
         max_tokens=3000,
         temperature=0.8  # Higher temperature for more creativity
     )
-    
-    story_text = response.choices[0].message.content
-    word_count = len(story_text.split())
-    
+
+def _story_result(story_text: str, universe: str, what_if: str) -> dict:
+    """Package a completion the way generate_story callers expect"""
     return {
         "story": story_text,
-        "word_count": word_count,
+        "word_count": len(story_text.split()),
         "universe": universe,
         "what_if": what_if
     }
 
+def generate_story(universe: str, what_if: str, length: str = "medium") -> dict:
+    """Generate a 'what if' story"""
+    request = _story_request(universe, what_if, length)
+    completion = _complete(request, universe)
+    
+    return _story_result(completion.text, universe, what_if)
+
+async def generate_story_async(universe: str, what_if: str, length: str = "medium") -> dict:
+    """Generate a 'what if' story without blocking the event loop"""
+    request = _story_request(universe, what_if, length)
+    completion = await _acomplete(request, universe)
+    
+    return _story_result(completion.text, universe, what_if)
+
+def stream_story(universe: str, what_if: str, length: str = "medium"):
+    """Stream a 'what if' story as text deltas.
+
+    Raises ValueError immediately for an unsupported universe.
+    """
+    return _stream(_story_request(universe, what_if, length), universe)
+
+def default_system_prompt(universe: str) -> str:
+    """Generic system prompt used when a custom universe request has none"""
+    return f"You are an expert in the {universe} universe. Write in the style of {universe}."
+
 def get_available_universes():
     """Return list of supported universes"""
     return list(UNIVERSES.keys())
 
-def generate_universe_prompt(universe_name: str) -> str:
-    """Generate a system prompt for a custom universe"""
+def _universe_prompt_request(universe_name: str) -> dict:
+    """Build the provider-neutral chat request for a custom universe system prompt"""
     prompt = f"""Create a detailed system prompt for an AI writer to generate stories in the "{universe_name}" universe.
 
 The system prompt should:
@@ -126,10 +180,7 @@ The system prompt should:
 
 Format the response as a complete system prompt that can be used directly with an AI model. Start with "You are an expert in the {universe_name} universe..." and make it comprehensive but concise (150-200 words)."""
     
-    client = _get_client()
-
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
+    return dict(
         messages=[
             {"role": "system", "content": "You are an expert at creating detailed system prompts for creative AI writers."},
             {"role": "user", "content": prompt}
@@ -137,23 +188,26 @@ Format the response as a complete system prompt that can be used directly with a
         max_tokens=500,
         temperature=0.7
     )
-    
-    return response.choices[0].message.content
 
-def generate_story_with_prompt(universe: str, system_prompt: str, what_if: str, length: str = "medium") -> str:
-    """Generate a story using a custom system prompt"""
-    length_specs = {
-        "short": "500-800 words, focus on one key scene",
-        "medium": "1000-1500 words, include 2-3 key scenes with character development",
-        "long": "1800-2500 words, full narrative arc with multiple scenes and deeper exploration"
-    }
+def generate_universe_prompt(universe_name: str) -> str:
+    """Generate a system prompt for a custom universe"""
+    return _complete(_universe_prompt_request(universe_name), universe_name).text
+
+async def generate_universe_prompt_async(universe_name: str) -> str:
+    """Async variant of generate_universe_prompt"""
+    completion = await _acomplete(_universe_prompt_request(universe_name), universe_name)
     
+    return completion.text
+
+def _custom_story_request(universe: str, system_prompt: str, what_if: str, length: str) -> dict:
+    """Build the provider-neutral chat request for a story with a custom system prompt"""
+    validate_story_request(universe, what_if, custom=True)
     prompt = f"""Write a {length} alternative story exploring this 'What If' scenario:
 
 **What If: {what_if}**
 
 Guidelines:
-- Length: {length_specs.get(length, length_specs['medium'])}
+- Length: {LENGTH_SPECS.get(length, LENGTH_SPECS['medium'])}
 - Stay true to the universe's tone, rules, and character personalities
 - Make it compelling with conflict, emotion, and resolution
 - Include specific details from the {universe} universe
@@ -161,10 +215,7 @@ Guidelines:
 
 Begin the story now:"""
     
-    client = _get_client()
-
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
+    return dict(
         messages=[
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": prompt}
@@ -172,5 +223,23 @@ Begin the story now:"""
         max_tokens=3000,
         temperature=0.8
     )
+
+def generate_story_with_prompt(universe: str, system_prompt: str, what_if: str, length: str = "medium") -> str:
+    """Generate a story using a custom system prompt"""
+    request = _custom_story_request(universe, system_prompt, what_if, length)
     
-    return response.choices[0].message.content
\ No newline at end of file
+    return _complete(request, universe).text
+
+async def generate_story_with_prompt_async(universe: str, system_prompt: str, what_if: str, length: str = "medium") -> str:
+    """Async variant of generate_story_with_prompt"""
+    request = _custom_story_request(universe, system_prompt, what_if, length)
+    completion = await _acomplete(request, universe)
+    
+    return completion.text
+
+def stream_story_with_prompt(universe: str, system_prompt: str, what_if: str, length: str = "medium"):
+    """Stream a story with a custom system prompt as text deltas.
+
+    Raises ValueError immediately for an invalid request.
+    """
+    return _stream(_custom_story_request(universe, system_prompt, what_if, length), universe)
@@ -0,0 +1,56 @@
+"""
+Server-Sent Events relay for streamed story generation.
+
+Tokens are forwarded to the client as ``token`` events while they arrive.
+Once the model finishes, the story is persisted and a closing ``done``
+event carries its id and metadata. If the client disconnects, the upstream
+stream is closed straight away so no more tokens are generated for it.
+"""
+import asyncio
+import json
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",  # keep nginx-style proxies from buffering the stream
+}
+
+def sse_event(event: str, data: dict) -> str:
+    """Format one SSE message"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def relay_story(request: Request, chunks, persist):
+    """Relay ``chunks`` as SSE and persist the full text when the stream ends.
+
+    ``persist`` is a blocking callable taking the complete story text and
+    returning the JSON-serializable payload of the closing ``done`` event.
+    """
+    parts = []
+    try:
+        async for text in chunks:
+            if await request.is_disconnected():
+                return
+            parts.append(text)
+            yield sse_event("token", {"text": text})
+
+        payload = await asyncio.to_thread(persist, "".join(parts))
+        yield sse_event("done", payload)
+    except Exception as e:
+        yield sse_event("error", {"detail": f"Story generation failed: {str(e)}"})
+    finally:
+        # Stops the upstream completion when we exit early for any reason
+        await chunks.aclose()
+
+async def replay_text(text: str):
+    """Stream an already generated story as a single chunk"""
+    yield text
+
+def story_stream_response(request: Request, chunks, persist) -> StreamingResponse:
+    """Wrap relay_story in a text/event-stream response"""
+    return StreamingResponse(
+        relay_story(request, chunks, persist),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
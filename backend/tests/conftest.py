@@ -8,8 +8,12 @@ from fastapi.testclient import TestClient
 # Add backend directory to path so we can import modules
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+# Query budget violations fail the test instead of printing a warning
+os.environ.setdefault("QUERY_BUDGET_MODE", "raise")
+
 from database import Base, get_db
 from main import app
+import query_budget
 
 from sqlalchemy.pool import StaticPool
 
@@ -23,6 +27,7 @@ def test_engine():
         connect_args={"check_same_thread": False},
         poolclass=StaticPool
     )
+    query_budget.instrument_engine(engine)
     return engine
 
 @pytest.fixture(scope="function")
@@ -47,3 +52,34 @@ def client(test_db):
     app.dependency_overrides[get_db] = override_get_db
     yield TestClient(app)
     app.dependency_overrides.clear()
+
+@pytest.fixture(autouse=True)
+def reset_process_caches():
+    """Keep in-process cache entries from leaking between per-test databases"""
+    from generation_cache import generation_cache
+    from universe_prompts import universe_prompts
+    from llm_client import llm_clients
+    import llm_providers
+    from rate_limit import rate_limiter
+    rate_limiter.store.clear()
+    generation_cache.lru.clear()
+    universe_prompts.lru.clear()
+    llm_clients.reset()
+    llm_providers.set_provider(None)
+    yield
+    generation_cache.lru.clear()
+    universe_prompts.lru.clear()
+    llm_clients.reset()
+    llm_providers.set_provider(None)
+
+@pytest.fixture
+def query_counter():
+    """Count the queries run inside a ``with`` block, including those served by TestClient.
+
+        with query_counter() as queries:
+            client.get("/story/history")
+        assert queries.count == 1
+    """
+    def counter(budget=None, repeat_threshold=None):
+        return query_budget.track_queries("test", budget, repeat_threshold, all_threads=True)
+    return counter
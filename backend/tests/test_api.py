@@ -2,7 +2,7 @@ import pytest
 from fastapi.testclient import TestClient
 from unittest.mock import patch, MagicMock
 from main import app
-from database import Base, engine, get_db, SessionLocal
+from database import Base, engine, get_db, SessionLocal, create_schema
 import os
 
 # Create a new testing database
@@ -20,32 +20,41 @@ def override_get_db():
 
 app.dependency_overrides[get_db] = override_get_db
 
+# Importing the app no longer creates tables
+create_schema()
+
 client = TestClient(app)
 
-def test_read_root():
-    response = client.get("/")
+def test_read_root(query_counter):
+    with query_counter() as queries:
+        response = client.get("/")
     assert response.status_code == 200
+    assert queries.count == 0
     data = response.json()
     assert data["message"] == "What If Novel AI API"
     assert "endpoints" in data
 
-def test_get_universes():
-    response = client.get("/universes")
+def test_get_universes(query_counter):
+    with query_counter() as queries:
+        response = client.get("/universes")
     assert response.status_code == 200
+    assert queries.count == 0
     data = response.json()
     assert "universes" in data
     assert len(data["universes"]) > 0
     assert "Harry Potter" in data["universes"]
 
-def test_get_history():
-    response = client.get("/story/history")
+def test_get_history(query_counter):
+    with query_counter() as queries:
+        response = client.get("/story/history")
     assert response.status_code == 200
+    assert queries.count == 1
     data = response.json()
     assert "stories" in data
     assert "count" in data
 
-@patch("main.generate_story")
-def test_generate_story(mock_generate_story):
+@patch("main.generate_story_async")
+def test_generate_story(mock_generate_story, query_counter):
     # Mock the AI response
     mock_generate_story.return_value = {
         "story": "This is a test story generated by pytest.",
@@ -58,9 +67,12 @@ def test_generate_story(mock_generate_story):
         "length": "short"
     }
     
-    response = client.post("/story/generate", json=payload)
+    with query_counter() as queries:
+        response = client.post("/story/generate", json=payload)
     
     assert response.status_code == 200
+    # cache lookup, insert, search index entry, refresh
+    assert queries.count <= 4
     data = response.json()
     assert data["universe"] == "Harry Potter"
     assert data["what_if"] == "What if tests passed?"
@@ -73,8 +85,8 @@ def test_generate_story(mock_generate_story):
     # We access the real DB via TestClient/app, so we can verify via API
     # But ideally avoid depending on shared state. For now it's fine.
 
-@patch("story_generator.generate_story_with_prompt")
-def test_generate_custom_story(mock_generate_custom):
+@patch("story_generator.generate_story_with_prompt_async")
+def test_generate_custom_story(mock_generate_custom, query_counter):
     mock_generate_custom.return_value = "This is a custom test story."
     
     payload = {
@@ -84,9 +96,11 @@ def test_generate_custom_story(mock_generate_custom):
         "length": "short"
     }
 
-    response = client.post("/story/generate-custom", json=payload)
+    with query_counter() as queries:
+        response = client.post("/story/generate-custom", json=payload)
     
     assert response.status_code == 200
+    assert queries.count <= 4
     data = response.json()
     assert data["universe"] == "Custom World"
     assert data["story"] == "This is a custom test story."
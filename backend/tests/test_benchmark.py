@@ -0,0 +1,62 @@
+import asyncio
+import httpx
+import pytest
+from sqlalchemy import func
+from database import Story, Rating, TRENDING_PRIOR_MEAN, TRENDING_PRIOR_WEIGHT
+from llm_providers import LocalProvider, set_provider
+from main import app
+import benchmark
+
+def test_percentile_nearest_rank():
+    samples = list(range(1, 101))
+    assert benchmark.percentile(samples, 50) == 50
+    assert benchmark.percentile(samples, 95) == 95
+    assert benchmark.percentile(samples, 99) == 99
+    assert benchmark.percentile([], 99) == 0.0
+
+def test_seed_database_keeps_aggregates_consistent(test_engine, test_db):
+    stats = benchmark.seed_database(test_engine, stories=50, ratings=400, story_words=20)
+    assert stats["stories"] == 50
+
+    assert test_db.query(func.count(Story.id)).scalar() == 50
+    assert test_db.query(func.count(Rating.id)).scalar() == 400
+    assert test_db.query(func.sum(Story.rating_count)).scalar() == 400
+    assert test_db.query(func.sum(Story.rating_sum)).scalar() == test_db.query(func.sum(Rating.rating_value)).scalar()
+
+    story = test_db.query(Story).order_by(Story.rating_count.desc()).first()
+    assert sum(story.rating_distribution.values()) == story.rating_count
+    expected = (TRENDING_PRIOR_WEIGHT * TRENDING_PRIOR_MEAN + story.rating_sum) / (TRENDING_PRIOR_WEIGHT + story.rating_count)
+    assert abs(story.trending_score - expected) < 1e-9
+
+def test_workload_reports_every_endpoint(test_engine, client, monkeypatch):
+    set_provider(LocalProvider())
+    monkeypatch.setattr("rate_limit.rate_limiter.enabled", False)
+    benchmark.seed_database(test_engine, stories=30, ratings=100, story_words=20, share_fraction=0.5)
+    targets = benchmark.load_targets(test_engine)
+    assert targets["max_id"] == 30 and targets["share_tokens"]
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+            return await benchmark.run_workload(http, targets, concurrency=1, requests=300)
+
+    result = asyncio.run(scenario())
+    assert result["total"]["requests"] == 300
+    assert result["total"]["errors"] == 0
+    assert set(result["endpoints"]) == set(benchmark.WORKLOAD)
+    for stats in result["endpoints"].values():
+        assert stats["p50_ms"] <= stats["p95_ms"] <= stats["p99_ms"] <= stats["max_ms"]
+
+def test_remote_runs_require_the_local_provider(monkeypatch):
+    async def check():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+            await benchmark.check_remote_provider(http)
+
+    set_provider(LocalProvider())
+    asyncio.run(check())
+
+    set_provider(None)
+    monkeypatch.setenv("LLM_PROVIDER", "openai")
+    with pytest.raises(SystemExit):
+        asyncio.run(check())
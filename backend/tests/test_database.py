@@ -71,3 +71,31 @@ def test_related_cascade_delete(test_db):
     test_db.commit()
     
     assert test_db.query(Rating).count() == 0
+
+def test_rating_aggregates_follow_updates(test_db):
+    """Test that changing or removing a rating keeps the stored aggregates in sync"""
+    story = Story(universe="U", what_if="W", story="S", word_count=10)
+    test_db.add(story)
+    test_db.commit()
+
+    r1 = Rating(story_id=story.id, session_id="s1", rating_value=2)
+    r2 = Rating(story_id=story.id, session_id="s2", rating_value=4)
+    test_db.add_all([r1, r2])
+    test_db.commit()
+
+    r1.rating_value = 5
+    test_db.commit()
+    test_db.refresh(story)
+
+    assert story.rating_sum == 9
+    assert story.rating_count == 2
+    assert story.average_rating == 4.5
+    assert story.rating_distribution == {1: 0, 2: 0, 3: 0, 4: 1, 5: 1}
+
+    test_db.delete(r2)
+    test_db.commit()
+    test_db.refresh(story)
+
+    assert story.rating_count == 1
+    assert story.average_rating == 5.0
+    assert story.rating_distribution[4] == 0
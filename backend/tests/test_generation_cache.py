@@ -0,0 +1,60 @@
+import time
+import pytest
+from unittest.mock import patch
+from database import Story
+from generation_cache import GenerationCache, scenario_key, normalize_text
+from ttl_cache import TTLCache
+
+def test_scenario_key_normalizes_equivalent_requests():
+    a = scenario_key("Harry Potter", "What if Harry was sorted into Slytherin?", "medium")
+    b = scenario_key("harry potter", "  what if harry was   sorted into slytherin ", "medium")
+    assert a == b
+    assert a != scenario_key("Harry Potter", "What if Harry was sorted into Slytherin?", "short")
+    assert a != scenario_key("Harry Potter", "What if Harry was sorted into Slytherin?", "medium", "Custom prompt")
+    assert normalize_text(None) == ""
+
+def test_ttl_cache_expires_and_evicts():
+    cache = TTLCache(max_size=2, ttl_seconds=0.05)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None  # least recently used
+    assert cache.get("a") == 1
+    time.sleep(0.06)
+    assert cache.get("a") is None
+
+def test_reuses_only_after_variant_cap(test_db):
+    cache = GenerationCache(max_variants=2, lru_size=10, ttl_seconds=60)
+    key = scenario_key("DC", "What if?", "short")
+
+    assert cache.find(test_db, key) is None
+    first = Story(universe="DC", what_if="What if?", story="one", word_count=1, scenario_hash=key)
+    test_db.add(first)
+    test_db.commit()
+    cache.remember(key, first.id)
+    assert cache.find(test_db, key) is None
+
+    second = Story(universe="DC", what_if="What if?", story="two", word_count=1, scenario_hash=key)
+    test_db.add(second)
+    test_db.commit()
+    cache.remember(key, second.id)
+
+    hit = cache.find(test_db, key)
+    assert hit.id in {first.id, second.id}
+    assert cache.stats()["hits"] == 1
+
+@patch("main.generate_story_async")
+def test_generate_endpoint_serves_cached_variant(mock_gen, client, monkeypatch):
+    monkeypatch.setattr("main.generation_cache", GenerationCache(max_variants=1, lru_size=10, ttl_seconds=60))
+    mock_gen.return_value = {"story": "Cached once", "word_count": 2}
+    payload = {"universe": "Star Wars", "what_if": "What if Vader won?", "length": "short"}
+
+    first = client.post("/story/generate", json=payload).json()
+    again = client.post("/story/generate", json={**payload, "what_if": "what if vader won"}).json()
+    assert again["id"] == first["id"]
+    assert mock_gen.call_count == 1
+
+    fresh = client.post("/story/generate", json={**payload, "fresh": True}).json()
+    assert fresh["id"] != first["id"]
+    assert mock_gen.call_count == 2
@@ -0,0 +1,55 @@
+import pytest
+from datetime import datetime, timedelta
+from database import Story
+import history
+from pagination import encode_cursor, decode_cursor
+
+def _seed(test_db, count, same_timestamp=False):
+    base = datetime(2025, 1, 1)
+    stories = []
+    for i in range(count):
+        created = base if same_timestamp else base + timedelta(minutes=i)
+        story = Story(universe="U", what_if=f"W{i}", story="S" * 1000, word_count=10, created_at=created)
+        test_db.add(story)
+        stories.append(story)
+    test_db.commit()
+    return stories
+
+def test_cursor_round_trip():
+    cursor = encode_cursor("2025-01-01T00:00:00", 42)
+    assert decode_cursor(cursor, 2) == ["2025-01-01T00:00:00", 42]
+    with pytest.raises(ValueError):
+        decode_cursor("not-a-cursor", 2)
+    with pytest.raises(ValueError):
+        decode_cursor(encode_cursor(1, 2, 3), 2)
+
+@pytest.mark.parametrize("same_timestamp", [False, True])
+def test_pages_walk_every_story_once(test_db, same_timestamp):
+    stories = _seed(test_db, 7, same_timestamp=same_timestamp)
+
+    seen, cursor = [], None
+    while True:
+        page = history.get_history_page(test_db, limit=3, cursor=cursor)
+        seen.extend(s["id"] for s in page["stories"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    expected = sorted(stories, key=lambda s: (s.created_at, s.id), reverse=True)
+    assert seen == [s.id for s in expected]
+
+def test_history_endpoint_pagination(client, test_db):
+    _seed(test_db, 3)
+
+    first = client.get("/story/history", params={"limit": 2}).json()
+    assert first["count"] == 2
+    assert "story" not in first["stories"][0]
+    assert first["next_cursor"]
+
+    second = client.get("/story/history", params={"limit": 2, "cursor": first["next_cursor"]}).json()
+    assert second["count"] == 1
+    assert second["next_cursor"] is None
+
+def test_history_rejects_bad_cursor(client):
+    response = client.get("/story/history", params={"cursor": "garbage"})
+    assert response.status_code == 400
@@ -0,0 +1,23 @@
+from types import SimpleNamespace
+from http_cache import etag_matches, story_etag, rating_version
+
+def test_etag_matches_lists_weak_tags_and_wildcard():
+    assert etag_matches('"a", W/"b"', '"b"')
+    assert etag_matches("*", '"c"')
+    assert not etag_matches('"a"', '"b"')
+    assert not etag_matches(None, '"b"')
+
+def test_story_etag_tracks_rating_fields():
+    story = SimpleNamespace(id=7, rating_count=2, rating_sum=9, rating=0)
+    assert rating_version(story) == "2.9.0"
+    assert story_etag(story) == '"story-7-r2.9.0"'
+    assert story_etag(story, shared=True, split=True) == '"story-7-r2.9.0-s-meta"'
+    story.rating_sum = 8
+    assert story_etag(story) != '"story-7-r2.9.0"'
+
+def test_accepts_encoding():
+    from http_cache import accepts_encoding
+    assert accepts_encoding("gzip, deflate, br", "gzip")
+    assert accepts_encoding("br;q=1.0, *;q=0.5", "gzip")
+    assert not accepts_encoding("gzip;q=0", "gzip")
+    assert not accepts_encoding(None, "gzip")
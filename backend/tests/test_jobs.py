@@ -0,0 +1,188 @@
+import asyncio
+import pytest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+from sqlalchemy.orm import sessionmaker
+from database import GenerationJob, Story
+from jobs import JobQueue, PENDING, RUNNING, SUCCEEDED, FAILED
+
+@pytest.fixture
+def queue(test_engine, test_db):
+    return JobQueue(session_factory=sessionmaker(bind=test_engine), workers=1, poll_seconds=0.01,
+                    lease_seconds=60, max_attempts=2)
+
+@patch("story_generator.generate_story_async")
+def test_builtin_job_runs_to_completion(mock_gen, queue, test_db):
+    mock_gen.return_value = {"story": "A queued tale", "word_count": 3}
+    job = queue.submit(test_db, universe="Harry Potter", what_if="What if?", length="short")
+    assert job.status == PENDING
+    assert job.system_prompt is None
+
+    asyncio.run(queue.run_until_empty())
+
+    test_db.refresh(job)
+    assert job.status == SUCCEEDED
+    assert job.attempts == 1
+    assert job.story.story == "A queued tale"
+    assert mock_gen.call_args.kwargs["length"] == "short"
+
+@patch("story_generator.generate_story_with_prompt_async")
+def test_custom_job_gets_default_prompt(mock_gen, queue, test_db):
+    mock_gen.return_value = "Spice flows"
+    job = queue.submit(test_db, universe="Dune", what_if="What if?")
+
+    asyncio.run(queue.run_until_empty())
+
+    test_db.refresh(job)
+    assert job.status == SUCCEEDED
+    assert "Dune" in mock_gen.call_args.kwargs["system_prompt"]
+
+@patch("story_generator.generate_story_async")
+def test_transient_errors_retry_then_fail(mock_gen, queue, test_db):
+    mock_gen.side_effect = RuntimeError("rate limited")
+    job = queue.submit(test_db, universe="Star Wars", what_if="What if?")
+
+    asyncio.run(queue.run_until_empty())
+
+    test_db.refresh(job)
+    assert job.status == FAILED
+    assert job.attempts == 2
+    assert job.error == "rate limited"
+    assert test_db.query(Story).count() == 0
+
+def test_expired_running_job_is_reclaimed(queue, test_db):
+    job = GenerationJob(id="stale", status=RUNNING, universe="DC", what_if="W", length="short",
+                        attempts=1, started_at=datetime.utcnow() - timedelta(hours=1))
+    fresh = GenerationJob(id="fresh", status=RUNNING, universe="DC", what_if="W", length="short",
+                          attempts=1, started_at=datetime.utcnow())
+    test_db.add_all([job, fresh])
+    test_db.commit()
+
+    claimed = queue.claim()
+    assert claimed["id"] == "stale"
+    assert claimed["attempts"] == 2
+    assert queue.claim() is None
+
+def test_worker_that_lost_its_lease_cannot_finish_the_job(queue, test_db):
+    queue.submit(test_db, universe="Harry Potter", what_if="What if?", length="short")
+    first = queue.claim()
+
+    # The first worker waits for an LLM slot past its lease and another worker reclaims the job
+    test_db.query(GenerationJob).update({"started_at": datetime.utcnow() - timedelta(hours=1)})
+    test_db.commit()
+    second = queue.claim()
+    assert second["id"] == first["id"]
+
+    assert queue.renew_lease(first) is False
+    queue.complete(first, "Stale worker's story")
+    queue.fail(first, RuntimeError("stale worker"))
+    assert queue.renew_lease(second) is True
+    queue.complete(second, "The story")
+
+    test_db.expire_all()
+    job = test_db.get(GenerationJob, first["id"])
+    assert job.status == SUCCEEDED
+    assert job.error is None
+    assert [story.story for story in test_db.query(Story).all()] == ["The story"]
+
+@patch("story_generator.generate_story_async")
+def test_workers_pick_up_jobs_and_release_on_stop(mock_gen, queue, test_db):
+    started = []
+
+    async def slow_generation(**kwargs):
+        started.append(kwargs)
+        await asyncio.sleep(10)
+
+    mock_gen.side_effect = slow_generation
+    job = queue.submit(test_db, universe="Naruto", what_if="What if?")
+
+    async def scenario():
+        queue.start()
+        for _ in range(100):
+            if started:
+                break
+            await asyncio.sleep(0.01)
+        await queue.stop()
+
+    asyncio.run(scenario())
+
+    test_db.refresh(job)
+    assert started
+    assert job.status == PENDING
+    assert job.attempts == 0
+
+@patch("story_generator.generate_story_async")
+def test_worker_survives_database_errors(mock_gen, queue, test_db, monkeypatch):
+    mock_gen.return_value = {"story": "A queued tale", "word_count": 3}
+    job = queue.submit(test_db, universe="Harry Potter", what_if="What if?", length="short")
+
+    complete = queue.complete
+    calls = []
+
+    def locked_once(job, story_text):
+        calls.append(job["id"])
+        if len(calls) == 1:
+            raise RuntimeError("database is locked")
+        complete(job, story_text)
+
+    def fail_broken(job, error):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(queue, "complete", locked_once)
+    monkeypatch.setattr(queue, "fail", fail_broken)
+
+    async def scenario():
+        queue.start()
+        for _ in range(200):
+            test_db.expire_all()
+            if test_db.get(GenerationJob, job.id).status == SUCCEEDED:
+                break
+            await asyncio.sleep(0.01)
+        alive = [task for task in queue._tasks if not task.done()]
+        await queue.stop()
+        return alive
+
+    alive = asyncio.run(scenario())
+    test_db.refresh(job)
+    assert job.status == SUCCEEDED
+    assert len(calls) == 2
+    assert len(alive) == queue.workers
+
+def test_job_endpoints(client, test_db, queue, monkeypatch):
+    monkeypatch.setattr("main.job_queue", queue)
+
+    response = client.post("/story/jobs", json={"universe": "DC", "what_if": "What if?"})
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+
+    status = client.get(f"/story/jobs/{job_id}").json()
+    assert status["status"] == PENDING
+
+    with patch("story_generator.generate_story_async") as mock_gen:
+        mock_gen.return_value = {"story": "Done story", "word_count": 2}
+        asyncio.run(queue.run_until_empty())
+
+    test_db.expire_all()
+    status = client.get(f"/story/jobs/{job_id}").json()
+    assert status["status"] == SUCCEEDED
+    assert status["story"]["story"] == "Done story"
+
+    assert client.get("/story/jobs/missing").status_code == 404
+
+@patch("story_generator.generate_story_async")
+def test_job_reuses_cached_variant_unless_fresh(mock_gen, test_engine, test_db):
+    from generation_cache import GenerationCache
+    queue = JobQueue(session_factory=sessionmaker(bind=test_engine), workers=1,
+                     cache=GenerationCache(max_variants=1, lru_size=10, ttl_seconds=60))
+    mock_gen.return_value = {"story": "Only once", "word_count": 2}
+
+    first = queue.submit(test_db, universe="DC", what_if="What if?")
+    second = queue.submit(test_db, universe="DC", what_if="what if")
+    third = queue.submit(test_db, universe="DC", what_if="What if?", fresh=True)
+    asyncio.run(queue.run_until_empty())
+
+    for job in (first, second, third):
+        test_db.refresh(job)
+    assert second.story_id == first.story_id
+    assert third.story_id != first.story_id
+    assert mock_gen.call_count == 2
@@ -0,0 +1,95 @@
+import asyncio
+import pytest
+from sqlalchemy.orm import sessionmaker
+from database import Story, Rating
+from leaderboard import Leaderboard, LeaderboardSnapshot, GLOBAL_BOARD
+
+def _add_story(test_db, universe, ratings=()):
+    story = Story(universe=universe, what_if="W", story="S", word_count=10)
+    test_db.add(story)
+    test_db.commit()
+    for i, value in enumerate(ratings):
+        test_db.add(Rating(story_id=story.id, session_id=f"s{i}", rating_value=value))
+    test_db.commit()
+    return story
+
+@pytest.fixture
+def board(test_engine, test_db):
+    return Leaderboard(session_factory=sessionmaker(bind=test_engine), refresh_seconds=60)
+
+def test_rebuild_covers_builtin_and_custom_universes(board, test_db):
+    hp = _add_story(test_db, "Harry Potter", [5, 5])
+    custom = _add_story(test_db, "Dune", [4])
+
+    snapshot = board.rebuild()
+
+    assert snapshot.version == 1
+    assert [s["id"] for s in snapshot.get(GLOBAL_BOARD, 10)] == [hp.id, custom.id]
+    assert [s["id"] for s in snapshot.get("Dune", 10)] == [custom.id]
+    assert snapshot.get("Star Wars", 10) == []
+    assert snapshot.get("Never Seen", 10) is None
+
+def test_rebuild_query_count_does_not_grow_with_universes(board, test_db, query_counter):
+    for i in range(5):
+        _add_story(test_db, f"Custom {i}", [4])
+    with query_counter() as queries:
+        snapshot = board.rebuild()
+    assert queries.count == 2
+    assert len(snapshot.get("Custom 3", 10)) == 1
+
+def test_rebuild_only_bumps_version_on_change(board, test_db):
+    story = _add_story(test_db, "DC", [3])
+    first = board.rebuild()
+    assert board.rebuild() is first
+
+    test_db.add(Rating(story_id=story.id, session_id="other", rating_value=5))
+    test_db.commit()
+    second = board.rebuild()
+    assert second.version == first.version + 1
+    assert second.etag != first.etag
+
+def test_etag_depends_on_contents_not_version(board, test_db):
+    _add_story(test_db, "DC", [3])
+    snapshot = board.rebuild()
+    # Another worker building the same boards has its own version counter
+    other = LeaderboardSnapshot(snapshot.version + 7, dict(snapshot.boards), snapshot.generated_at)
+    assert other.etag == snapshot.etag
+
+def test_large_score_change_wakes_refresher(board):
+    async def scenario():
+        task = asyncio.create_task(board.run())
+        for _ in range(200):
+            if board.snapshot is not None and board._wake.bound:
+                break
+            await asyncio.sleep(0.01)
+        first = board.snapshot
+        board.note_score_change(3.0, 3.01)
+        assert not board._wake.is_set()
+        board.note_score_change(3.0, 4.0)
+        await asyncio.sleep(0)
+        assert board._wake.is_set()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return first
+
+    assert asyncio.run(scenario()) is not None
+
+def test_trending_endpoint_serves_snapshot_with_etag(client, test_db, board, monkeypatch):
+    story = _add_story(test_db, "Naruto", [5])
+    monkeypatch.setattr("main.leaderboard", board)
+    board.rebuild()
+
+    response = client.get("/story/trending", params={"universe": "Naruto"})
+    assert response.status_code == 200
+    assert response.headers["ETag"] == board.snapshot.etag
+    data = response.json()
+    assert data["version"] == board.snapshot.version
+    assert [s["id"] for s in data["stories"]] == [story.id]
+
+    cached = client.get("/story/trending", params={"universe": "Naruto"},
+                        headers={"If-None-Match": board.snapshot.etag})
+    assert cached.status_code == 304
+    for header in (f"W/{board.snapshot.etag}", f'"stale", {board.snapshot.etag}', "*"):
+        assert client.get("/story/trending", params={"universe": "Naruto"},
+                          headers={"If-None-Match": header}).status_code == 304
@@ -0,0 +1,88 @@
+import asyncio
+import os
+import time
+import pytest
+from unittest.mock import patch
+import llm_providers
+import story_generator
+from llm_providers import (
+    Completion, LLMProvider, LocalProvider, LocalProviderError, OpenAIProvider, ProviderConfigurationError, get_provider,
+)
+
+REQUEST = story_generator._story_request("Star Wars", "What if Vader turned back early?", "short")
+
+def test_local_provider_is_deterministic():
+    first = LocalProvider().complete(REQUEST)
+    second = LocalProvider().complete(REQUEST)
+    other = LocalProvider().complete(story_generator._story_request("Star Wars", "What if Han shot second?", "short"))
+
+    assert first.text == second.text
+    assert first.text != other.text
+    assert len(first.text.split()) == int(REQUEST["max_tokens"] * LocalProvider.WORDS_PER_MAX_TOKEN)
+    assert first.completion_tokens > 0 and first.prompt_tokens > 0
+
+def test_local_stream_matches_completion():
+    provider = LocalProvider()
+
+    async def collect():
+        return [text async for text in provider.astream(REQUEST)]
+
+    chunks = asyncio.run(collect())
+    assert len(chunks) > 1
+    assert "".join(chunks) == provider.complete(REQUEST).text
+
+def test_local_latency_and_token_rate():
+    provider = LocalProvider(latency_ms=50, tokens_per_second=1e6)
+    started = time.perf_counter()
+    asyncio.run(provider.acomplete(REQUEST))
+    assert time.perf_counter() - started >= 0.05
+
+def test_local_error_injection():
+    with pytest.raises(LocalProviderError):
+        LocalProvider(error_rate=1).complete(REQUEST)
+
+    provider = LocalProvider(error_rate=0.5, seed=7)
+    outcomes = []
+    for _ in range(40):
+        try:
+            provider.complete(REQUEST)
+            outcomes.append(True)
+        except LocalProviderError:
+            outcomes.append(False)
+    assert 0 < outcomes.count(False) < 40
+
+def test_provider_selected_by_env():
+    with patch.dict(os.environ, {"LLM_PROVIDER": "local"}):
+        provider = get_provider()
+        assert isinstance(provider, LocalProvider)
+        assert get_provider() is provider
+        result = story_generator.generate_story("Star Wars", "What if?", "short")
+    assert result["word_count"] > 0
+
+    with patch.dict(os.environ, {"LLM_PROVIDER": "openai"}):
+        assert isinstance(get_provider(), OpenAIProvider)
+
+    with patch.dict(os.environ, {"LLM_PROVIDER": "nope"}):
+        with pytest.raises(ProviderConfigurationError):
+            get_provider()
+
+def test_unknown_provider_is_a_server_error(client):
+    with patch.dict(os.environ, {"LLM_PROVIDER": "nope"}):
+        response = client.post("/story/generate", json={
+            "universe": "Star Wars", "what_if": "What if?", "length": "short", "fresh": True
+        })
+    assert response.status_code == 500
+    assert "LLM_PROVIDER" in response.json()["detail"]
+
+def test_providers_must_implement_the_interface():
+    class Incomplete(LLMProvider):
+        def complete(self, request):
+            return Completion("", self.model)
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+def test_set_provider_overrides_env():
+    provider = LocalProvider()
+    llm_providers.set_provider(provider)
+    assert get_provider() is provider
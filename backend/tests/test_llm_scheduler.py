@@ -0,0 +1,166 @@
+import asyncio
+import math
+import pytest
+from unittest.mock import patch
+from llm_scheduler import LLMScheduler, SchedulerOverloaded, priority_for
+
+def test_priority_for_length():
+    assert priority_for("short") == "short"
+    assert priority_for("long") == "long"
+    assert priority_for("epic") == "medium"
+
+def test_concurrency_is_capped():
+    scheduler = LLMScheduler(max_concurrency=2, deadline_seconds=600)
+    running = []
+    peak = []
+
+    async def call(i):
+        async with scheduler.slot(f"s{i}", "medium"):
+            running.append(i)
+            peak.append(len(running))
+            await asyncio.sleep(0.01)
+            running.remove(i)
+
+    async def scenario():
+        await asyncio.gather(*(call(i) for i in range(6)))
+
+    asyncio.run(scenario())
+    assert max(peak) == 2
+    assert scheduler.in_use == 0 and scheduler.depth() == 0
+
+def test_cheap_work_first_and_sessions_round_robin():
+    scheduler = LLMScheduler(max_concurrency=1, deadline_seconds=600, aging_seconds=60)
+    order = []
+
+    async def call(session, priority, name):
+        async with scheduler.slot(session, priority):
+            order.append(name)
+            await asyncio.sleep(0)
+
+    async def scenario():
+        blocker = await scheduler.acquire("x", "medium")
+        tasks = [asyncio.create_task(call("heavy", "long", f"heavy-long-{i}")) for i in range(3)]
+        tasks += [asyncio.create_task(call("heavy", "short", f"heavy-short-{i}")) for i in range(3)]
+        tasks.append(asyncio.create_task(call("light", "short", "light-short")))
+        tasks.append(asyncio.create_task(call("ui", "system_prompt", "prompt")))
+        await asyncio.sleep(0)
+        assert scheduler.depth() == 8
+        scheduler.release(blocker)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(scenario())
+    assert order == [
+        "prompt",
+        "heavy-short-0", "light-short", "heavy-short-1", "heavy-short-2",
+        "heavy-long-0", "heavy-long-1", "heavy-long-2",
+    ]
+
+def test_aged_waiters_jump_ahead_of_cheaper_work():
+    scheduler = LLMScheduler(max_concurrency=1, deadline_seconds=60, aging_seconds=0.01)
+    order = []
+
+    async def call(priority):
+        async with scheduler.slot(priority, priority):
+            order.append(priority)
+
+    async def scenario():
+        blocker = await scheduler.acquire("x", "medium")
+        long_task = asyncio.create_task(call("long"))
+        await asyncio.sleep(0.02)
+        short_task = asyncio.create_task(call("short"))
+        await asyncio.sleep(0)
+        scheduler.release(blocker)
+        await asyncio.gather(long_task, short_task)
+
+    asyncio.run(scenario())
+    assert order == ["long", "short"]
+
+def test_rejects_when_estimated_wait_exceeds_deadline():
+    scheduler = LLMScheduler(max_concurrency=1, deadline_seconds=20)
+
+    async def scenario():
+        ticket = await scheduler.acquire("a", "long")
+        with pytest.raises(SchedulerOverloaded) as error:
+            await scheduler.acquire("b", "long")  # the running long story alone is expected to take 45s
+        # Jobs opt out of the deadline and simply queue
+        waiting = asyncio.create_task(scheduler.acquire("jobs", "long", deadline=math.inf))
+        await asyncio.sleep(0)
+        assert scheduler.depth("long") == 1
+        scheduler.release(ticket)
+        scheduler.release(await waiting)
+        return error.value
+
+    error = asyncio.run(scenario())
+    assert error.retry_after > 20
+    assert scheduler.rejected == 1
+    assert scheduler.in_use == 0
+
+def test_waiter_times_out_at_deadline():
+    scheduler = LLMScheduler(max_concurrency=1, deadline_seconds=0.05)
+    scheduler.expected["short"] = 0.0
+
+    async def scenario():
+        ticket = await scheduler.acquire("a", "short")
+        with pytest.raises(SchedulerOverloaded):
+            await scheduler.acquire("b", "short")
+        assert scheduler.depth() == 0
+        scheduler.release(ticket)
+
+    asyncio.run(scenario())
+    assert scheduler.in_use == 0
+
+def test_stream_holds_a_slot_only_while_iterated():
+    scheduler = LLMScheduler(max_concurrency=1)
+
+    async def chunks():
+        yield "a"
+        yield "b"
+
+    async def scenario():
+        abandoned = scheduler.stream(chunks(), "s", "short")
+        assert scheduler.in_use == 0  # a body that never starts holds nothing
+        del abandoned
+
+        stream = scheduler.stream(chunks(), "s", "short")
+        assert await stream.__anext__() == "a"
+        assert scheduler.in_use == 1
+        await stream.aclose()
+        assert scheduler.in_use == 0
+        return [text async for text in scheduler.stream(chunks(), "s", "short")]
+
+    assert asyncio.run(scenario()) == ["a", "b"]
+    assert scheduler.in_use == 0
+
+def test_stream_endpoint_returns_503_before_queueing_when_full(client):
+    full = LLMScheduler(max_concurrency=1, deadline_seconds=1)
+    asyncio.run(full.acquire("someone-else", "long"))
+    with patch("main.llm_scheduler", full):
+        response = client.post(
+            "/story/generate/stream", json={"universe": "Star Wars", "what_if": "What if?", "length": "long"}
+        )
+    assert response.status_code == 503
+    assert full.in_use == 1 and full.depth() == 0
+
+def test_generate_returns_503_when_overloaded(client):
+    full = LLMScheduler(max_concurrency=1, deadline_seconds=1)
+    asyncio.run(full.acquire("someone-else", "long"))
+    with patch("main.llm_scheduler", full), patch("main.generate_story_async") as mock_generate:
+        response = client.post("/story/generate", json={"universe": "Star Wars", "what_if": "What if?", "length": "long"})
+    assert response.status_code == 503
+    assert int(response.headers["retry-after"]) >= 1
+    mock_generate.assert_not_called()
+
+def test_invalid_requests_are_rejected_before_queueing(client):
+    full = LLMScheduler(max_concurrency=1, deadline_seconds=1)
+    asyncio.run(full.acquire("someone-else", "long"))
+    with patch("main.llm_scheduler", full):
+        unsupported = client.post("/story/generate", json={"universe": "Narnia", "what_if": "What if?"})
+        blank = client.post("/story/generate-custom", json={"universe": "Narnia", "what_if": "  "})
+    assert unsupported.status_code == 400
+    assert blank.status_code == 400
+    assert full.depth() == 0
+
+def test_debug_generation_reports_queue(client):
+    scheduler = client.get("/debug/generation").json()["scheduler"]
+    assert set(scheduler["queued"]) == {"system_prompt", "short", "medium", "long"}
+    assert scheduler["in_use"] == 0
@@ -1,6 +1,6 @@
 import pytest
 from unittest.mock import patch, MagicMock
-from database import Story
+from database import Story, Rating
 
 def test_read_root(client):
     response = client.get("/")
@@ -15,7 +15,7 @@ def test_get_universes(client):
     assert "universes" in data
     assert len(data["universes"]) > 0
 
-@patch("main.generate_story")
+@patch("main.generate_story_async")
 def test_generate_story(mock_generate, client):
     # Mock AI response
     mock_generate.return_value = {
@@ -43,7 +43,7 @@ def test_generate_story(mock_generate, client):
     # Let's check main.py StoryResponse model: share_url is Optional.
     # Logic: return StoryResponse(...). It doesn't auto-add share_url unless set.    
     
-@patch("story_generator.generate_story_with_prompt")
+@patch("story_generator.generate_story_with_prompt_async")
 def test_generate_custom_story(mock_gen, client):
     mock_gen.return_value = "Custom content"
     
@@ -60,7 +60,7 @@ def test_generate_custom_story(mock_gen, client):
     assert data["universe"] == "Custom"
     assert data["story"] == "Custom content"
 
-@patch("story_generator.generate_story_with_prompt")
+@patch("story_generator.generate_story_with_prompt_async")
 def test_generate_custom_story_no_prompt(mock_gen, client):
     """Test custom story generation without system prompt (fallback)"""
     mock_gen.return_value = "Fallback content"
@@ -112,6 +112,31 @@ def test_rate_story(client, test_db):
     assert data["average_rating"] == 5.0
     assert data["rating_count"] == 1
 
+def test_rate_story_again_replaces_rating(client, test_db, query_counter):
+    story = Story(universe="U", what_if="W", story="S", word_count=10)
+    test_db.add(story)
+    test_db.commit()
+    story_id = story.id
+
+    client.post(f"/story/{story_id}/rate", json={"rating": 5, "session_id": "s1"})
+    client.post(f"/story/{story_id}/rate", json={"rating": 4, "session_id": "s2"})
+    with query_counter() as queries:
+        response = client.post(f"/story/{story_id}/rate", json={"rating": 1, "session_id": "s1"})
+
+    assert response.json() == {"message": "Rating saved", "average_rating": 2.5, "rating_count": 2}
+    # lock, read previous value, upsert, adjust aggregates
+    assert queries.count == 4
+    assert any("ON CONFLICT" in statement for statement in queries.statements)
+    assert test_db.query(Rating).filter(Rating.story_id == story_id).count() == 2
+    test_db.expire_all()
+    story = test_db.get(Story, story_id)
+    assert story.rating_distribution == {1: 1, 2: 0, 3: 0, 4: 1, 5: 0}
+    assert story.trending_score == (5 * 3.0 + 5) / (5 + 2)
+
+def test_rate_missing_story(client):
+    response = client.post("/story/9999/rate", json={"rating": 3, "session_id": "s1"})
+    assert response.status_code == 404
+
 def test_get_story_by_token(client, test_db):
     story = Story(universe="U", what_if="W", story="S", word_count=10)
     story.generate_share_token()
@@ -123,14 +148,14 @@ def test_get_story_by_token(client, test_db):
     data = response.json()
     assert data["id"] == story.id
 
-@patch("story_generator.generate_universe_prompt")
+@patch("story_generator.generate_universe_prompt_async")
 def test_generate_universe_system_prompt(mock_gen, client):
     """Test generating system prompt via API"""
     mock_gen.return_value = "Generated system prompt"
     
     payload = {"universe": "Matrix"}
     
-    # Since main.py does a local import, patching story_generator.generate_universe_prompt works
+    # Since main.py does a local import, patching story_generator.generate_universe_prompt_async works
     # provided story_generator is imported.
     
     response = client.post("/universe/system-prompt", json=payload)
@@ -138,3 +163,104 @@ def test_generate_universe_system_prompt(mock_gen, client):
     data = response.json()
     assert data["universe"] == "Matrix"
     assert data["system_prompt"] == "Generated system prompt"
+
+def _rated_story(test_db, values):
+    story = Story(universe="U", what_if="W", story="S", word_count=10)
+    test_db.add(story)
+    test_db.commit()
+    for i, value in enumerate(values):
+        test_db.add(Rating(story_id=story.id, session_id=f"s{i}", rating_value=value))
+    test_db.commit()
+    return story.id
+
+def test_story_ratings_from_stored_counters(client, test_db, query_counter):
+    story_id = _rated_story(test_db, [5, 5, 3])
+
+    with query_counter() as queries:
+        response = client.get(f"/story/{story_id}/ratings")
+    assert response.json() == {"average": 4.3, "count": 3, "distribution": {"1": 0, "2": 0, "3": 1, "4": 0, "5": 2}}
+    assert queries.count == 1
+    assert "ratings" not in queries.statements[0].split("FROM", 1)[1]
+    assert client.get("/story/9999/ratings").status_code == 404
+
+def test_ratings_batch(client, test_db, query_counter):
+    first = _rated_story(test_db, [4])
+    second = _rated_story(test_db, [])
+
+    with query_counter() as queries:
+        response = client.get(f"/ratings?story_ids={second},{first},9999,{first}")
+    assert queries.count == 1
+    data = response.json()
+    assert list(data["ratings"]) == [str(second), str(first)]
+    assert data["ratings"][str(first)] == {"average": 4.0, "count": 1, "distribution": {"1": 0, "2": 0, "3": 0, "4": 1, "5": 0}}
+    assert data["ratings"][str(second)]["count"] == 0
+    assert data["missing"] == [9999]
+
+    assert client.get("/ratings?story_ids=a,b").status_code == 400
+    too_many = ",".join(str(i) for i in range(1, 102))
+    assert client.get(f"/ratings?story_ids={too_many}").status_code == 400
+
+def test_story_conditional_get(client, test_db, query_counter):
+    story_id = _rated_story(test_db, [4])
+
+    response = client.get(f"/story/{story_id}")
+    etag = response.headers["etag"]
+    assert etag == f'"story-{story_id}-r1.4.0"'
+    assert response.headers["cache-control"].startswith("public, max-age=")
+
+    with query_counter() as queries:
+        revalidated = client.get(f"/story/{story_id}", headers={"If-None-Match": etag})
+    assert revalidated.status_code == 304
+    assert revalidated.content == b""
+    assert queries.count == 1
+    assert "stories.story," not in queries.statements[0]
+
+    # A new rating changes the tag, and the full body comes back
+    client.post(f"/story/{story_id}/rate", json={"rating": 2, "session_id": "other"})
+    changed = client.get(f"/story/{story_id}", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.json()["story"] == "S"
+    assert changed.headers["etag"] != etag
+
+def test_shared_story_split_from_text(client, test_db):
+    story = Story(universe="U", what_if="W", story="S", word_count=10)
+    story.generate_share_token()
+    test_db.add(story)
+    test_db.commit()
+
+    meta = client.get(f"/story/share/{story.share_token}?split=true")
+    assert meta.status_code == 200
+    assert "story" not in meta.json()
+    assert meta.json()["text_url"] == f"/story/{story.id}/text"
+    assert meta.headers["etag"].endswith('-s-meta"')
+    assert client.get(f"/story/share/{story.share_token}?split=true",
+                      headers={"If-None-Match": meta.headers["etag"]}).status_code == 304
+
+    text = client.get(meta.json()["text_url"])
+    assert text.json()["story"] == "S"
+    assert text.headers["cache-control"] == "public, max-age=31536000, immutable"
+    assert client.get(meta.json()["text_url"], headers={"If-None-Match": text.headers["etag"]}).status_code == 304
+    assert client.get("/story/9999/text").status_code == 404
+
+def test_story_text_is_stored_and_served_compressed(client, test_db):
+    text = "The ring went west instead. " * 40
+    story = Story(universe="U", what_if="W", story=text, word_count=200)
+    test_db.add(story)
+    test_db.commit()
+    assert story.story_codec == "gzip" and story.story_text is None
+    assert len(story.story_blob) < len(text)
+
+    assert client.get(f"/story/{story.id}").json()["story"] == text
+
+    url = f"/story/{story.id}/text?format=plain"
+    with client.stream("GET", url, headers={"Accept-Encoding": "gzip"}) as response:
+        raw = b"".join(response.iter_raw())
+    assert response.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert raw == story.story_blob
+
+    identity = client.get(url, headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in identity.headers
+    assert identity.text == text
+    assert identity.headers["etag"] != response.headers["etag"]
+    assert client.get(f"/story/{story.id}/text?format=xml").status_code == 400
@@ -0,0 +1,99 @@
+import asyncio
+import pytest
+from database import Story
+from llm_providers import LocalProvider, LocalProviderError, set_provider
+import metrics
+import story_generator
+
+@pytest.fixture(autouse=True)
+def clean_registry():
+    metrics.registry.clear()
+    yield
+    metrics.registry.clear()
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = metrics.Histogram("demo_seconds", "Demo", ("route",), buckets=(0.1, 1.0))
+    histogram.observe(0.05, route="/a")
+    histogram.observe(0.5, route="/a")
+    histogram.observe(5, route="/a")
+
+    lines = histogram.render()
+    assert '# TYPE demo_seconds histogram' in lines
+    assert 'demo_seconds_bucket{route="/a",le="0.1"} 1' in lines
+    assert 'demo_seconds_bucket{route="/a",le="1"} 2' in lines
+    assert 'demo_seconds_bucket{route="/a",le="+Inf"} 3' in lines
+    assert 'demo_seconds_count{route="/a"} 3' in lines
+
+def test_label_values_are_escaped():
+    counter = metrics.Counter("demo_total", "Demo", ("name",))
+    counter.inc(name='say "hi"\n')
+    assert 'demo_total{name="say \\"hi\\"\\n"} 1' in counter.render()
+
+def test_metrics_endpoint_reports_route_templates(client, test_db):
+    story = Story(universe="Star Wars", what_if="What if?", story="Text", word_count=1)
+    test_db.add(story)
+    test_db.commit()
+    client.get(f"/story/{story.id}")
+    client.get("/story/999999")
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    assert 'http_requests_total{method="GET",route="/story/{story_id}",status="200"} 1' in body
+    assert 'http_requests_total{method="GET",route="/story/{story_id}",status="404"} 1' in body
+    assert 'http_request_duration_seconds_count{method="GET",route="/story/{story_id}"} 2' in body
+    assert 'http_requests_in_flight{method="GET",route="/story/{story_id}"} 0' in body
+
+def test_queries_are_counted_per_request(client, test_engine, test_db):
+    metrics.instrument_engine(test_engine)
+    metrics.instrument_engine(test_engine)  # idempotent
+    story = Story(universe="Star Wars", what_if="What if?", story="Text", word_count=1)
+    test_db.add(story)
+    test_db.commit()
+    metrics.registry.clear()
+
+    client.get(f"/story/{story.id}")
+
+    assert metrics.HTTP_DB_QUERIES.count(method="GET", route="/story/{story_id}") == 1
+    state = metrics.HTTP_DB_QUERIES._values[("GET", "/story/{story_id}")]
+    assert state["sum"] >= 1
+    assert metrics.DB_QUERIES.value(operation="SELECT") >= 1
+
+def test_llm_calls_record_latency_and_tokens():
+    set_provider(LocalProvider(model="local-test"))
+    story_generator.generate_story("Star Wars", "What if?", "short")
+    story_generator.generate_story_with_prompt("Dune", "You know Dune.", "What if?", "short")
+
+    labels = {"model": "local-test", "universe": "Star Wars"}
+    assert metrics.LLM_REQUESTS.value(mode="complete", outcome="ok", **labels) == 1
+    assert metrics.LLM_LATENCY.count(mode="complete", **labels) == 1
+    assert metrics.LLM_TOKENS.value(kind="completion", **labels) > 0
+    assert metrics.LLM_TOKENS.value(kind="prompt", **labels) > 0
+    assert metrics.LLM_REQUESTS.value(model="local-test", universe="custom", mode="complete", outcome="ok") == 1
+
+def test_llm_errors_and_streams_are_recorded():
+    set_provider(LocalProvider(model="local-test", error_rate=1))
+    with pytest.raises(LocalProviderError):
+        story_generator.generate_story("Star Wars", "What if?", "short")
+    assert metrics.LLM_REQUESTS.value(model="local-test", universe="Star Wars", mode="complete", outcome="error") == 1
+
+    set_provider(LocalProvider(model="local-test"))
+
+    async def collect():
+        return [chunk async for chunk in story_generator.stream_story("Star Wars", "What if?", "short")]
+
+    chunks = asyncio.run(collect())
+    labels = {"model": "local-test", "universe": "Star Wars"}
+    assert metrics.LLM_TTFT.count(**labels) == 1
+    assert metrics.LLM_TOKENS.value(kind="completion", **labels) == len(chunks)
+    assert metrics.LLM_REQUESTS.value(mode="stream", outcome="ok", **labels) == 1
+
+def test_cache_hit_ratio():
+    metrics.record_cache("demo", hit=True)
+    metrics.record_cache("demo", hit=True)
+    metrics.record_cache("demo", hit=False)
+    metrics.record_cache("demo", hit=True)
+    body = metrics.registry.render()
+    assert 'cache_requests_total{cache="demo",result="hit"} 3' in body
+    assert 'cache_hit_ratio{cache="demo"} 0.75' in body
@@ -9,25 +9,52 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import migrate_db
 
-def test_migration_adds_missing_column(test_engine):
-    """Test that migration adds share_token column if missing"""
-    # Setup: Create table WITHOUT share_token
-    with test_engine.connect() as conn:
-        conn.execute(text("DROP TABLE IF EXISTS stories"))
-        # Create minimal table mocking old state
+def _legacy_stories(conn, count=0, rows=(), share_token=False, ratings=None):
+    """Recreate the pre-migration schema: ``count`` placeholder stories (or
+    the given ``rows``), a share_token column if asked for, and the old
+    ratings table when ``ratings`` (story_id, session_id, value) are given"""
+    for table in ("stories_fts", "ratings", "stories"):
+        conn.execute(text(f"DROP TABLE IF EXISTS {table}"))
+    conn.execute(text(f"""
+        CREATE TABLE stories (
+            id INTEGER PRIMARY KEY,
+            universe VARCHAR,
+            what_if TEXT,
+            story TEXT,
+            word_count INTEGER,
+            rating INTEGER DEFAULT 0,
+            is_public BOOLEAN DEFAULT 1,
+            {"share_token VARCHAR(32)," if share_token else ""}
+            created_at TIMESTAMP
+        )
+    """))
+    rows = list(rows) or [
+        {"id": story_id, "universe": "U", "what_if": "What if?", "story": "Story"} for story_id in range(1, count + 1)
+    ]
+    for row in rows:
+        conn.execute(text(f"INSERT INTO stories ({', '.join(row)}) VALUES ({', '.join(':' + c for c in row)})"), row)
+    if ratings is not None:
         conn.execute(text("""
-            CREATE TABLE stories (
-                id INTEGER PRIMARY KEY,
-                universe VARCHAR,
-                what_if TEXT,
-                story TEXT,
-                word_count INTEGER,
-                rating INTEGER DEFAULT 0,
-                is_public BOOLEAN DEFAULT 1,
-                created_at TIMESTAMP
+            CREATE TABLE ratings (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                story_id INTEGER NOT NULL,
+                session_id VARCHAR(64) NOT NULL,
+                rating_value INTEGER NOT NULL,
+                created_at TIMESTAMP,
+                updated_at TIMESTAMP
             )
         """))
-        conn.commit()
+        for story_id, session_id, value in ratings:
+            conn.execute(
+                text("INSERT INTO ratings (story_id, session_id, rating_value) VALUES (:story_id, :session_id, :value)"),
+                {"story_id": story_id, "session_id": session_id, "value": value}
+            )
+    conn.commit()
+
+def test_migration_adds_missing_column(test_engine):
+    """Test that migration adds share_token column if missing"""
+    with test_engine.connect() as conn:
+        _legacy_stories(conn)
 
     # Mock engine in migrate_db to use our test_engine
     with patch('migrate_db.engine', test_engine):
@@ -40,28 +67,10 @@ def test_migration_adds_missing_column(test_engine):
 
 def test_migration_backfills_data(test_engine):
     """Test that migration backfills share_token for existing rows"""
-    # Setup: Create table and insert data
     with test_engine.connect() as conn:
-        conn.execute(text("DROP TABLE IF EXISTS stories"))
-        conn.execute(text("""
-            CREATE TABLE stories (
-                id INTEGER PRIMARY KEY,
-                universe VARCHAR,
-                what_if TEXT,
-                story TEXT,
-                word_count INTEGER,
-                rating INTEGER DEFAULT 0,
-                is_public BOOLEAN DEFAULT 1,
-                created_at TIMESTAMP
-                -- Missing share_token initially
-            )
-        """))
-        # Insert test story
-        conn.execute(text("""
-            INSERT INTO stories (universe, what_if, story, word_count)
-            VALUES ('Test Universe', 'What if?', 'Story content', 100)
-        """))
-        conn.commit()
+        _legacy_stories(conn, rows=[
+            {"universe": "Test Universe", "what_if": "What if?", "story": "Story content", "word_count": 100}
+        ])
 
     # Run migration
     with patch('migrate_db.engine', test_engine):
@@ -85,3 +94,130 @@ def test_migration_failure_exits(test_engine):
         with pytest.raises(Exception) as excinfo:
             migrate_db.migrate()
         assert "DB Error" in str(excinfo.value)
+
+def test_migration_backfills_rating_aggregates(test_engine):
+    """Test that migration adds aggregate columns and fills them from existing ratings"""
+    with test_engine.connect() as conn:
+        _legacy_stories(
+            conn, share_token=True,
+            rows=[{"id": 1, "universe": "U", "share_token": "tok1"}, {"id": 2, "universe": "U", "share_token": "tok2"}],
+            ratings=[(1, "a", 5), (1, "b", 3), (1, "c", 5)],
+        )
+
+    with patch('migrate_db.engine', test_engine):
+        migrate_db.migrate()
+
+    with test_engine.connect() as conn:
+        rows = conn.execute(text(
+            "SELECT id, rating_sum, rating_count, stars_3, stars_5 FROM stories ORDER BY id"
+        )).fetchall()
+    assert [tuple(r) for r in rows] == [(1, 13, 3, 1, 2), (2, 0, 0, 0, 0)]
+
+def test_migration_deduplicates_ratings_before_unique_index(test_engine):
+    """Test that duplicate (story, session) ratings are collapsed and the unique index is added"""
+    with test_engine.connect() as conn:
+        _legacy_stories(
+            conn, share_token=True,
+            rows=[{"id": 1, "universe": "U", "share_token": "tok1"}],
+            ratings=[(1, "a", 1), (1, "a", 4), (1, "b", 2)],
+        )
+
+    with patch('migrate_db.engine', test_engine):
+        migrate_db.migrate()
+        migrate_db.migrate()  # second run is a no-op
+
+    with test_engine.connect() as conn:
+        ratings = conn.execute(text("SELECT session_id, rating_value FROM ratings ORDER BY session_id")).fetchall()
+        aggregates = conn.execute(text("SELECT rating_sum, rating_count, stars_1, stars_4 FROM stories")).one()
+        with pytest.raises(Exception):
+            conn.execute(text("INSERT INTO ratings (story_id, session_id, rating_value) VALUES (1, 'a', 3)"))
+    assert [tuple(r) for r in ratings] == [("a", 4), ("b", 2)]
+    assert tuple(aggregates) == (6, 2, 0, 1)
+    indexes = {index["name"]: index for index in inspect(test_engine).get_indexes("ratings")}
+    assert indexes["ux_ratings_story_session"]["unique"]
+
+def test_migration_compresses_story_text_in_batches(test_engine):
+    """Test that plain story text is moved into the compressed column and still reads back"""
+    from sqlalchemy.orm import Session
+    from database import Story
+
+    with test_engine.connect() as conn:
+        _legacy_stories(conn, share_token=True, rows=[
+            {"id": story_id, "universe": "U", "story": f"Once upon a time {story_id}. " * 50, "share_token": f"tok{story_id}"}
+            for story_id in range(1, 6)
+        ])
+
+    with patch('migrate_db.engine', test_engine), patch('migrate_db.COMPRESS_BATCH_SIZE', 2):
+        migrate_db.migrate()
+        migrate_db.migrate()  # second run is a no-op
+
+    with test_engine.connect() as conn:
+        rows = conn.execute(text("SELECT story, story_codec, LENGTH(story_blob) FROM stories ORDER BY id")).fetchall()
+    assert all(row[0] is None and row[1] == "gzip" for row in rows)
+    assert all(row[2] < len("Once upon a time 1. " * 50) for row in rows)
+    with Session(test_engine) as session:
+        assert session.get(Story, 3).story == "Once upon a time 3. " * 50
+
+def test_migration_builds_search_index(test_engine):
+    """Test that existing stories are added to a newly created full-text index"""
+    with test_engine.connect() as conn:
+        _legacy_stories(conn, share_token=True, rows=[
+            {"id": 1, "universe": "U", "what_if": "What if dragons returned?",
+             "story": "The dragons circled the tower.", "share_token": "tok1"},
+            {"id": 2, "universe": "U", "what_if": "What if the sea froze?",
+             "story": "Ice stretched to the horizon.", "share_token": "tok2"},
+        ])
+
+    with patch('migrate_db.engine', test_engine), patch('migrate_db.SEARCH_BATCH_SIZE', 1):
+        migrate_db.migrate()
+        migrate_db.migrate()  # second run leaves the index alone
+
+    with test_engine.connect() as conn:
+        dragons = conn.execute(text("SELECT rowid FROM stories_fts WHERE stories_fts MATCH 'dragon'")).scalars().all()
+        ice = conn.execute(text("SELECT rowid FROM stories_fts WHERE stories_fts MATCH 'ice'")).scalars().all()
+    assert dragons == [1]
+    assert ice == [2]
+
+def test_migration_records_versions_and_skips_applied_steps(test_engine, query_counter):
+    """Test that applied steps are recorded and an up-to-date schema costs a single read"""
+    with test_engine.connect() as conn:
+        _legacy_stories(conn, 3)
+
+    with patch('migrate_db.engine', test_engine):
+        migrate_db.migrate()
+        with query_counter() as queries:
+            migrate_db.migrate()
+
+    assert queries.count == 1
+    assert "schema_version" in queries.statements[0]
+    with test_engine.connect() as conn:
+        versions = conn.execute(text("SELECT version FROM schema_version ORDER BY version")).scalars().all()
+    assert versions == [version for version, _, _ in migrate_db.MIGRATIONS]
+
+def test_migration_runs_only_pending_steps(test_engine):
+    """Test that a database at an older version runs just the newer steps"""
+    with test_engine.connect() as conn:
+        _legacy_stories(conn, 1)
+
+    calls = []
+    migrations = migrate_db.MIGRATIONS + [(99, "later step", lambda conn: calls.append(99))]
+    with patch('migrate_db.engine', test_engine):
+        migrate_db.migrate()
+        with patch('migrate_db.MIGRATIONS', migrations), patch('migrate_db.LATEST_VERSION', 99):
+            migrate_db.migrate()
+            migrate_db.migrate()
+
+    assert calls == [99]
+
+def test_migration_backfills_share_tokens_in_batches(test_engine, query_counter):
+    """Test that share tokens are written with one UPDATE per batch, not per story"""
+    with test_engine.connect() as conn:
+        _legacy_stories(conn, 25, share_token=True)
+
+        with query_counter() as queries:
+            assert migrate_db.backfill_share_tokens(conn, batch_size=10) == 25
+        tokens = conn.execute(text("SELECT share_token FROM stories")).scalars().all()
+
+    updates = [statement for statement in queries.statements if statement.lstrip().startswith("UPDATE")]
+    assert len(updates) == 3
+    assert len(set(tokens)) == 25 and None not in tokens
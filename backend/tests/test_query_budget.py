@@ -0,0 +1,79 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from database import Story, Rating
+import query_budget
+from query_budget import QueryBudgetExceeded, QueryBudgetMiddleware, statement_shape, track_queries
+
+def test_statement_shape_ignores_values():
+    assert statement_shape("SELECT * FROM ratings WHERE story_id = 1") == statement_shape(
+        "SELECT *\n  FROM ratings WHERE story_id = 42"
+    )
+    assert statement_shape("SELECT * FROM stories WHERE id IN (?, ?, ?)") == "SELECT * FROM stories WHERE id IN (?)"
+    assert statement_shape("SELECT stars_1 FROM stories") == "SELECT stars_1 FROM stories"
+
+def test_block_over_budget_raises(test_engine):
+    with pytest.raises(QueryBudgetExceeded, match="3 queries, budget is 2"):
+        with track_queries(budget=2, mode="raise") as queries:
+            with test_engine.connect() as connection:
+                for _ in range(3):
+                    connection.execute(text("SELECT 1"))
+    assert queries.count == 3
+
+def test_warn_mode_prints(test_engine, capsys):
+    with track_queries("demo", budget=0, mode="warn"):
+        with test_engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+    assert "Query budget exceeded in demo" in capsys.readouterr().out
+
+def test_detects_lazy_load_n_plus_one(test_db):
+    for i in range(6):
+        story = Story(universe="Star Wars", what_if=f"What if {i}?", story="Text", word_count=1)
+        story.ratings.append(Rating(session_id="s", rating_value=4))
+        test_db.add(story)
+    test_db.commit()
+    test_db.expire_all()
+
+    with pytest.raises(QueryBudgetExceeded, match="possible N\\+1"):
+        with track_queries(repeat_threshold=5, mode="raise"):
+            for story in test_db.query(Story).all():
+                len(story.ratings)
+
+def test_off_mode_skips_checks(test_engine):
+    with track_queries(budget=0, mode="off") as queries:
+        with test_engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+    assert queries.count == 1
+
+def test_middleware_applies_route_budgets(test_engine):
+    app = FastAPI()
+
+    @app.get("/items/{item_id}")
+    def item(item_id: int):
+        with test_engine.connect() as connection:
+            for _ in range(item_id):
+                connection.execute(text("SELECT 1"))
+        return {"ok": True}
+
+    app.add_middleware(QueryBudgetMiddleware, router_app=app, budget=10, repeat_threshold=0,
+                       route_budgets={"/items/{item_id}": 2}, mode="raise")
+    client = TestClient(app)
+
+    assert client.get("/items/2").status_code == 200
+    with pytest.raises(QueryBudgetExceeded, match="GET /items/{item_id}"):
+        client.get("/items/3")
+
+def test_endpoint_query_counts(client, test_db, query_counter):
+    story = Story(universe="Star Wars", what_if="What if?", story="Text", word_count=1)
+    test_db.add(story)
+    test_db.commit()
+    story_id = story.id
+
+    with query_counter() as queries:
+        assert client.get(f"/story/{story_id}").status_code == 200
+    assert queries.count == 1
+
+    with query_counter() as queries:
+        assert client.get("/story/trending").status_code == 200
+    assert queries.count == 1
@@ -0,0 +1,113 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from rate_limit import (
+    Limit, MemoryStore, SQLiteStore, RateLimiter, RateLimitMiddleware, client_ip_key, client_key, parse_limits, rate_limit_keys,
+)
+import rate_limit
+
+def test_bucket_allows_burst_then_refills():
+    store = MemoryStore()
+    limit = Limit(60, 60, burst=2)  # one token per second
+    assert store.take("k", limit, now=100.0) == (True, 0)
+    assert store.take("k", limit, now=100.0) == (True, 0)
+    allowed, retry_after = store.take("k", limit, now=100.0)
+    assert not allowed and retry_after == pytest.approx(1.0)
+    assert store.take("k", limit, now=101.0)[0]
+    assert store.take("other", limit, now=101.0)[0]
+
+def test_sqlite_store_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / "limits.db")
+    limit = Limit(1, 60, burst=1)
+    assert SQLiteStore(path).take("k", limit, now=1000.0)[0]
+    allowed, retry_after = SQLiteStore(path).take("k", limit, now=1001.0)
+    assert not allowed and retry_after == pytest.approx(59.0)
+
+def test_parse_limits():
+    limits = parse_limits("POST /story/generate=20/60:10; GET *=600/60")
+    assert limits[("POST", "/story/generate")].burst == 10
+    assert limits[("GET", "*")].refill_per_second == 10
+    with pytest.raises(ValueError):
+        parse_limits("nonsense")
+
+def test_client_key_prefers_session():
+    scope = {"headers": [(b"x-session-id", b"abc")], "query_string": b"", "client": ("10.0.0.1", 1)}
+    assert client_key(scope) == "session:abc"
+    scope = {"headers": [], "query_string": b"limit=5&session_id=xyz", "client": ("10.0.0.1", 1)}
+    assert client_key(scope) == "session:xyz"
+    scope = {"headers": [(b"x-forwarded-for", b"1.2.3.4")], "query_string": b"", "client": ("10.0.0.1", 1)}
+    assert client_key(scope) == "ip:10.0.0.1"
+
+def test_rate_limit_keys_always_include_the_ip():
+    scope = {"headers": [(b"x-session-id", b"abc")], "query_string": b"", "client": ("10.0.0.1", 1)}
+    assert rate_limit_keys(scope) == ["ip:10.0.0.1", "session:abc"]
+    scope = {"headers": [], "query_string": b"", "client": ("10.0.0.1", 1)}
+    assert rate_limit_keys(scope) == ["ip:10.0.0.1"]
+
+def test_forwarded_ip_ignores_hops_the_client_sent(monkeypatch):
+    monkeypatch.setenv("RATE_LIMIT_TRUST_FORWARDED", "true")
+    scope = {"headers": [(b"x-forwarded-for", b"6.6.6.6, 1.2.3.4")], "query_string": b"", "client": ("10.0.0.1", 1)}
+    assert client_ip_key(scope) == "ip:1.2.3.4"
+    monkeypatch.setenv("RATE_LIMIT_TRUSTED_PROXIES", "2")
+    scope = {"headers": [(b"x-forwarded-for", b"6.6.6.6, 1.2.3.4, 10.1.1.1")], "query_string": b"", "client": ("10.0.0.1", 1)}
+    assert client_ip_key(scope) == "ip:1.2.3.4"
+    scope = {"headers": [(b"x-forwarded-for", b"1.2.3.4")], "query_string": b"", "client": ("10.0.0.1", 1)}
+    assert client_ip_key(scope) == "ip:10.0.0.1"
+
+def _app(limiter):
+    app = FastAPI()
+
+    @app.post("/story/generate")
+    def generate():
+        return {"ok": True}
+
+    @app.get("/story/{story_id}")
+    def get_story(story_id: int):
+        return {"id": story_id}
+
+    app.add_middleware(RateLimitMiddleware, router_app=app, limiter=limiter)
+    return TestClient(app)
+
+def test_middleware_returns_429_with_retry_after():
+    limiter = RateLimiter(store=MemoryStore(), enabled=True, limits={
+        ("POST", "/story/generate"): Limit(1, 60, burst=2),
+        ("GET", "*"): Limit(100, 60, burst=100),
+    })
+    client = _app(limiter)
+
+    assert client.post("/story/generate").status_code == 200
+    assert client.post("/story/generate").status_code == 200
+    response = client.post("/story/generate")
+    assert response.status_code == 429
+    assert int(response.headers["retry-after"]) >= 1
+    assert limiter.rejected == 1
+
+    # cheaper routes have their own buckets
+    assert all(client.get(f"/story/{i}").status_code == 200 for i in range(20))
+
+def test_session_ids_do_not_bypass_the_ip_limit(monkeypatch):
+    monkeypatch.setenv("RATE_LIMIT_TRUST_FORWARDED", "true")
+    limiter = RateLimiter(store=MemoryStore(), enabled=True, limits={
+        ("POST", "/story/generate"): Limit(1, 60, burst=2),
+    })
+    client = _app(limiter)
+    same_ip = {"X-Forwarded-For": "1.2.3.4"}
+
+    assert client.post("/story/generate", headers={**same_ip, "X-Session-ID": "a"}).status_code == 200
+    assert client.post("/story/generate", headers={**same_ip, "X-Session-ID": "b"}).status_code == 200
+    assert client.post("/story/generate", headers={**same_ip, "X-Session-ID": "c"}).status_code == 429
+    assert client.post("/story/generate?session_id=d", headers=same_ip).status_code == 429
+
+    # a session is also limited on its own, and another address has its own bucket
+    other_ip = {"X-Forwarded-For": "5.6.7.8"}
+    assert client.post("/story/generate", headers={**other_ip, "X-Session-ID": "a"}).status_code == 200
+    assert client.post("/story/generate", headers={**other_ip, "X-Session-ID": "a"}).status_code == 429
+    assert client.post("/story/generate", headers={"X-Forwarded-For": "9.9.9.9"}).status_code == 200
+
+def test_app_limits_generation(client, monkeypatch):
+    monkeypatch.setitem(rate_limit.rate_limiter.limits, ("POST", "/universe/system-prompt"), Limit(1, 60, burst=1))
+    client.post("/universe/system-prompt", json={})  # spends the only token, even though it is invalid
+    response = client.post("/universe/system-prompt", json={"universe": "Dune"})
+    assert response.status_code == 429
+    assert "retry-after" in response.headers
+    assert client.get("/metrics").status_code == 200
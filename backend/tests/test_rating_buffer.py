@@ -0,0 +1,113 @@
+import asyncio
+import pytest
+from sqlalchemy.orm import sessionmaker
+from database import Story, Rating
+from rating_buffer import RatingBuffer, aggregate_deltas
+import rating_buffer as rating_buffer_module
+
+@pytest.fixture
+def buffer(test_engine, test_db):
+    return RatingBuffer(session_factory=sessionmaker(bind=test_engine), enabled=True, flush_ms=10, max_entries=100)
+
+def _story(test_db, ratings=()):
+    story = Story(universe="Star Wars", what_if="What if?", story="Text", word_count=1)
+    test_db.add(story)
+    test_db.commit()
+    for session_id, value in ratings:
+        test_db.add(Rating(story_id=story.id, session_id=session_id, rating_value=value))
+    test_db.commit()
+    return story.id
+
+def test_aggregate_deltas():
+    deltas = aggregate_deltas({(1, "a"): 5, (1, "b"): 2, (1, "c"): 3, (2, "a"): 4}, {(1, "b"): 4, (1, "c"): 3})
+    assert deltas == [
+        {"story_id": 1, "d_sum": 3, "d_count": 1,
+         "d_stars_1": 0, "d_stars_2": 1, "d_stars_3": 0, "d_stars_4": -1, "d_stars_5": 1},
+        {"story_id": 2, "d_sum": 4, "d_count": 1,
+         "d_stars_1": 0, "d_stars_2": 0, "d_stars_3": 0, "d_stars_4": 1, "d_stars_5": 0},
+    ]
+
+def test_submit_collapses_and_flush_writes_in_one_batch(buffer, test_db):
+    story_id = _story(test_db, [("old", 2)])
+    other_id = _story(test_db)
+
+    first = buffer.submit(test_db, story_id, "s1", 1)
+    assert (first["rating_sum"], first["rating_count"]) == (3, 2)
+    again = buffer.submit(test_db, story_id, "s1", 5)
+    assert (again["rating_sum"], again["rating_count"]) == (7, 2)
+    buffer.submit(test_db, story_id, "old", 4)
+    buffer.submit(test_db, other_id, "s1", 3)
+    assert buffer.submit(test_db, 9999, "s1", 3) is None
+    assert len(buffer) == 3
+
+    assert buffer.flush() == 3
+    assert len(buffer) == 0
+
+    test_db.expire_all()
+    story = test_db.get(Story, story_id)
+    assert (story.rating_sum, story.rating_count) == (9, 2)
+    assert story.rating_distribution == {1: 0, 2: 0, 3: 0, 4: 1, 5: 1}
+    assert story.trending_score == pytest.approx((5 * 3.0 + 9) / 7)
+    values = dict(test_db.query(Rating.session_id, Rating.rating_value).filter(Rating.story_id == story_id).all())
+    assert values == {"old": 4, "s1": 5}
+    assert test_db.get(Story, other_id).rating_count == 1
+
+def test_failed_flush_keeps_ratings(buffer, test_db, monkeypatch):
+    story_id = _story(test_db)
+    buffer.submit(test_db, story_id, "s1", 4)
+
+    def boom(batch):
+        buffer.submit(test_db, story_id, "s1", 2)  # a newer click arrives mid-flush
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(buffer, "_write", boom)
+    with pytest.raises(RuntimeError):
+        buffer.flush()
+    assert buffer._pending[(story_id, "s1")][0] == 2
+
+def test_flusher_runs_on_timer_and_on_stop(buffer, test_db):
+    story_id = _story(test_db)
+
+    async def scenario():
+        buffer.start()
+        await asyncio.to_thread(buffer.submit, test_db, story_id, "s1", 5)
+        for _ in range(300):
+            if buffer.flushed:
+                break
+            await asyncio.sleep(0.01)
+        flushed_by_timer = buffer.flushed
+        buffer.flush_seconds = 60
+        await asyncio.sleep(0.05)  # let the flusher start its long wait
+        await asyncio.to_thread(buffer.submit, test_db, story_id, "s2", 3)
+        await buffer.stop()
+        return flushed_by_timer
+
+    assert asyncio.run(scenario()) == 1
+    assert buffer.flushed == 2
+    test_db.expire_all()
+    assert test_db.get(Story, story_id).rating_count == 2
+
+def test_rate_endpoint_uses_buffer(client, test_db, buffer, monkeypatch):
+    monkeypatch.setattr("main.rating_buffer", buffer)
+    story_id = _story(test_db)
+
+    response = client.post(f"/story/{story_id}/rate", json={"rating": 4, "session_id": "s1"})
+    assert response.json() == {"message": "Rating saved", "average_rating": 4.0, "rating_count": 1}
+    assert test_db.query(Rating).count() == 0
+    assert client.post("/story/9999/rate", json={"rating": 4, "session_id": "s1"}).status_code == 404
+
+    buffer.flush()
+    assert test_db.query(Rating).count() == 1
+
+def test_leaderboard_is_bumped_after_the_flush_commits(client, test_db, buffer, monkeypatch):
+    monkeypatch.setattr("main.rating_buffer", buffer)
+    bumps = []
+    monkeypatch.setattr(rating_buffer_module.leaderboard, "note_score_change", lambda old, new: bumps.append((old, new)))
+    story_id = _story(test_db)
+
+    client.post(f"/story/{story_id}/rate", json={"rating": 5, "session_id": "s1"})
+    client.post(f"/story/{story_id}/rate", json={"rating": 4, "session_id": "s2"})
+    assert bumps == []
+
+    buffer.flush()
+    assert bumps == [(pytest.approx(3.0), pytest.approx((5 * 3.0 + 9) / 7))]
@@ -0,0 +1,61 @@
+import pytest
+from database import Story
+import search
+
+def _add(test_db, universe, what_if, story, is_public=True):
+    row = Story(universe=universe, what_if=what_if, story=story, word_count=len(story.split()), is_public=is_public)
+    test_db.add(row)
+    test_db.commit()
+    return row.id
+
+@pytest.fixture
+def stories(test_db):
+    return {
+        "survives": _add(test_db, "Harry Potter", "What if Snape survives the battle?",
+                         "Snape opened his eyes in the Shrieking Shack. He had survived, and the castle was quiet."),
+        "mentioned": _add(test_db, "Harry Potter", "What if Neville became headmaster?",
+                          "Years later Neville still told students how Snape survived the war by a whisker."),
+        "other": _add(test_db, "Star Wars", "What if Vader survives?",
+                      "Vader survived the second Death Star and retired to a quiet moon."),
+        "unrelated": _add(test_db, "Harry Potter", "What if Ron was sorted into Slytherin?",
+                          "Ron found the dungeons surprisingly cosy."),
+        "private": _add(test_db, "Harry Potter", "What if Snape survives in secret?",
+                        "Snape survived but nobody knew.", is_public=False),
+    }
+
+def test_search_ranks_scenario_matches_first(client, stories, query_counter):
+    with query_counter() as queries:
+        response = client.get("/story/search", params={"q": "Snape survives"})
+    assert response.status_code == 200
+    assert queries.count == 1
+    assert "stories_fts MATCH" in queries.statements[0]
+    data = response.json()
+    assert [story["id"] for story in data["stories"]] == [stories["survives"], stories["mentioned"]]
+    assert data["stories"][0]["score"] >= data["stories"][1]["score"]
+    assert "<mark>Snape</mark>" in data["stories"][0]["snippet"]
+    assert "<mark>survived,</mark>" in data["stories"][0]["snippet"]
+    assert data["next_offset"] is None
+
+def test_search_filters_by_universe_and_paginates(client, stories):
+    data = client.get("/story/search", params={"q": "survives", "universe": "Star Wars"}).json()
+    assert [story["id"] for story in data["stories"]] == [stories["other"]]
+
+    first = client.get("/story/search", params={"q": "survived", "limit": 2}).json()
+    assert first["count"] == 2 and first["next_offset"] == 2
+    second = client.get("/story/search", params={"q": "survived", "limit": 2, "offset": 2}).json()
+    assert second["count"] == 1 and second["next_offset"] is None
+    assert {s["id"] for s in first["stories"] + second["stories"]} == {stories["survives"], stories["mentioned"], stories["other"]}
+
+def test_search_rejects_empty_queries_and_fts_syntax_is_inert(client, stories):
+    assert client.get("/story/search", params={"q": "!!"}).status_code == 400
+    assert client.get("/story/search", params={"q": "snape", "offset": 5000}).status_code == 400
+    response = client.get("/story/search", params={"q": 'snape" OR "ron'})
+    assert response.status_code == 200
+    assert stories["unrelated"] not in [story["id"] for story in response.json()["stories"]]
+
+def test_snippet_escapes_and_windows():
+    text = " ".join(["word"] * 40 + ["<b>Snape</b>"] + ["word"] * 40)
+    excerpt = search.snippet(text, ["snape"], words=10)
+    assert excerpt.startswith("… ") and excerpt.endswith(" …")
+    assert "<mark>&lt;b&gt;Snape&lt;/b&gt;</mark>" in excerpt
+    assert search.snippet("nothing here", ["snape"]) is None
@@ -0,0 +1,94 @@
+import asyncio
+import httpx
+import pytest
+from unittest.mock import patch
+from database import Story
+from single_flight import SingleFlight
+from main import app
+import metrics
+
+def test_concurrent_callers_share_one_run():
+    flights = SingleFlight()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 42
+
+    async def scenario():
+        return await asyncio.gather(*(flights.do("k", work) for _ in range(5)))
+
+    assert asyncio.run(scenario()) == [42] * 5
+    assert len(calls) == 1
+    assert flights.stats() == {"leaders": 1, "coalesced": 4, "in_flight": 0}
+
+def test_coalesced_calls_are_exported_as_metrics():
+    flights = SingleFlight()
+    coalesced = metrics.SINGLE_FLIGHT_CALLS.value(role="coalesced")
+
+    async def work():
+        await asyncio.sleep(0.01)
+
+    async def scenario():
+        await asyncio.gather(*(flights.do("k", work) for _ in range(3)))
+
+    asyncio.run(scenario())
+    assert metrics.SINGLE_FLIGHT_CALLS.value(role="coalesced") == coalesced + 2
+    assert 'single_flight_calls_total{role="coalesced"}' in metrics.registry.render()
+
+def test_errors_reach_every_waiter_and_clear_the_key():
+    flights = SingleFlight()
+
+    async def boom():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream failed")
+
+    async def scenario():
+        results = await asyncio.gather(flights.do("k", boom), flights.do("k", boom), return_exceptions=True)
+        return results, flights.in_flight("k")
+
+    results, remaining = asyncio.run(scenario())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert remaining is None
+
+def test_cancelled_caller_does_not_cancel_shared_work():
+    flights = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.02)
+        return "done"
+
+    async def scenario():
+        leader = asyncio.create_task(flights.do("k", work))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flights.do("k", work))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await follower
+
+    assert asyncio.run(scenario()) == "done"
+
+@patch("main.generate_story_async")
+def test_duplicate_generate_requests_cost_one_call(mock_gen, client, test_db, monkeypatch):
+    flights = SingleFlight()
+    monkeypatch.setattr("main.single_flight", flights)
+
+    async def slow_generation(**kwargs):
+        await asyncio.sleep(0.05)
+        return {"story": "Shared story", "word_count": 2}
+
+    mock_gen.side_effect = slow_generation
+    payload = {"universe": "Harry Potter", "what_if": "What if Snape survived?", "length": "short"}
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+            return await asyncio.gather(*(ac.post("/story/generate", json=payload) for _ in range(5)))
+
+    responses = asyncio.run(scenario())
+    ids = {r.json()["id"] for r in responses}
+    assert len(ids) == 1
+    assert mock_gen.call_count == 1
+    assert test_db.query(Story).count() == 1
+    assert flights.stats()["coalesced"] == 4
@@ -79,3 +79,104 @@ def test_generate_universe_prompt(mock_groq_class):
         
     assert result == "System prompt content."
     mock_client.chat.completions.create.assert_called_once()
+
+@patch('llm_client.AsyncOpenAI')
+def test_generate_story_async(mock_async_class):
+    """Test the async generation path awaits the async client"""
+    import asyncio
+    from unittest.mock import AsyncMock
+
+    mock_client = MagicMock()
+    mock_async_class.return_value = mock_client
+    mock_completion = MagicMock()
+    mock_completion.choices[0].message.content = "An async story about wands."
+    mock_client.chat.completions.create = AsyncMock(return_value=mock_completion)
+
+    with patch.dict(os.environ, {"OPENAI_API_KEY": "fake_key"}):
+        result = asyncio.run(story_generator.generate_story_async("Harry Potter", "What if?", "short"))
+
+    assert result["story"] == "An async story about wands."
+    assert result["word_count"] == 5
+    mock_client.chat.completions.create.assert_awaited_once()
+    assert mock_client.chat.completions.create.call_args.kwargs["model"] == "gpt-4o-mini"
+
+@patch('llm_client.AsyncOpenAI')
+def test_stream_story_yields_deltas(mock_async_class):
+    """Test that streaming requests stream=True and yields only content deltas"""
+    import asyncio
+    from unittest.mock import AsyncMock
+
+    class FakeStream:
+        def __init__(self, deltas):
+            self.chunks = []
+            for delta in deltas:
+                chunk = MagicMock()
+                chunk.choices[0].delta.content = delta
+                self.chunks.append(chunk)
+        async def __aenter__(self):
+            return self
+        async def __aexit__(self, *exc):
+            return False
+        def __aiter__(self):
+            return self._iterate()
+        async def _iterate(self):
+            for chunk in self.chunks:
+                yield chunk
+
+    mock_client = MagicMock()
+    mock_async_class.return_value = mock_client
+    mock_client.chat.completions.create = AsyncMock(return_value=FakeStream(["Once", None, " more"]))
+
+    async def collect():
+        return [text async for text in story_generator.stream_story("Star Wars", "What if?")]
+
+    with patch.dict(os.environ, {"OPENAI_API_KEY": "fake_key"}):
+        assert asyncio.run(collect()) == ["Once", " more"]
+    assert mock_client.chat.completions.create.call_args.kwargs["stream"] is True
+
+def test_stream_story_rejects_unknown_universe():
+    with pytest.raises(ValueError):
+        story_generator.stream_story("Nowhere", "What if?")
+
+@patch('llm_client.OpenAI')
+def test_sync_client_is_shared_and_pooled(mock_openai_class):
+    """Test that the sync client is built once with the tuned pool settings"""
+    from llm_client import LLMClientManager
+
+    manager = LLMClientManager()
+    env = {"OPENAI_API_KEY": "fake_key", "LLM_MAX_CONNECTIONS": "7", "LLM_CONNECT_TIMEOUT": "1.5"}
+    with patch.dict(os.environ, env):
+        first = manager.get()
+        second = manager.get()
+        assert manager.limits().max_connections == 7
+
+    assert first is second
+    mock_openai_class.assert_called_once()
+    kwargs = mock_openai_class.call_args.kwargs
+    assert kwargs["timeout"].connect == 1.5
+    assert kwargs["http_client"] is not None
+
+def test_client_manager_requires_key():
+    from llm_client import LLMClientManager
+
+    with patch.dict(os.environ, {}, clear=True):
+        with pytest.raises(ValueError):
+            LLMClientManager().get()
+
+def test_async_client_reused_within_loop_and_closed():
+    """Test that one async client serves a whole event loop and aclose() closes it"""
+    import asyncio
+    from llm_client import LLMClientManager
+
+    manager = LLMClientManager()
+
+    async def scenario():
+        first = manager.get_async()
+        second = manager.get_async()
+        await manager.aclose()
+        return first, second
+
+    with patch.dict(os.environ, {"OPENAI_API_KEY": "fake_key"}):
+        first, second = asyncio.run(scenario())
+    assert first is second
+    assert first.is_closed()
@@ -0,0 +1,90 @@
+import asyncio
+import json
+import pytest
+from unittest.mock import patch
+from database import Story
+from streaming import relay_story, sse_event
+
+def _parse_events(body: str) -> list:
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+async def _fake_chunks(closed=None):
+    try:
+        for text in ["Once ", "upon ", "a time."]:
+            yield text
+    finally:
+        if closed is not None:
+            closed.append(True)
+
+class _FakeRequest:
+    def __init__(self, disconnect_after):
+        self.calls = 0
+        self.disconnect_after = disconnect_after
+
+    async def is_disconnected(self):
+        self.calls += 1
+        return self.calls > self.disconnect_after
+
+def test_sse_event_format():
+    assert sse_event("token", {"text": "hi"}) == 'event: token\ndata: {"text": "hi"}\n\n'
+
+@patch("main.stream_story")
+def test_stream_endpoint_relays_tokens_and_persists(mock_stream, client, test_db):
+    mock_stream.return_value = _fake_chunks()
+
+    payload = {"universe": "Harry Potter", "what_if": "What if?", "length": "short"}
+    with client.stream("POST", "/story/generate/stream", json=payload) as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        body = "".join(response.iter_text())
+
+    events = _parse_events(body)
+    assert [e for e, _ in events] == ["token", "token", "token", "done"]
+    done = events[-1][1]
+    stored = test_db.query(Story).filter(Story.id == done["id"]).one()
+    assert stored.story == "Once upon a time."
+    assert done["word_count"] == 4
+    assert "story" not in done
+
+def test_stream_endpoint_rejects_unknown_universe(client):
+    payload = {"universe": "Nowhere", "what_if": "What if?"}
+    response = client.post("/story/generate/stream", json=payload)
+    assert response.status_code == 400
+
+@patch("story_generator.stream_story_with_prompt")
+def test_custom_stream_endpoint(mock_stream, client):
+    mock_stream.return_value = _fake_chunks()
+
+    payload = {"universe": "Dune", "what_if": "What if the spice stopped?"}
+    response = client.post("/story/generate-custom/stream", json=payload)
+    events = _parse_events(response.text)
+    assert events[-1][0] == "done"
+    assert events[-1][1]["universe"] == "Dune"
+    assert mock_stream.call_args.kwargs["system_prompt"].startswith("You are an expert in the Dune universe")
+
+def test_disconnect_closes_upstream_without_persisting():
+    closed, persisted = [], []
+
+    async def collect():
+        return [e async for e in relay_story(_FakeRequest(disconnect_after=1), _fake_chunks(closed), persisted.append)]
+
+    events = asyncio.run(collect())
+    assert len(events) == 1
+    assert closed == [True]
+    assert persisted == []
+
+def test_upstream_error_becomes_error_event():
+    async def failing():
+        yield "partial"
+        raise RuntimeError("upstream broke")
+
+    async def collect():
+        return [e async for e in relay_story(_FakeRequest(disconnect_after=10), failing(), lambda text: {})]
+
+    events = asyncio.run(collect())
+    assert events[-1].startswith("event: error")
+    assert "upstream broke" in events[-1]
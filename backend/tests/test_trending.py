@@ -0,0 +1,60 @@
+import pytest
+from database import Story, Rating
+import trending
+
+def _add_story(test_db, universe="U", ratings=(), is_public=True):
+    story = Story(universe=universe, what_if="W", story="S" * 100, word_count=10, is_public=is_public)
+    test_db.add(story)
+    test_db.commit()
+    for i, value in enumerate(ratings):
+        test_db.add(Rating(story_id=story.id, session_id=f"s{i}", rating_value=value))
+    test_db.commit()
+    return story
+
+def test_bayesian_score_prefers_many_good_ratings(test_db):
+    """A single 5-star rating should not outrank many strong ratings"""
+    lone = _add_story(test_db, ratings=[5])
+    popular = _add_story(test_db, ratings=[5, 5, 5, 4, 5, 5, 4, 5])
+    unrated = _add_story(test_db)
+    poor = _add_story(test_db, ratings=[1, 2, 1])
+
+    ids = [s["id"] for s in trending.get_trending(test_db)]
+    assert ids == [popular.id, lone.id, unrated.id, poor.id]
+
+def test_trending_limit_and_universe_filters(test_db):
+    _add_story(test_db, universe="Star Wars", ratings=[5, 5])
+    _add_story(test_db, universe="Star Wars", ratings=[4])
+    _add_story(test_db, universe="DC", ratings=[5, 5, 5])
+    _add_story(test_db, universe="DC", ratings=[5, 5, 5, 5], is_public=False)
+
+    assert len(trending.get_trending(test_db, limit=1)) == 1
+
+    stories = trending.get_trending(test_db, universe="Star Wars")
+    assert [s["universe"] for s in stories] == ["Star Wars", "Star Wars"]
+    assert stories[0]["average_rating"] == 5.0
+    assert stories[0]["rating_count"] == 2
+    assert "story" not in stories[0]
+
+def test_trending_by_universe_matches_per_universe_queries(test_db):
+    for universe, ratings in [("Star Wars", [5, 5]), ("Star Wars", [4]), ("Star Wars", [3]), ("DC", [5]), ("Dune", [])]:
+        _add_story(test_db, universe=universe, ratings=ratings)
+    _add_story(test_db, universe="Hidden", ratings=[5], is_public=False)
+
+    boards = trending.get_trending_by_universe(test_db, limit=2)
+    assert set(boards) == {"Star Wars", "DC", "Dune"}
+    for universe, board in boards.items():
+        assert board == trending.get_trending(test_db, limit=2, universe=universe)
+
+def test_trending_limit_is_clamped():
+    assert trending.clamp_limit(0) == 1
+    assert trending.clamp_limit(10_000) == trending.MAX_LIMIT
+
+def test_trending_endpoint(client, test_db):
+    story = _add_story(test_db, universe="DC", ratings=[4, 5])
+    _add_story(test_db, universe="Naruto", ratings=[5])
+
+    response = client.get("/story/trending", params={"universe": "DC", "limit": 5})
+    assert response.status_code == 200
+    data = response.json()
+    assert [s["id"] for s in data["stories"]] == [story.id]
+    assert data["stories"][0]["average_rating"] == 4.5
@@ -0,0 +1,71 @@
+import asyncio
+import time
+import pytest
+from unittest.mock import patch
+from universe_prompts import UniversePromptStore, universe_key
+
+def test_universe_key_normalizes_names():
+    assert universe_key("  Dune ") == universe_key("dune")
+
+@patch("story_generator.generate_universe_prompt_async")
+def test_prompt_generated_once_then_served_from_store(mock_gen, test_db):
+    mock_gen.return_value = "You are an expert in the Dune universe..."
+    store = UniversePromptStore(lru_size=10, ttl_seconds=60)
+
+    prompt, cached = asyncio.run(store.get_or_generate(test_db, "Dune"))
+    assert not cached
+    prompt_again, cached_again = asyncio.run(store.get_or_generate(test_db, "DUNE"))
+    assert cached_again
+    assert prompt_again == prompt
+    assert mock_gen.call_count == 1
+
+    # A fresh process (empty LRU) still finds it in the table
+    assert UniversePromptStore().get(test_db, "dune") == prompt
+
+    mock_gen.return_value = "Regenerated prompt"
+    prompt, cached = asyncio.run(store.get_or_generate(test_db, "Dune", regenerate=True))
+    assert prompt == "Regenerated prompt"
+    assert store.get(test_db, "Dune") == "Regenerated prompt"
+
+def test_resolve_order(test_db):
+    store = UniversePromptStore(lru_size=10, ttl_seconds=60)
+    assert store.resolve(test_db, "Dune", "Explicit") == "Explicit"
+    assert store.resolve(test_db, "Dune").startswith("You are an expert in the Dune universe")
+    store.save(test_db, "Dune", "Stored")
+    assert store.resolve(test_db, "dune") == "Stored"
+    assert store.invalidate(test_db, "Dune")
+    assert store.get(test_db, "Dune") is None
+    assert not store.invalidate(test_db, "Dune")
+
+def test_other_workers_see_changes_once_their_entry_expires(test_db):
+    worker_a = UniversePromptStore(lru_size=10, ttl_seconds=60)
+    worker_b = UniversePromptStore(lru_size=10, ttl_seconds=60)
+    worker_a.save(test_db, "Dune", "Old")
+    assert worker_b.get(test_db, "Dune") == "Old"
+    worker_a.save(test_db, "Dune", "New")
+    assert worker_b.get(test_db, "Dune") == "Old"
+    with patch("ttl_cache.time.monotonic", return_value=time.monotonic() + 61):
+        assert worker_b.get(test_db, "Dune") == "New"
+        worker_a.invalidate(test_db, "Dune")
+    with patch("ttl_cache.time.monotonic", return_value=time.monotonic() + 122):
+        assert worker_b.get(test_db, "Dune") is None
+
+def test_default_ttl_is_short():
+    assert UniversePromptStore().lru.ttl_seconds <= 60
+
+@patch("story_generator.generate_universe_prompt_async")
+@patch("story_generator.generate_story_with_prompt_async")
+def test_custom_story_uses_stored_prompt(mock_story, mock_prompt, client):
+    mock_prompt.return_value = "Stored Pokemon prompt"
+    mock_story.return_value = "Pikachu story"
+
+    response = client.post("/universe/system-prompt", json={"universe": "Pokemon"})
+    assert response.json()["cached"] is False
+    assert client.post("/universe/system-prompt", json={"universe": "pokemon"}).json()["cached"] is True
+
+    response = client.post("/story/generate-custom", json={"universe": "Pokemon", "what_if": "What if?"})
+    assert response.status_code == 200
+    assert mock_story.call_args.kwargs["system_prompt"] == "Stored Pokemon prompt"
+
+    assert client.delete("/universe/system-prompt/Pokemon").status_code == 200
+    assert client.delete("/universe/system-prompt/Pokemon").status_code == 404
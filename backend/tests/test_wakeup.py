@@ -0,0 +1,35 @@
+import asyncio
+import threading
+import time
+from wakeup import Wakeup
+
+def test_set_before_bind_is_a_no_op():
+    wake = Wakeup()
+    wake.set()
+    assert not wake.bound and not wake.is_set()
+
+def test_set_from_another_thread_ends_the_wait_early():
+    wake = Wakeup()
+
+    async def scenario():
+        wake.bind()
+        threading.Timer(0.05, wake.set).start()
+        started = time.monotonic()
+        await wake.wait(5)
+        assert not wake.is_set()  # reset for the next round
+        return time.monotonic() - started
+
+    assert asyncio.run(scenario()) < 2
+    wake.unbind()
+    assert not wake.bound
+
+def test_wait_times_out_without_a_wakeup():
+    wake = Wakeup()
+
+    async def scenario():
+        wake.bind()
+        started = time.monotonic()
+        await wake.wait(0.05)
+        return time.monotonic() - started
+
+    assert asyncio.run(scenario()) >= 0.04
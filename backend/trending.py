@@ -0,0 +1,73 @@
+"""
+Trending engine: top-K public stories ranked by a Bayesian-weighted score.
+
+The score lives in ``stories.trending_score`` and is kept current by the
+rating aggregate updates in ``database.py``, so ranking is an index walk over
+``ix_stories_public_trending`` / ``ix_stories_universe_trending`` that stops
+after ``limit`` rows. Story bodies are never selected.
+"""
+from typing import Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from database import Story
+import pagination
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+
+# Only the listed columns are read; the `story` text column is never touched
+TRENDING_COLUMNS = (
+    Story.id,
+    Story.universe,
+    Story.what_if,
+    Story.word_count,
+    Story.rating_sum,
+    Story.rating_count,
+    Story.trending_score,
+)
+
+# Best first; the id breaks ties so pages are stable
+TRENDING_ORDER = (
+    Story.trending_score.desc(),
+    Story.rating_count.desc(),
+    Story.id.desc(),
+)
+
+def clamp_limit(limit: Optional[int]) -> int:
+    return pagination.clamp_limit(limit, DEFAULT_LIMIT, MAX_LIMIT)
+
+def trending_query(db: Session, universe: Optional[str] = None):
+    """Build the ordered trending query, optionally scoped to one universe"""
+    query = db.query(*TRENDING_COLUMNS).filter(Story.is_public == True)
+    if universe:
+        query = query.filter(Story.universe == universe)
+    return query.order_by(*TRENDING_ORDER)
+
+def serialize_row(row) -> dict:
+    """Shape a projected trending row like the /story/trending payload"""
+    return {
+        **pagination.summary_fields(row),
+        "score": round(row.trending_score, 3),
+    }
+
+def get_trending(db: Session, limit: Optional[int] = DEFAULT_LIMIT, universe: Optional[str] = None) -> list:
+    """Return the top ``limit`` public stories, best score first"""
+    rows = trending_query(db, universe).limit(clamp_limit(limit)).all()
+    return [serialize_row(row) for row in rows]
+
+def get_trending_by_universe(db: Session, limit: Optional[int] = DEFAULT_LIMIT) -> dict:
+    """Top ``limit`` public stories of every universe that has one, in one windowed query"""
+    rank = func.row_number().over(partition_by=Story.universe, order_by=TRENDING_ORDER).label("rank")
+    ranked = db.query(*TRENDING_COLUMNS, rank).filter(Story.is_public == True).subquery()
+    rows = (
+        db.query(ranked)
+        .filter(ranked.c.rank <= clamp_limit(limit), ranked.c.universe.isnot(None))
+        .order_by(ranked.c.universe, ranked.c.rank)
+        .all()
+    )
+    boards = {}
+    for row in rows:
+        boards.setdefault(row.universe, []).append(serialize_row(row))
+    return boards
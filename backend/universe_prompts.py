@@ -0,0 +1,95 @@
+"""
+Persistent cache of generated system prompts for custom universes.
+
+Prompts are stored in ``universe_prompts`` keyed on the normalized universe
+name and kept hot in an in-process LRU, so "Dune" costs one LLM round-trip
+ever rather than one per request. Prompts can be regenerated or dropped
+explicitly; other workers only notice when their LRU entry expires, so the
+LRU's TTL is kept short.
+"""
+import asyncio
+import os
+from typing import Optional
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from database import UniversePrompt
+from generation_cache import normalize_text
+from ttl_cache import TTLCache
+from metrics import record_cache
+import story_generator
+from llm_scheduler import llm_scheduler, SYSTEM_PROMPT
+
+def universe_key(universe: str) -> str:
+    """Normalized lookup key for a universe name"""
+    return normalize_text(universe)
+
+class UniversePromptStore:
+    """Database-backed universe prompt cache with an LRU in front"""
+
+    def __init__(self, lru_size: int = None, ttl_seconds: float = None):
+        self.lru = TTLCache(
+            max_size=lru_size if lru_size is not None else int(os.getenv("UNIVERSE_PROMPT_CACHE_SIZE", "512")),
+            ttl_seconds=ttl_seconds if ttl_seconds is not None else float(os.getenv("UNIVERSE_PROMPT_CACHE_TTL_SECONDS", "60"))
+        )
+
+    def get(self, db: Session, universe: str) -> Optional[str]:
+        """Return the stored prompt for ``universe``, or None"""
+        key = universe_key(universe)
+        prompt = self.lru.get(key)
+        record_cache("universe_prompt", hit=prompt is not None)
+        if prompt is None:
+            row = db.query(UniversePrompt.system_prompt).filter(UniversePrompt.universe_key == key).first()
+            if row is None:
+                return None
+            prompt = row.system_prompt
+            self.lru.set(key, prompt)
+        return prompt
+
+    def save(self, db: Session, universe: str, system_prompt: str):
+        """Insert or replace the stored prompt for ``universe``"""
+        key = universe_key(universe)
+        for _ in range(2):
+            row = db.query(UniversePrompt).filter(UniversePrompt.universe_key == key).first()
+            if row is None:
+                db.add(UniversePrompt(universe_key=key, universe=universe, system_prompt=system_prompt))
+            else:
+                row.system_prompt = system_prompt
+            try:
+                db.commit()
+                break
+            except IntegrityError:
+                # Another request stored this universe first; update its row instead
+                db.rollback()
+        self.lru.set(key, system_prompt)
+
+    def invalidate(self, db: Session, universe: str) -> bool:
+        """Forget the stored prompt; returns whether one existed"""
+        key = universe_key(universe)
+        self.lru.invalidate(key)
+        deleted = db.query(UniversePrompt).filter(UniversePrompt.universe_key == key).delete()
+        db.commit()
+        return deleted > 0
+
+    def resolve(self, db: Session, universe: str, system_prompt: Optional[str] = None) -> str:
+        """Prompt to use for a custom story: explicit, then stored, then the generic default"""
+        if system_prompt:
+            return system_prompt
+        return self.get(db, universe) or story_generator.default_system_prompt(universe)
+
+    async def get_or_generate(self, db: Session, universe: str, regenerate: bool = False, session: str = "anonymous"):
+        """Return ``(prompt, cached)``, calling the model only on a miss or when asked to.
+
+        The model call waits for an LLM scheduler slot on behalf of ``session``.
+        """
+        if not regenerate:
+            prompt = await asyncio.to_thread(self.get, db, universe)
+            if prompt is not None:
+                return prompt, True
+        async with llm_scheduler.slot(session, SYSTEM_PROMPT):
+            prompt = await story_generator.generate_universe_prompt_async(universe)
+        await asyncio.to_thread(self.save, db, universe, prompt)
+        return prompt, False
+
+universe_prompts = UniversePromptStore()
@@ -0,0 +1,47 @@
+"""
+Wake-up signal shared by the background loops (rating flusher, job
+workers, leaderboard refresher): each sleeps for an interval unless a
+request handler pokes it sooner.
+"""
+import asyncio
+
+class Wakeup:
+    """An asyncio event that threadpool endpoints can set on the loop that waits for it"""
+
+    def __init__(self):
+        self._loop = None
+        self._event = None
+
+    def bind(self):
+        """Attach to the running event loop; until then (and after unbind) set() is a no-op"""
+        self._loop = asyncio.get_running_loop()
+        self._event = asyncio.Event()
+
+    def unbind(self):
+        self._loop = None
+        self._event = None
+
+    @property
+    def bound(self) -> bool:
+        return self._event is not None
+
+    def set(self):
+        """Wake the waiting loop early; safe to call from any thread"""
+        loop, event = self._loop, self._event
+        if loop is not None and event is not None:
+            loop.call_soon_threadsafe(event.set)
+
+    def is_set(self) -> bool:
+        return self._event is not None and self._event.is_set()
+
+    async def wait(self, timeout: float):
+        """Sleep until woken or ``timeout`` seconds have passed, then reset"""
+        event = self._event
+        # asyncio.wait rather than wait_for: on 3.11 wait_for can swallow
+        # a cancel that races with the wake-up and keep the task alive
+        waiter = asyncio.ensure_future(event.wait())
+        try:
+            await asyncio.wait({waiter}, timeout=timeout)
+        finally:
+            waiter.cancel()
+        event.clear()